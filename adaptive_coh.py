@@ -0,0 +1,311 @@
+from collections import OrderedDict, Counter
+from lru_cache import LRUCache
+from atomics import AtomicOps
+from coherence_bus import LINE_SIZE, REGION_SIZE
+from dragon_coh import UpdateBus, MESSAGE_HEADER_BYTES
+from event_log import (LOG, FETCH, INVALIDATE, MIGRATE, READ_HIT, READ_MISS, RECLASSIFY, SUPPLY, UPDATE, WRITE,
+                       WRITE_HIT, WRITE_MISS)
+
+SHARING_CLASSES = ["private", "read_mostly", "migratory", "producer_consumer"]
+SCORE_LIMIT = 3  # Saturating counters give each line some hysteresis
+SCORE_THRESHOLD = 2
+
+
+# Per-line sharing history used to pick a protocol for that line
+class LineProfile:
+    def __init__(self):
+        self.sharing_class = "private"
+        self.vms = set()
+        self.last_writer = None
+        self.readers_since_write = set()
+        self.migratory_score = 0
+        self.producer_score = 0
+
+    def observe(self, vm_id, op):
+        self.vms.add(vm_id)
+        if op == "A":
+            # An atomic reads the line and writes it back in one go
+            self.readers_since_write.add(vm_id)
+        elif op == "R":
+            self.readers_since_write.add(vm_id)
+            return
+        other_readers = self.readers_since_write - {vm_id}
+        if self.last_writer is not None and self.last_writer != vm_id and vm_id in self.readers_since_write \
+                and not other_readers:
+            # Read-then-write by a new VM: the line is moving between VMs
+            self.migratory_score = min(self.migratory_score + 1, SCORE_LIMIT)
+            self.producer_score = max(self.producer_score - 1, 0)
+        elif self.last_writer == vm_id and other_readers:
+            # Same writer, other VMs consumed the previous value
+            self.producer_score = min(self.producer_score + 1, SCORE_LIMIT)
+            self.migratory_score = max(self.migratory_score - 1, 0)
+        elif self.last_writer == vm_id:
+            # Write burst with no consumers in between: updates would be wasted
+            self.producer_score = max(self.producer_score - 1, 0)
+        self.last_writer = vm_id
+        self.readers_since_write = set()
+
+    def classify(self):
+        if len(self.vms) == 1:
+            return "private"
+        if self.migratory_score >= SCORE_THRESHOLD:
+            return "migratory"
+        if self.producer_score >= SCORE_THRESHOLD:
+            return "producer_consumer"
+        return "read_mostly"
+
+
+# Shared bus that also holds the per-line classification
+class AdaptiveBus(UpdateBus):
+    def __init__(self, policy="adaptive", line_size=LINE_SIZE, region_size=REGION_SIZE):
+        super().__init__(line_size, region_size)
+        self.policy = policy  # "adaptive", or "invalidate"/"update" to pin every line for comparison
+        self.profiles = {}
+        self.transitions = Counter()
+        self.class_stats = OrderedDict(
+            (name, OrderedDict([("accesses", 0), ("misses", 0), ("invalidations", 0), ("updates", 0),
+                                ("migratory_handoffs", 0)]))
+            for name in SHARING_CLASSES)
+
+    def observe(self, vm_id, address, op):
+        """
+        Update the line's profile and return its (possibly new) sharing class.
+        """
+        profile = self.profiles.get(address)
+        if profile is None:
+            profile = self.profiles[address] = LineProfile()
+        profile.observe(vm_id, op)
+        sharing_class = profile.classify()
+        if sharing_class != profile.sharing_class:
+            self.transitions[f"{profile.sharing_class}->{sharing_class}"] += 1
+            LOG.emit(RECLASSIFY, vm_id, address, (profile.sharing_class, sharing_class))
+            profile.sharing_class = sharing_class
+        self.class_stats[sharing_class]["accesses"] += 1
+        return sharing_class
+
+    def handling(self, sharing_class):
+        if self.policy == "invalidate":
+            return "invalidate"
+        if self.policy == "update":
+            return "update"
+        if sharing_class == "producer_consumer":
+            return "update"
+        if sharing_class == "migratory":
+            return "migratory"
+        return "invalidate"
+
+    def report(self):
+        report = OrderedDict()
+        report["policy"] = self.policy
+        report["traffic"] = OrderedDict(self.traffic)
+        report["transitions"] = OrderedDict(sorted(self.transitions.items()))
+        report["classes"] = self.class_stats
+        report["lines"] = Counter(profile.sharing_class for profile in self.profiles.values())
+        return report
+
+
+# Adaptive Coherence: MOESI states, with each line handled by invalidate, update or migratory rules
+class AdaptiveCoherence(AtomicOps):
+    def __init__(self, vm_id, bus, cache_size=2):
+        self.vm_id = vm_id
+        self.bus = bus
+        self.lru_cache = LRUCache(cache_size, on_evict=self._evict, line_size=bus.line_size)
+        self.bus.attach(vm_id, self.lru_cache, f"adaptive-{bus.policy}")
+
+    def _evict(self, address, line):
+        self.bus.drop(self.vm_id, address)
+        self.bus.back_invalidate(self.vm_id, address)
+        if line[1] in ["M", "O"]:
+            self.bus.traffic["writebacks"] += 1
+            self.bus.stats.writeback(self.vm_id)
+            self.bus.write_memory(self.vm_id, address, line[0])
+
+    def _fill(self, address, data, state):
+        if address in self.lru_cache.cache:
+            self.lru_cache.total_count += 1
+            self.lru_cache.miss_count += 1
+            self.lru_cache.cache.move_to_end(address)
+            self.lru_cache.cache[address] = [data, state]
+        else:
+            self.lru_cache.access(address, [data, state])
+
+    def _sharers(self, address):
+        sharers = []
+        for peer_id, cache in self.bus.peers(self.vm_id):
+            line = cache.cache.get(address)
+            if line is not None and line[1] != "I":
+                sharers.append((peer_id, line))
+        return sharers
+
+    def read(self, address):
+        address &= self.bus.line_mask
+        sharing_class = self.bus.observe(self.vm_id, address, "R")
+        stats = self.bus.class_stats[sharing_class]
+        line = self.lru_cache.cache.get(address)
+        if line is not None and line[1] != "I":
+            self.lru_cache.access(address)
+            self.bus.consume(self.vm_id, address)
+            self.bus.stats.hit(self.vm_id, "read", line[1])
+            LOG.emit(READ_HIT, self.vm_id, address, line[1])
+            return self.bus.line(line[0])
+
+        LOG.emit(READ_MISS, self.vm_id, address)
+        self.bus.stats.miss(self.vm_id, "read", "-" if line is None else line[1])
+        stats["misses"] += 1
+        sharers = self._sharers(address)
+        owner = next(((peer_id, peer_line) for peer_id, peer_line in sharers
+                      if peer_line[1] in ["M", "O", "E"]), None)
+        handling = self.bus.handling(sharing_class)
+
+        if owner is not None and handling == "migratory" and owner[1][1] in ["M", "E"]:
+            # Hand the line over exclusively so the write that follows needs no upgrade
+            peer_id, peer_line = owner
+            data, state = peer_line[0], peer_line[1]
+            peer_line[1] = "I"
+            self.bus.back_invalidate(peer_id, address)
+            self.bus.traffic["cache_to_cache"] += 1
+            self.bus.traffic["invalidations"] += 1
+            self.bus.stats.transfer(peer_id, self.vm_id, address)
+            self.bus.stats.invalidation(self.vm_id, peer_id, address)
+            stats["migratory_handoffs"] += 1
+            LOG.emit(MIGRATE, self.vm_id, address, peer=peer_id)
+        elif owner is not None:
+            peer_id, peer_line = owner
+            data = peer_line[0]
+            peer_line[1] = "O" if peer_line[1] in ["M", "O"] else "S"
+            state = "S"
+            self.bus.traffic["cache_to_cache"] += 1
+            self.bus.stats.transfer(peer_id, self.vm_id, address)
+            LOG.emit(SUPPLY, self.vm_id, address, peer=peer_id)
+        else:
+            data = self.bus.read_memory(self.vm_id, address)
+            state = "S" if sharers else "E"
+
+        self._fill(address, data, state)
+        LOG.emit(FETCH, self.vm_id, address, state)
+        return self.bus.line(data)
+
+    def write(self, address, data):
+        address &= self.bus.line_mask
+        sharing_class = self.bus.observe(self.vm_id, address, "W")
+        stats = self.bus.class_stats[sharing_class]
+        line = self.lru_cache.cache.get(address)
+        if line is not None and line[1] in ["M", "E"]:
+            self.lru_cache.access(address)
+            self.lru_cache.cache[address] = [data, "M"]
+            self.bus.stats.hit(self.vm_id, "write", line[1])
+            LOG.emit(WRITE_HIT, self.vm_id, address, line[1])
+            return
+
+        if line is not None and line[1] != "I":
+            self.bus.traffic["upgrades"] += 1
+            self.bus.stats.upgrade(self.vm_id, address)
+            self.lru_cache.access(address)
+        else:
+            LOG.emit(WRITE_MISS, self.vm_id, address)
+            self.bus.stats.miss(self.vm_id, "write", "-" if line is None else line[1])
+            stats["misses"] += 1
+
+        sharers = self._sharers(address)
+        if sharers and self.bus.handling(sharing_class) == "update":
+            self.update_sharers(address, data, sharers, stats)
+            self._fill(address, data, "O")
+            LOG.emit(WRITE, self.vm_id, address, "OWNED")
+            return
+
+        self.invalidate_sharers(address, sharers, stats)
+        self._fill(address, data, "M")
+        LOG.emit(WRITE, self.vm_id, address, "MODIFIED")
+
+    def invalidate_sharers(self, address, sharers, stats):
+        for peer_id, peer_line in sharers:
+            peer_line[1] = "I"
+            self.bus.back_invalidate(peer_id, address)
+            self.bus.traffic["invalidations"] += 1
+            self.bus.stats.invalidation(self.vm_id, peer_id, address)
+            stats["invalidations"] += 1
+            LOG.emit(INVALIDATE, self.vm_id, address, peer=peer_id)
+
+    def _own(self, address, op):
+        """
+        Read for ownership. Atomics always invalidate, whatever the line's class: an update
+        would let sharers read the line while the read-modify-write is still in flight.
+        """
+        sharing_class = self.bus.observe(self.vm_id, address, "A")
+        stats = self.bus.class_stats[sharing_class]
+        line = self.lru_cache.cache.get(address)
+        if line is not None and line[1] in ["M", "E"]:
+            self.lru_cache.access(address)
+            self.bus.stats.hit(self.vm_id, op, line[1])
+            line[1] = "M"
+            return line
+
+        sharers = self._sharers(address)
+        if line is not None and line[1] != "I":
+            # S or O: the local copy is current, only the other copies have to go
+            self.bus.traffic["upgrades"] += 1
+            self.bus.stats.upgrade(self.vm_id, address)
+            self.lru_cache.access(address)
+            line[1] = "M"
+        else:
+            self.bus.stats.miss(self.vm_id, op, "-" if line is None else line[1])
+            stats["misses"] += 1
+            owner = next(((peer_id, peer_line) for peer_id, peer_line in sharers
+                          if peer_line[1] in ["M", "O", "E"]), None)
+            if owner is not None:
+                peer_id, peer_line = owner
+                data = peer_line[0]
+                self.bus.traffic["cache_to_cache"] += 1
+                self.bus.stats.transfer(peer_id, self.vm_id, address)
+                LOG.emit(SUPPLY, self.vm_id, address, peer=peer_id)
+            else:
+                data = self.bus.read_memory(self.vm_id, address)
+            self._fill(address, data, "M")
+            line = self.lru_cache.cache[address]
+        self.invalidate_sharers(address, sharers, stats)
+        return line
+
+    def update_sharers(self, address, data, sharers, stats):
+        payload = len(data)
+        self.bus.traffic["updates"] += 1
+        stats["updates"] += 1
+        for peer_id, peer_line in sharers:
+            peer_line[0] = data
+            peer_line[1] = "S"
+            self.bus.traffic["update_deliveries"] += 1
+            self.bus.traffic["update_bytes"] += MESSAGE_HEADER_BYTES + payload
+            self.bus.deliver_update(peer_id, address)
+            self.bus.stats.update(self.vm_id, peer_id, address, MESSAGE_HEADER_BYTES + payload)
+            LOG.emit(UPDATE, self.vm_id, address, peer=peer_id)
+
+
+# Test Scenarios: one private, one migratory and one producer/consumer line
+def run_mixed_workload(policy, rounds=6):
+    bus = AdaptiveBus(policy)
+    vms = [AdaptiveCoherence(vm_id, bus, cache_size=4) for vm_id in range(1, 4)]
+    for address in [0xA00, 0xB00, 0xC00]:
+        bus.store(address, b"Data")
+
+    for round_number in range(rounds):
+        vms[0].write(0xA00, f"Private{round_number}".encode())
+        vms[0].read(0xA00)
+
+        mover = vms[round_number % len(vms)]
+        mover.read(0xB00)
+        mover.write(0xB00, f"Moved{round_number}".encode())
+
+        vms[0].write(0xC00, f"Value{round_number}".encode())
+        vms[1].read(0xC00)
+        vms[2].read(0xC00)
+    return bus
+
+
+if __name__ == "__main__":
+    reports = [run_mixed_workload(policy).report() for policy in ["invalidate", "update", "adaptive"]]
+    for report in reports:
+        print(f"\n--- Policy: {report['policy']} ---")
+        for key, value in report["traffic"].items():
+            print(f"{key}: {value}")
+        print(f"transitions: {dict(report['transitions'])}")
+        for name, stats in report["classes"].items():
+            print(f"{name}: {dict(stats)}")
@@ -0,0 +1,136 @@
+import struct
+import sys
+from event_log import LOG, ATOMIC
+
+COUNTER = struct.Struct("<q")  # fetch_and_add treats the first 8 bytes of a line as a signed integer
+
+
+def counter_value(data):
+    return COUNTER.unpack(bytes(data[:COUNTER.size]).ljust(COUNTER.size, b"\0"))[0]
+
+
+def counter_bytes(value):
+    return COUNTER.pack(value)
+
+
+# Atomic read-modify-write ops for engines that can take a line in M with its data (_own)
+# The whole operation is one coherence transaction: no other VM can act on the line in between.
+class AtomicOps:
+    def _atomic(self, address, op, function):
+        address &= self.bus.line_mask
+        line = self._own(address, op)
+        old = self.bus.line(line[0])
+        line[0] = function(old)
+        LOG.emit(ATOMIC, self.vm_id, address, op)
+        return old
+
+    def compare_and_swap(self, address, expected, data):
+        """
+        Store data if the line holds expected. Returns (swapped, value the line held).
+        """
+        old = self._atomic(address, "cas",
+                           lambda old: data if self.bus.line(old) == self.bus.line(expected) else old)
+        return self.bus.line(old) == self.bus.line(expected), old
+
+    def fetch_and_add(self, address, delta=1):
+        """
+        Add delta to the line's counter and return the counter's previous value.
+        """
+        old = self._atomic(address, "fetch_add", lambda old: counter_bytes(counter_value(old) + delta))
+        return counter_value(old)
+
+    def swap(self, address, data):
+        return self._atomic(address, "swap", lambda old: data)
+
+
+LINK_MESSAGES = ["device_reads", "device_writes", "cache_to_cache", "invalidations", "upgrades", "updates"]
+
+
+def link_messages(bus):
+    return sum(bus.traffic.get(name, 0) for name in LINK_MESSAGES)
+
+
+# Test Scenarios: a shared counter, then a spinlock, contended by every VM
+def run_counter(engine, mode, vm_count=4, rounds=100):
+    """
+    mode is "interleaved" (every VM reads, then every VM writes), "read_write" (each VM reads then writes
+    back to back) or "atomic" (fetch_and_add). Returns (final count, bus).
+    """
+    bus, agents = engine(vm_count)
+    counter = 0x1000
+    for _ in range(rounds):
+        if mode == "interleaved":
+            values = [counter_value(agent.read(counter)) for agent in agents]
+            for agent, value in zip(agents, values):
+                agent.write(counter, counter_bytes(value + 1))
+        elif mode == "read_write":
+            for agent in agents:
+                agent.write(counter, counter_bytes(counter_value(agent.read(counter)) + 1))
+        else:
+            for agent in agents:
+                agent.fetch_and_add(counter)
+    return counter_value(agents[0].read(counter)), bus
+
+
+def run_spinlock(engine, test_first, vm_count=4, acquisitions=25, critical_steps=4):
+    """
+    Round-robin scheduler: each step, every VM either spins on the lock, works in its critical
+    section or releases. With test_first, a waiter reads the lock and only tries CAS once it looks free.
+    Returns (acquisitions, bus).
+    """
+    bus, agents = engine(vm_count)
+    lock, data = 0x2000, 0x2040
+    free = counter_bytes(0)
+    remaining = {agent.vm_id: acquisitions for agent in agents}
+    held = {}  # vm_id -> critical section steps left
+    acquired = 0
+    while any(remaining.values()):
+        for agent in agents:
+            if not remaining[agent.vm_id]:
+                continue
+            steps = held.get(agent.vm_id)
+            if steps is None:
+                if test_first and counter_value(agent.read(lock)) != 0:
+                    continue
+                swapped, _ = agent.compare_and_swap(lock, free, counter_bytes(agent.vm_id))
+                if swapped:
+                    held[agent.vm_id] = critical_steps
+                    acquired += 1
+            elif steps:
+                agent.fetch_and_add(data)
+                held[agent.vm_id] = steps - 1
+            else:
+                agent.swap(lock, free)
+                del held[agent.vm_id]
+                remaining[agent.vm_id] -= 1
+    return acquired, bus
+
+
+def _mesif(vm_count):
+    from coherence_bus import CoherenceBus
+    from mesif_coh import MESIFCoherence
+    bus = CoherenceBus()
+    return bus, [MESIFCoherence(vm_id, bus, cache_size=4) for vm_id in range(1, vm_count + 1)]
+
+
+def _adaptive(vm_count):
+    from adaptive_coh import AdaptiveBus, AdaptiveCoherence
+    bus = AdaptiveBus()
+    return bus, [AdaptiveCoherence(vm_id, bus, cache_size=4) for vm_id in range(1, vm_count + 1)]
+
+
+if __name__ == "__main__":
+    vm_count = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    rounds = 100
+    for name, engine in [("mesif", _mesif), ("adaptive", _adaptive)]:
+        print(f"\n--- {name}: shared counter, {vm_count} VMs x {rounds} increments ---")
+        for mode in ["interleaved", "read_write", "atomic"]:
+            count, bus = run_counter(engine, mode, vm_count, rounds)
+            print(f"{mode:<12} count={count:<5} link messages={link_messages(bus):<5} "
+                  f"per increment={link_messages(bus) / (vm_count * rounds):.2f}")
+
+        print(f"\n--- {name}: spinlock ---")
+        for label, test_first in [("test-and-set", False), ("test-and-test-and-set", True)]:
+            acquired, bus = run_spinlock(engine, test_first, vm_count)
+            print(f"{label:<22} acquisitions={acquired} link messages={link_messages(bus):<5} "
+                  f"per acquisition={link_messages(bus) / acquired:.1f}")
@@ -0,0 +1,178 @@
+import os
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from lru_cache import LRUCache
+
+INCLUSION_POLICIES = ["inclusive", "exclusive", "nine"]  # NINE: non-inclusive, non-exclusive
+CXL_LATENCY_NS = 250.0  # Anything the coherence engine had to fetch or announce over the link
+# (name, lines, lookup latency in ns); the LLC stands in for a local-DRAM cache of the shared region
+DEFAULT_LEVELS = [("L1", 64, 1.0), ("L2", 512, 4.0), ("LLC", 4096, 80.0)]
+
+
+def required_capacity(levels=DEFAULT_LEVELS):
+    """
+    Lines the engine's coherent cache needs under these levels: every line the private levels can hold
+    at once, plus the invalid lines the engines keep, so its own LRU never forces evictions the levels
+    never made.
+    """
+    return 2 * sum(lines for _, lines, _ in levels)
+
+
+# Private L1/L2/LLC tag stores in front of one VM's coherence engine
+# The engine's cache is the coherence point: every line held in any level is valid there,
+# and a line the engine invalidates or evicts is back-invalidated out of every level.
+class CacheHierarchy:
+    def __init__(self, engine, levels=DEFAULT_LEVELS, inclusion="inclusive", remote_ns=CXL_LATENCY_NS):
+        if inclusion not in INCLUSION_POLICIES:
+            raise ValueError(f"Inclusion policy must be one of {INCLUSION_POLICIES}, got {inclusion}.")
+        required = required_capacity(levels)
+        if engine.lru_cache.capacity < required:
+            raise ValueError(f"VM{engine.vm_id}'s cache holds {engine.lru_cache.capacity} lines but these levels "
+                             f"need {required}; create the engine with cache_size={required}.")
+        self.engine = engine
+        self.vm_id = engine.vm_id
+        self.bus = engine.bus
+        self.lru_cache = engine.lru_cache
+        self.inclusion = inclusion
+        self.remote_ns = remote_ns
+        self.names = [name for name, _, _ in levels]
+        self.latencies = [latency for _, _, latency in levels]
+        self.levels = [LRUCache(lines, on_evict=lambda address, _, index=index: self._evicted(index, address),
+                                line_size=self.bus.line_size)
+                       for index, (_, lines, _) in enumerate(levels)]
+        self.bus.hierarchies[self.vm_id] = self
+        self.stats = OrderedDict([("accesses", 0)] + [(name, 0) for name in self.names]
+                                 + [("remote", 0), ("back_invalidations", 0)])
+
+    def _level_of(self, address):
+        for index, level in enumerate(self.levels):
+            if address in level.cache:
+                return index
+        return None
+
+    def _traffic(self):
+        return sum(self.bus.traffic.values())
+
+    def _insert(self, index, address):
+        if index < len(self.levels):
+            self.levels[index].access(address)
+
+    def _evicted(self, index, address):
+        if self.inclusion == "inclusive":
+            for level in self.levels[:index]:
+                level.cache.pop(address, None)
+        elif self.inclusion == "exclusive":
+            # Victims move outward instead of being dropped
+            if index + 1 < len(self.levels):
+                self._insert(index + 1, address)
+                return
+        if self._level_of(address) is None:
+            line = self.lru_cache.cache.pop(address, None)
+            if line is not None:
+                self.engine._evict(address, line)
+
+    def drop(self, address):
+        """
+        Back-invalidation from the coherence engine.
+        """
+        held = False
+        for level in self.levels:
+            if address in level.cache:
+                del level.cache[address]
+                held = True
+        if held:
+            self.stats["back_invalidations"] += 1
+
+    def _fill(self, found, address):
+        """
+        Place a line after an access served by level `found` (None for the shared region).
+        """
+        if self.inclusion == "exclusive":
+            if found is not None:
+                del self.levels[found].cache[address]
+            self._insert(0, address)
+            return
+        outermost = len(self.levels) if found is None else found
+        # Outer levels first, so an inclusive victim never back-invalidates the line being filled
+        for index in reversed(range(outermost)):
+            self._insert(index, address)
+        if found is not None:
+            self.levels[found].access(address)
+
+    def _access(self, address, operation):
+        line = self.lru_cache.cache.get(address)
+        found = self._level_of(address) if line is not None and line[1] != "I" else None
+        before = self._traffic()
+        result = operation()
+        if self._traffic() != before or found is None:
+            # The engine went to a peer or the device, or had to tell peers about a write
+            self.stats["remote"] += 1
+            self._fill(None if self._traffic() != before else found, address)
+        else:
+            self.stats[self.names[found]] += 1
+            self._fill(found, address)
+        self.stats["accesses"] += 1
+        return result
+
+    def read(self, address):
+        address &= self.bus.line_mask
+        return self._access(address, lambda: self.engine.read(address))
+
+    def write(self, address, data):
+        address &= self.bus.line_mask
+        return self._access(address, lambda: self.engine.write(address, data))
+
+    def report(self):
+        """
+        Local hit rate of each level (hits / accesses that reached it) and average memory access time.
+        """
+        report = OrderedDict()
+        reaching = self.stats["accesses"]
+        total_ns = 0.0
+        lookup_ns = 0.0
+        for name, latency in zip(self.names, self.latencies):
+            lookup_ns += latency
+            hits = self.stats[name]
+            report[f"{name}_hit_rate"] = hits / reaching if reaching else 0.0
+            total_ns += hits * lookup_ns
+            reaching -= hits
+        total_ns += self.stats["remote"] * (lookup_ns + self.remote_ns)
+        report["remote_rate"] = self.stats["remote"] / self.stats["accesses"] if self.stats["accesses"] else 0.0
+        report["amat_ns"] = total_ns / self.stats["accesses"] if self.stats["accesses"] else 0.0
+        report["back_invalidations"] = self.stats["back_invalidations"]
+        return report
+
+
+def combined_report(hierarchies):
+    """
+    Merge per-VM counters into one report for the whole system.
+    """
+    first = hierarchies[0]
+    merged = CacheHierarchy.__new__(CacheHierarchy)
+    merged.names, merged.latencies, merged.remote_ns = first.names, first.latencies, first.remote_ns
+    merged.stats = OrderedDict((key, sum(hierarchy.stats[key] for hierarchy in hierarchies)) for key in first.stats)
+    return merged.report()
+
+
+# Benchmark: how much private caching hides the CXL round trip on a zipfian hot set
+if __name__ == "__main__":
+    from coherence_bus import CoherenceBus
+    from mesif_coh import MESIFCoherence
+    from workloads import drive, zipfian
+
+    configurations = [
+        ("L1", DEFAULT_LEVELS[:1]),
+        ("L1+L2", DEFAULT_LEVELS[:2]),
+        ("L1+L2+LLC", DEFAULT_LEVELS),
+    ]
+    for label, levels in configurations:
+        for inclusion in INCLUSION_POLICIES:
+            bus = CoherenceBus()
+            agents = {vm_id: CacheHierarchy(MESIFCoherence(vm_id, bus, required_capacity(levels)), levels, inclusion)
+                      for vm_id in range(1, 5)}
+            with open(os.devnull, "w") as quiet, redirect_stdout(quiet):
+                drive(agents, zipfian(40000, lines=8192, write_fraction=0.1, seed=42))
+            report = combined_report(list(agents.values()))
+            rates = " ".join(f"{name}={report[f'{name}_hit_rate']:.3f}" for name, _, _ in levels)
+            print(f"{label:<10} {inclusion:<9} {rates:<36} remote={report['remote_rate']:.3f} "
+                  f"AMAT={report['amat_ns']:.1f} ns back-invalidations={report['back_invalidations']}")
@@ -0,0 +1,221 @@
+import argparse
+import gc
+import os
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from coherence_bus import CoherenceBus
+from mesif_coh import MESIFCoherence
+from dragon_coh import UpdateBus, DragonCoherence
+from adaptive_coh import AdaptiveBus, AdaptiveCoherence
+from protocol_table import MOESI, TableCoherence
+from dax_mapping import DAXMapping, HUGE_PAGE_SIZE
+
+# Request: op, vm_id, request_id, address, payload length, then payload
+REQUEST = struct.Struct("<BBIQI")
+# Response: request_id, status, payload length, then payload
+RESPONSE = struct.Struct("<IBI")
+OP_READ = 0
+OP_WRITE = 1
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+PROTOCOLS = {
+    "mesi": (CoherenceBus, lambda vm_id, bus, cache_size: MESIFCoherence(vm_id, bus, cache_size, forwarding=False)),
+    "mesif": (CoherenceBus, MESIFCoherence),
+    "dragon": (UpdateBus, DragonCoherence),
+    "adaptive": (AdaptiveBus, AdaptiveCoherence),
+    "moesi": (CoherenceBus, lambda vm_id, bus, cache_size: TableCoherence(vm_id, bus, cache_size, MOESI)),
+}
+
+
+# Resident agents: caches, bus and device mapping stay warm between requests
+# One daemon hosts the agents of every VM on the host, and they snoop each other through the
+# in-process bus. There is no daemon per VM and no channel between daemons: VMs on different
+# hosts, or in different daemons, do not see each other's caches.
+class CoherenceDaemon(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, protocol="mesif", vm_ids=(1, 2), cache_size=2, device=None):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, AgentRequestHandler)
+        bus_class, agent_class = PROTOCOLS[protocol]
+        self.bus = bus_class()
+        self.mapping = None
+        if device is not None:
+            # The shared region is the device itself, mapped once for the daemon's lifetime
+            size = -(-len(self.bus.memory) // HUGE_PAGE_SIZE) * HUGE_PAGE_SIZE
+            self.mapping = DAXMapping(device, window_size=size)
+            window, _ = self.mapping.window(0)
+            self.bus.memory = memoryview(window)[:len(self.bus.memory)]
+        self.agents = {vm_id: agent_class(vm_id, self.bus, cache_size) for vm_id in vm_ids}
+        self.lock = threading.Lock()  # Agents share the bus, so requests are applied one at a time
+
+    def execute(self, op, vm_id, address, payload):
+        agent = self.agents[vm_id]
+        with self.lock:
+            if op == OP_READ:
+                return agent.read(address)  # Always a full line, copied out of the region
+            agent.write(address, payload)
+            return b""
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        if self.mapping is not None:
+            # Cached lines are views into the mapping; they must be gone before it can be unmapped
+            self.agents = self.bus = None
+            gc.collect()
+            self.mapping.close()
+            self.mapping = None
+
+
+class AgentRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        """
+        Decode every complete frame in the buffer, then answer them with one send.
+        Clients may pipeline any number of requests without waiting for responses.
+        """
+        buffer = bytearray()
+        while True:
+            chunk = self.request.recv(65536)
+            if not chunk:
+                return
+            buffer += chunk
+            responses = []
+            offset = 0
+            while len(buffer) - offset >= REQUEST.size:
+                op, vm_id, request_id, address, length = REQUEST.unpack_from(buffer, offset)
+                end = offset + REQUEST.size + length
+                if len(buffer) < end:
+                    break
+                payload = bytes(buffer[offset + REQUEST.size:end])
+                try:
+                    result = self.server.execute(op, vm_id, address, payload)
+                    status = STATUS_OK
+                except Exception as e:
+                    result = str(e).encode("utf-8")
+                    status = STATUS_ERROR
+                responses.append(RESPONSE.pack(request_id, status, len(result)) + result)
+                offset = end
+            del buffer[:offset]
+            if responses:
+                self.request.sendall(b"".join(responses))
+
+
+# Client side of the daemon socket
+class CoherenceClient:
+    def __init__(self, socket_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.buffer = bytearray()
+        self.next_id = 0
+
+    def _frame(self, op, vm_id, address, payload=b""):
+        self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+        if isinstance(address, str):
+            # Hex text from the command line is converted here and nowhere else
+            address = int(address, 16)
+        return REQUEST.pack(op, vm_id, self.next_id, address, len(payload)) + payload
+
+    def _receive(self):
+        while True:
+            if len(self.buffer) >= RESPONSE.size:
+                request_id, status, length = RESPONSE.unpack_from(self.buffer)
+                end = RESPONSE.size + length
+                if len(self.buffer) >= end:
+                    payload = bytes(self.buffer[RESPONSE.size:end])
+                    del self.buffer[:end]
+                    if status != STATUS_OK:
+                        raise RuntimeError(f"Request {request_id} failed: {payload.decode('utf-8')}")
+                    return payload
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("Coherence daemon closed the connection.")
+            self.buffer += chunk
+
+    def read(self, vm_id, address):
+        self.sock.sendall(self._frame(OP_READ, vm_id, address))
+        return self._receive()
+
+    def write(self, vm_id, address, data):
+        self.sock.sendall(self._frame(OP_WRITE, vm_id, address, data))
+        self._receive()
+
+    def pipeline(self, requests, window=1024):
+        """
+        Send (op, vm_id, address, data) requests back to back and collect the responses in order.
+        At most `window` requests are in flight so neither side's socket buffer can fill up.
+        """
+        results = []
+        for start in range(0, len(requests), window):
+            frames = [self._frame(OP_WRITE if op == "W" else OP_READ, vm_id, address, data if op == "W" else b"")
+                      for op, vm_id, address, data in requests[start:start + window]]
+            self.sock.sendall(b"".join(frames))
+            results.extend(self._receive() for _ in frames)
+        return results
+
+    def close(self):
+        self.sock.close()
+
+
+def run_latency_benchmark(requests=20000):
+    with tempfile.TemporaryDirectory() as socket_dir, open(os.devnull, "w") as quiet, redirect_stdout(quiet):
+        daemon = CoherenceDaemon(os.path.join(socket_dir, "agent.sock"), vm_ids=(1, 2), cache_size=64)
+        thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+        thread.start()
+        client = CoherenceClient(daemon.server_address)
+
+        start = time.perf_counter()
+        for number in range(requests):
+            client.read(1 + number % 2, 0xABC + 64 * (number % 32))
+        sequential = time.perf_counter() - start
+
+        batch = [("R", 1 + number % 2, 0xABC + 64 * (number % 32), b"") for number in range(requests)]
+        start = time.perf_counter()
+        client.pipeline(batch)
+        pipelined = time.perf_counter() - start
+
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        launch = time.perf_counter() - start
+
+        client.close()
+        daemon.shutdown()
+        daemon.server_close()
+
+    print(f"Process launch: {launch * 1e6:.1f} us per access")
+    print(f"Daemon, one request at a time: {sequential / requests * 1e6:.1f} us per access")
+    print(f"Daemon, pipelined: {pipelined / requests * 1e6:.1f} us per access")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resident coherence agent daemon")
+    parser.add_argument("socket_path", nargs="?", default="/tmp/cxl_coh_vm1.sock")
+    parser.add_argument("--protocol", choices=sorted(PROTOCOLS), default="mesif")
+    parser.add_argument("--vms", type=int, default=2)
+    parser.add_argument("--cache-size", type=int, default=2)
+    parser.add_argument("--device", help="DAX device (or file) to map as the shared region, instead of memory")
+    parser.add_argument("--quiet", action="store_true", help="Drop per-access protocol output")
+    parser.add_argument("--bench", action="store_true", help="Measure per-request latency and exit")
+    args = parser.parse_args()
+
+    if args.bench:
+        run_latency_benchmark()
+    else:
+        if args.quiet:
+            sys.stdout = open(os.devnull, "w")
+        daemon = CoherenceDaemon(args.socket_path, args.protocol, range(1, args.vms + 1), args.cache_size,
+                                 args.device)
+        try:
+            daemon.serve_forever()
+        finally:
+            daemon.server_close()
@@ -0,0 +1,152 @@
+import csv
+import json
+import signal
+from collections import Counter, OrderedDict
+
+
+# Space-Saving heavy hitters: at most `capacity` counters, whatever the number of lines
+class HotLineSketch:
+    def __init__(self, capacity=32):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+
+    def record(self, address, weight=1):
+        if address in self.counts:
+            self.counts[address] += weight
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[address] = weight
+            self.errors[address] = 0
+            return
+        # Replace the smallest counter; its count bounds how much the newcomer may be overestimated
+        victim = min(self.counts, key=self.counts.get)
+        floor = self.counts.pop(victim)
+        del self.errors[victim]
+        self.counts[address] = floor + weight
+        self.errors[address] = floor
+
+    def top(self, count=10):
+        """
+        Return [(address, estimated count, maximum overestimate)] for the hottest lines.
+        """
+        hottest = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:count]
+        return [(address, estimate, self.errors[address]) for address, estimate in hottest]
+
+
+# Per-VM structured counters for one protocol run
+class CoherenceStats:
+    def __init__(self, protocol="unknown", sketch_size=32):
+        self.protocol = protocol
+        self.vms = OrderedDict()
+        self.hot_lines = HotLineSketch(sketch_size)
+
+    def counters(self, vm_id):
+        counters = self.vms.get(vm_id)
+        if counters is None:
+            counters = self.vms[vm_id] = Counter()
+        return counters
+
+    def hit(self, vm_id, op, state):
+        self.counters(vm_id)[f"{op}_hit_{state}"] += 1
+
+    def miss(self, vm_id, op, state):
+        # state is the line's state before the miss: I if present but invalid, - if not cached
+        self.counters(vm_id)[f"{op}_miss_{state}"] += 1
+
+    def invalidation(self, sender, receiver, address):
+        self.counters(sender)["invalidations_sent"] += 1
+        self.counters(receiver)["invalidations_received"] += 1
+        self.hot_lines.record(address)
+
+    def update(self, sender, receiver, address, size):
+        self.counters(sender)["updates_sent"] += 1
+        self.counters(receiver)["updates_received"] += 1
+        self.counters(sender)["update_bytes"] += size
+        self.hot_lines.record(address)
+
+    def upgrade(self, vm_id, address):
+        self.counters(vm_id)["upgrades"] += 1
+        self.hot_lines.record(address)
+
+    def transfer(self, sender, receiver, address):
+        self.counters(sender)["c2c_sent"] += 1
+        self.counters(receiver)["c2c_received"] += 1
+        self.hot_lines.record(address)
+
+    def writeback(self, vm_id):
+        self.counters(vm_id)["writebacks"] += 1
+
+    def device_read(self, vm_id, size):
+        self.counters(vm_id)["device_bytes_read"] += size
+
+    def device_write(self, vm_id, size):
+        self.counters(vm_id)["device_bytes_written"] += size
+
+    def summary(self, hot_count=10):
+        return OrderedDict([
+            ("protocol", self.protocol),
+            ("vms", OrderedDict((vm_id, OrderedDict(sorted(counters.items())))
+                                for vm_id, counters in sorted(self.vms.items()))),
+            ("hot_lines", [OrderedDict([("address", address), ("events", estimate), ("error", error)])
+                           for address, estimate, error in self.hot_lines.top(hot_count)]),
+        ])
+
+    def export_json(self, path):
+        with open(path, "w") as file:
+            json.dump(self.summary(), file, indent=4)
+
+    def export_csv(self, path):
+        """
+        One row per (vm, counter), then one row per hot line with vm_id 'hot'.
+        """
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["protocol", "vm_id", "counter", "value"])
+            for vm_id, counters in self.vms.items():
+                for name, value in sorted(counters.items()):
+                    writer.writerow([self.protocol, vm_id, name, value])
+            for address, estimate, _ in self.hot_lines.top(self.hot_lines.capacity):
+                writer.writerow([self.protocol, "hot", address, estimate])
+
+    def export(self, path):
+        if path.endswith(".csv"):
+            self.export_csv(path)
+        else:
+            self.export_json(path)
+
+    def export_on_signal(self, path, signum=signal.SIGUSR1):
+        """
+        Dump the current counters whenever the process receives signum (e.g. kill -USR1 <pid>).
+        """
+        signal.signal(signum, lambda received, frame: self.export(path))
+
+
+# Demo: zipfian traffic through MESIF, then the hottest lines and both export formats
+if __name__ == "__main__":
+    import os
+    import sys
+    import tempfile
+    from contextlib import redirect_stdout
+    from coherence_bus import CoherenceBus
+    from mesif_coh import MESIFCoherence
+    from workloads import drive, zipfian
+
+    bus = CoherenceBus()
+    agents = {vm_id: MESIFCoherence(vm_id, bus, cache_size=64) for vm_id in range(1, 5)}
+    bus.stats.export_on_signal(os.path.join(tempfile.gettempdir(), f"coh_stats_{os.getpid()}.json"))
+    with open(os.devnull, "w") as quiet, redirect_stdout(quiet):
+        drive(agents, zipfian(20000, seed=42))
+
+    summary = bus.stats.summary(hot_count=5)
+    print(f"--- Protocol: {summary['protocol']} ---")
+    for vm_id, counters in summary["vms"].items():
+        print(f"VM{vm_id}: {dict(counters)}")
+    print("\n--- Hottest lines ---")
+    for line in summary["hot_lines"]:
+        print(f"{line['address']:#x}: {line['events']} events (+/- {line['error']})")
+
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else tempfile.mkdtemp()
+    for name in ["coh_stats.json", "coh_stats.csv"]:
+        bus.stats.export(os.path.join(output_dir, name))
+        print(f"Exported {os.path.join(output_dir, name)}")
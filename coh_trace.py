@@ -0,0 +1,196 @@
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from atomics import COUNTER, counter_bytes
+from coherence_bus import CoherenceBus
+from mesif_coh import MESIFCoherence
+
+# Fixed-width record: timestamp (ns since recording began), line address, size, VM, op, operand
+# (the delta of a fetch-and-add, 1 if a compare-and-swap swapped)
+RECORD = struct.Struct("<QQIHBxq")
+MAGIC = b"CXLTRC02"
+OP_READ = 0
+OP_WRITE = 1
+OP_CAS = 2
+OP_FETCH_ADD = 3
+OP_SWAP = 4
+LINE_SIZE = 64
+FLUSH_RECORDS = 4096
+COUNTER_LINE = 256 * LINE_SIZE  # Demo lines driven with atomics, past the lines driven with reads and writes
+LOCK_LINE = 257 * LINE_SIZE
+
+
+# Records every access that reaches an agent's read()/write() and its atomics
+class TraceRecorder:
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.buffer = bytearray()
+        self.pending = 0
+        self.records = 0
+        self.start = time.perf_counter_ns()
+
+    def record(self, vm_id, op, address, size, operand=0):
+        self.buffer += RECORD.pack(time.perf_counter_ns() - self.start, address, size, vm_id, op, operand)
+        self.pending += 1
+        if self.pending >= FLUSH_RECORDS:
+            self.flush()
+
+    def attach(self, agent):
+        """
+        Wrap the agent's entry points so every access is recorded before it is handled.
+        """
+        read, write = agent.read, agent.write
+
+        def traced_read(address):
+            self.record(agent.vm_id, OP_READ, address, agent.bus.line_size)
+            return read(address)
+
+        def traced_write(address, data):
+            self.record(agent.vm_id, OP_WRITE, address, len(data))
+            return write(address, data)
+
+        agent.read, agent.write = traced_read, traced_write
+        if not hasattr(agent, "compare_and_swap"):
+            return agent
+        compare_and_swap, fetch_and_add, swap = agent.compare_and_swap, agent.fetch_and_add, agent.swap
+
+        def traced_compare_and_swap(address, expected, data):
+            # Recorded once its outcome is known, so the replay can reproduce it
+            swapped, old = compare_and_swap(address, expected, data)
+            self.record(agent.vm_id, OP_CAS, address, len(data), int(swapped))
+            return swapped, old
+
+        def traced_fetch_and_add(address, delta=1):
+            self.record(agent.vm_id, OP_FETCH_ADD, address, COUNTER.size, delta)
+            return fetch_and_add(address, delta)
+
+        def traced_swap(address, data):
+            self.record(agent.vm_id, OP_SWAP, address, len(data))
+            return swap(address, data)
+
+        agent.compare_and_swap, agent.fetch_and_add, agent.swap = (traced_compare_and_swap, traced_fetch_and_add,
+                                                                   traced_swap)
+        return agent
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.records += self.pending
+        self.buffer.clear()
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+# Memory-mapped trace: records are decoded straight from the mapping, never copied into a list
+class TraceReader:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            self.mm.madvise(mmap.MADV_SEQUENTIAL)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a coherence trace.")
+        partial = (len(self.mm) - len(MAGIC)) % RECORD.size
+        if partial:
+            self.mm.close()
+            self.file.close()
+            raise ValueError(f"{path} ends in a partial {partial} of {RECORD.size} byte record; "
+                             f"the recording was cut short.")
+        self.view = memoryview(self.mm)[len(MAGIC):]
+
+    def __len__(self):
+        return len(self.view) // RECORD.size
+
+    def __iter__(self):
+        """
+        Yield (timestamp, address, size, vm_id, op, operand). iter_unpack decodes in C over the mapped
+        buffer; the only per-record object is the tuple Python itself needs to hand back.
+        """
+        return RECORD.iter_unpack(self.view)
+
+    def replay(self, agents):
+        """
+        Drive agents (keyed by vm_id) with the recorded stream. Payloads are not traced, so writes
+        and swaps replay a filler of the recorded size, and a compare-and-swap replays its recorded
+        outcome as the same single transaction.
+        """
+        for timestamp, address, size, vm_id, op, operand in self:
+            agent = agents[vm_id]
+            if op == OP_READ:
+                agent.read(address)
+            elif op == OP_WRITE:
+                agent.write(address, b"x" * size)
+            elif op == OP_FETCH_ADD:
+                agent.fetch_and_add(address, operand)
+            elif op == OP_SWAP:
+                agent.swap(address, b"x" * size)
+            else:
+                filler = b"x" * size
+                agent._atomic(address, "cas", (lambda old: filler) if operand else (lambda old: old))
+
+    def close(self):
+        self.view.release()
+        self.mm.close()
+        self.file.close()
+
+
+def run_mesif(trace_path=None, replay_path=None, operations=20000):
+    bus = CoherenceBus()
+    vms = {vm_id: MESIFCoherence(vm_id, bus, cache_size=64) for vm_id in range(1, 5)}
+    with open(os.devnull, "w") as quiet, redirect_stdout(quiet):
+        if replay_path is not None:
+            reader = TraceReader(replay_path)
+            reader.replay(vms)
+            reader.close()
+            return bus
+        recorder = TraceRecorder(trace_path)
+        for agent in vms.values():
+            recorder.attach(agent)
+        for number in range(operations):
+            agent = vms[1 + number % 4]
+            address = (number * 7 % 256) * LINE_SIZE
+            if number % 50 == 0:
+                agent.fetch_and_add(COUNTER_LINE)
+            elif number % 50 == 25:
+                agent.compare_and_swap(LOCK_LINE, counter_bytes(0), counter_bytes(agent.vm_id))
+            elif number % 50 == 45:
+                agent.swap(LOCK_LINE, counter_bytes(0))
+            elif number % 5 == 0:
+                agent.write(address, f"Data{number}".encode())
+            else:
+                agent.read(address)
+        recorder.close()
+    return bus
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as trace_dir:
+        path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(trace_dir, "mesif.trc")
+        recorded = run_mesif(trace_path=path)
+        replayed = run_mesif(replay_path=path)
+
+        reader = TraceReader(path)
+        start = time.perf_counter()
+        count = sum(1 for _ in reader)
+        elapsed = time.perf_counter() - start
+        reader.close()
+
+        print(f"Trace: {count} records, {os.path.getsize(path)} bytes")
+        print(f"Raw iteration: {count / elapsed / 1e6:.1f} M records/s")
+        print("Replay reproduces the recorded traffic" if recorded.traffic == replayed.traffic
+              else f"Replay traffic differs: {dict(recorded.traffic)} vs {dict(replayed.traffic)}")
+
+        # A recording cut short mid-record is reported, not decoded into a garbage tail
+        with open(path, "ab") as file:
+            file.write(b"\0" * (RECORD.size // 2))
+        try:
+            TraceReader(path)
+        except ValueError as e:
+            print(f"Truncated trace: {e}")
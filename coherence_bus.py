@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from coh_stats import CoherenceStats
+
+LINE_SIZE = 64
+REGION_SIZE = 4 * 1024 * 1024  # Default shared region; addresses are byte offsets into it
+
+
+# Shared CXL region plus the VM caches snooping it
+class CoherenceBus:
+    def __init__(self, line_size=LINE_SIZE, region_size=REGION_SIZE):
+        if line_size & (line_size - 1):
+            raise ValueError(f"Line size must be a power of two, got {line_size}.")
+        self.line_size = line_size
+        self.line_mask = ~(line_size - 1)  # address & line_mask is the line's base address
+        # Any writable buffer works here, e.g. an mmap of the DAX device
+        self.memory = memoryview(bytearray(region_size))
+        self.caches = OrderedDict()
+        self.traffic = OrderedDict([
+            ("device_reads", 0),
+            ("device_writes", 0),
+            ("cache_to_cache", 0),
+            ("invalidations", 0),
+            ("upgrades", 0),
+            ("writebacks", 0),
+        ])
+        self.stats = CoherenceStats()
+        self.hierarchies = {}  # vm_id -> private cache levels in front of that VM's coherent cache
+
+    def attach(self, vm_id, lru_cache, protocol):
+        """
+        Register a VM cache so other agents can snoop it.
+        """
+        self.caches[vm_id] = lru_cache
+        self.stats.protocol = protocol
+
+    def peers(self, vm_id):
+        """
+        Return (vm_id, cache) for every VM other than the requester.
+        """
+        return [(peer_id, cache) for peer_id, cache in self.caches.items() if peer_id != vm_id]
+
+    def back_invalidate(self, vm_id, address):
+        """
+        The line left vm_id's coherent cache (invalidated or evicted), so its private levels must drop it too.
+        """
+        hierarchy = self.hierarchies.get(vm_id)
+        if hierarchy is not None:
+            hierarchy.drop(address)
+
+    def _check(self, address):
+        if address < 0 or address + self.line_size > len(self.memory):
+            raise ValueError(f"Line {address:#x} is outside the {len(self.memory)} byte shared region.")
+
+    def read_memory(self, vm_id, address):
+        """
+        Return a read-only view of the line in the shared region; nothing is copied. The view follows
+        later writes to the line, so it may only be cached, never handed out: reads go through line().
+        """
+        self._check(address)
+        self.traffic["device_reads"] += 1
+        self.stats.device_read(vm_id, self.line_size)
+        return self.memory[address:address + self.line_size].toreadonly()
+
+    def line(self, data):
+        """
+        Copy a cached payload or memory view out as the full line_size bytes a read returns; the part of
+        the line past a short payload reads as zeros.
+        """
+        return bytes(data).ljust(self.line_size, b"\0")
+
+    def write_memory(self, vm_id, address, data):
+        self.traffic["device_writes"] += 1
+        self.stats.device_write(vm_id, self.line_size)
+        self.store(address, data)
+
+    def store(self, address, data):
+        """
+        Write a payload at the start of its line; the rest of the line is zeroed. Not counted as traffic,
+        so it also serves to set the region's initial contents.
+        """
+        address &= self.line_mask
+        self._check(address)
+        length = len(data)
+        if length > self.line_size:
+            raise ValueError(f"A {length} byte payload does not fit in a {self.line_size} byte line.")
+        self.memory[address:address + length] = data
+        self.memory[address + length:address + self.line_size] = bytes(self.line_size - length)
+
+    def display_traffic(self):
+        for key, value in self.traffic.items():
+            print(f"{key}: {value}")
@@ -0,0 +1,157 @@
+import mmap
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from lru_cache import LRUCache
+
+FILENAME = "/dev/dax0.0"
+REGION_SIZE = 4294967296  # 4 GB
+HUGE_PAGE_SIZE = 2 * 1024 * 1024
+DEFAULT_ADVICE = ("hugepage", "willneed", "random")
+
+
+# Windowed mapping of a DAX device: only the 2 MB windows in use are mapped, and they stay mapped
+class DAXMapping:
+    def __init__(self, filename=FILENAME, window_size=HUGE_PAGE_SIZE, max_windows=64, advice=DEFAULT_ADVICE,
+                 access=mmap.ACCESS_WRITE):
+        if window_size % HUGE_PAGE_SIZE:
+            raise ValueError(f"Window size must be a multiple of {HUGE_PAGE_SIZE} bytes.")
+        self.filename = filename
+        self.window_size = window_size
+        self.advice = advice
+        self.access = access
+        self.fd = os.open(filename, os.O_RDWR if access == mmap.ACCESS_WRITE else os.O_RDONLY)
+        # Character DAX devices report no size, so fall back to the configured region
+        self.region_size = os.lseek(self.fd, 0, os.SEEK_END) or REGION_SIZE
+        self.windows = LRUCache(max_windows, on_evict=self._unmap)
+        self.lock = threading.Lock()  # Shards on one device share the window table
+        self.stats = OrderedDict([
+            ("maps", 0),
+            ("unmaps", 0),
+            ("window_hits", 0),
+            ("map_seconds", 0.0),
+            ("minor_faults", 0),
+            ("major_faults", 0),
+        ])
+        self._faults_at_start = self._faults()
+
+    @staticmethod
+    def _faults():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_minflt, usage.ru_majflt
+
+    def _advise(self, mm):
+        for name in self.advice:
+            flag = getattr(mmap, f"MADV_{name.upper()}", None)
+            if flag is None:
+                continue  # Not every platform/kernel exposes every hint
+            try:
+                mm.madvise(flag)
+            except OSError as e:
+                print(f"madvise({name}) not applied: {e}")
+
+    def _map(self, index):
+        start = index * self.window_size
+        length = min(self.window_size, self.region_size - start)
+        if length <= 0:
+            raise ValueError(f"Offset {start:#x} is beyond the {self.region_size:#x} byte region.")
+        began = time.perf_counter()
+        mm = mmap.mmap(self.fd, length, access=self.access, offset=start)
+        self._advise(mm)
+        self.stats["map_seconds"] += time.perf_counter() - began
+        self.stats["maps"] += 1
+        return mm
+
+    def _unmap(self, index, mm):
+        mm.close()
+        self.stats["unmaps"] += 1
+
+    def window(self, offset):
+        """
+        Return (mapping, offset inside it) for the window holding offset, mapping it on first use.
+        """
+        index = offset // self.window_size
+        with self.lock:
+            if index in self.windows.cache:
+                self.stats["window_hits"] += 1
+                self.windows.access(index)
+            else:
+                self.windows.access(index, self._map(index))
+            return self.windows.cache[index], offset - index * self.window_size
+
+    def view(self, offset, length):
+        """
+        Zero-copy view of a range; the range must not cross a window boundary.
+        Release the view before its window can be evicted, or the unmap will fail.
+        """
+        mm, start = self.window(offset)
+        if start + length > len(mm):
+            raise ValueError(f"Range {offset:#x}+{length} crosses a {self.window_size} byte window.")
+        return memoryview(mm)[start:start + length]
+
+    def read(self, offset, length):
+        chunks = []
+        while length > 0:
+            mm, start = self.window(offset)
+            count = min(length, len(mm) - start)
+            chunks.append(mm[start:start + count])
+            offset += count
+            length -= count
+        return b"".join(chunks)
+
+    def write(self, offset, data):
+        data = memoryview(data)
+        while data:
+            mm, start = self.window(offset)
+            count = min(len(data), len(mm) - start)
+            mm[start:start + count] = data[:count]
+            offset += count
+            data = data[count:]
+
+    def report(self):
+        minor, major = self._faults()
+        self.stats["minor_faults"] = minor - self._faults_at_start[0]
+        self.stats["major_faults"] = major - self._faults_at_start[1]
+        return self.stats
+
+    def close(self):
+        for index, mm in list(self.windows.cache.items()):
+            self._unmap(index, mm)
+        self.windows.cache.clear()
+        os.close(self.fd)
+
+
+# Benchmark: full-region mapping per operation against reused windows
+if __name__ == "__main__":
+    device = sys.argv[1] if len(sys.argv) > 1 else None
+    with tempfile.TemporaryDirectory() as device_dir:
+        if device is None:
+            device = os.path.join(device_dir, "dax0.0")
+            with open(device, "wb") as file:
+                file.truncate(64 * HUGE_PAGE_SIZE)
+        offsets = [(line * 4099 * 64) % (32 * HUGE_PAGE_SIZE) for line in range(2000)]
+
+        fd = os.open(device, os.O_RDWR)
+        size = os.lseek(fd, 0, os.SEEK_END) or REGION_SIZE
+        start = time.perf_counter()
+        for offset in offsets:
+            with mmap.mmap(fd, size, access=mmap.ACCESS_WRITE) as mm:
+                mm[offset:offset + 64] = b"\x01" * 64
+        per_op = time.perf_counter() - start
+        os.close(fd)
+
+        mapping = DAXMapping(device)
+        start = time.perf_counter()
+        for offset in offsets:
+            mapping.write(offset, b"\x01" * 64)
+        windowed = time.perf_counter() - start
+
+        print(f"Map per operation: {per_op * 1000:.2f} ms for {len(offsets)} writes")
+        print(f"Windowed mapping: {windowed * 1000:.2f} ms for {len(offsets)} writes")
+        for key, value in mapping.report().items():
+            print(f"{key}: {value}")
+        mapping.close()
@@ -5,6 +5,7 @@ from collections import OrderedDict
 class DAXParser:
     def __init__(self):
         self.dax_output = ""
+        self.version = None  # Entry version dax_reader saw, handed back to dax_writer
         self.data = OrderedDict()
 
     def set_output(self, dax_output):
@@ -17,6 +18,8 @@ class DAXParser:
         """
         Parse the dax_output to extract key-value pairs into self.data.
         """
+        version = re.search(r"^Version: (\d+)$", self.dax_output, re.MULTILINE)
+        self.version = int(version.group(1)) if version else None
         match = re.search(r"\{(.*)\}", self.dax_output)
         if match:
             content = match.group(1)
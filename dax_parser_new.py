@@ -1,5 +1,6 @@
 import re
 from collections import OrderedDict
+from event_log import LOG, DIR_ENTRY, DIR_INVALIDATE
 
 
 class Directory:
@@ -18,7 +19,7 @@ class Directory:
             owners = self.directory[block]["owners"]
             for owner in owners:
                 if owner != requester:
-                    print(f"Invalidate block {block} in VM{owner}.")
+                    LOG.emit(DIR_INVALIDATE, requester, block, peer=owner)
             # Remove all owners except the requester
             self.directory[block]["owners"] = [requester]
 
@@ -26,6 +27,7 @@ class Directory:
 class DAXParser:
     def __init__(self):
         self.dax_output = ""
+        self.version = None  # Entry version dax_reader saw, handed back to dax_writer
         self.directory = Directory()  # For Directory-based protocol
 
     def set_output(self, dax_output):
@@ -38,6 +40,9 @@ class DAXParser:
         """
         Parse the dax_output to extract key-value pairs into the Directory object.
         """
+        version = re.search(r"^Version: (\d+)$", self.dax_output, re.MULTILINE)
+        self.version = int(version.group(1)) if version else None
+        self.directory = Directory()  # A re-read after a version conflict starts from what is on the device
         match = re.search(r"Paragraph read from DAX device:\s*(\{.*\}\})", self.dax_output)
         if match:
             content = match.group(1)
@@ -56,8 +61,7 @@ class DAXParser:
             # Extract state and owners
             state = info.get("state", "U")
             owners = info.get("owners", [])
-            # Print parsed results
-            print(f"Address: {address}, State: {state}, Owners: {owners}")
+            LOG.emit(DIR_ENTRY, address=address, detail=(state, tuple(owners)))
             self.directory.set_state(address, state, owners)
 
     def read_address(self, address):
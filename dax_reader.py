@@ -1,31 +1,50 @@
-import mmap
-import os
+import sys
+from dax_mapping import DAXMapping
+from seqlock import VersionedEntry
 
 FILENAME = "/dev/dax0.0"
-REGION_SIZE = 4294967296  # 4 GB
 
 
-def dax_reader():
-    # Open the file
-    try:
-        fd = os.open(FILENAME, os.O_RDWR)
-    except OSError as e:
-        print(f"Error opening file: {e}")
-        return 1
+def parse_entry(text):
+    """
+    "<offset>" or "<offset>:<size>" -> (offset, size). Without a size the entry runs to the end of its window.
+    """
+    offset, _, size = text.partition(":")
+    return int(offset, 0), int(size, 0) if size else None
+
+
+def dax_reader(filename=FILENAME, offset=0, mapping=None, size=None):
+    # Run as a script (ap_ad2.sh), each read is its own process, so the mapping cannot outlive it:
+    # only the 2 MB window holding the paragraph is mapped. Callers in a long-running process pass
+    # their own DAXMapping instead, and its windows are reused across reads.
+    owned = mapping is None
+    if owned:
+        try:
+            # Read-write: a reader that finds a dead writer's odd sequence word recovers the entry
+            mapping = DAXMapping(filename)
+        except OSError as e:
+            print(f"Error opening file: {e}")
+            return 1
 
-    # Memory-map the file
     try:
-        with mmap.mmap(fd, REGION_SIZE, access=mmap.ACCESS_READ) as mm:
-            print("Paragraph read from DAX device:")
-            print(mm[:4096].decode('utf-8', errors='ignore'))  # Read and print 4096 bytes
+        # Versioned read: retried if a writer on another VM is mid-update, so it is never torn
+        entry = VersionedEntry(mapping, offset, size or mapping.window_size - offset % mapping.window_size)
+        version, paragraph = entry.read()
+        # Writers pass this back to dax_writer so their update only lands if nobody wrote in between
+        print(f"Version: {version}")
+        print("Paragraph read from DAX device:")
+        print(paragraph.decode('utf-8', errors='ignore'))
     except Exception as e:
         print(f"Error mapping file: {e}")
         return 1
     finally:
-        os.close(fd)
+        if owned:
+            mapping.close()
 
     return 0
 
 
 if __name__ == "__main__":
-    dax_reader()
\ No newline at end of file
+    # Optional: <device> <offset>[:<size>] to read one shard or entry of a sharded directory
+    offset, size = parse_entry(sys.argv[2]) if len(sys.argv) > 2 else (0, None)
+    sys.exit(dax_reader(sys.argv[1] if len(sys.argv) > 1 else FILENAME, offset, size=size))
\ No newline at end of file
@@ -0,0 +1,156 @@
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dax_reader import FILENAME
+from dax_mapping import DAXMapping, HUGE_PAGE_SIZE
+from seqlock import VersionedEntry
+
+SHARD_SIZE = HUGE_PAGE_SIZE  # One 2 MB window per shard keeps shards aligned to huge pages
+LINE_SIZE = 64
+
+
+# One directory segment: a sub-region of a DAX device with its own versioned entry
+class DAXShard:
+    def __init__(self, mapping, offset, size=SHARD_SIZE):
+        if offset % mapping.window_size or size > mapping.window_size:
+            raise ValueError(f"Shard {offset:#x}+{size} does not sit in one {mapping.window_size} byte window.")
+        self.mapping = mapping
+        self.filename = mapping.filename
+        self.offset = offset
+        self.size = size
+        # Writers compare-and-swap the segment's sequence word, so shards never block each other
+        # and readers of a shard only retry while a writer is inside it
+        self.entry = VersionedEntry(mapping, offset, size)
+
+    @staticmethod
+    def _decode(payload):
+        # dax_writer null-terminates what it stores
+        payload = bytes(payload).rstrip(b"\0")
+        return json.loads(payload.decode("utf-8")) if payload else {}
+
+    def load(self):
+        return self._decode(self.entry.read()[1])
+
+    def modify(self, function):
+        """
+        Apply function to the decoded segment and retry until the compare-and-swap lands.
+        """
+        def apply(payload):
+            segment = self._decode(payload)
+            function(segment)
+            encoded = json.dumps(segment).encode("utf-8")
+            if len(encoded) > self.entry.capacity:
+                raise ValueError(f"Directory segment of {len(encoded)} bytes does not fit in a {self.size} byte shard.")
+            return encoded
+        return self.entry.update(apply)
+
+
+def shard_layout(devices=(FILENAME,), shards_per_device=1, shard_size=SHARD_SIZE):
+    """
+    (device, offset) of every shard, interleaved across devices. Processes that only drive
+    dax_reader/dax_writer use this to address a shard without mapping it themselves.
+    """
+    return [(device, index * shard_size) for index in range(shards_per_device) for device in devices]
+
+
+def shard_index(block, shard_count):
+    return (int(block, 16) // LINE_SIZE) % shard_count
+
+
+# Directory interleaved by line address across N devices or N sub-regions of one device
+class ShardedDirectory:
+    def __init__(self, devices=(FILENAME,), shards_per_device=1, shard_size=SHARD_SIZE):
+        # One reusable mapping per device, shared by every shard on it
+        mappings = {device: DAXMapping(device, max_windows=shards_per_device) for device in devices}
+        self.mappings = list(mappings.values())
+        self.shards = [DAXShard(mappings[device], offset, shard_size)
+                       for device, offset in shard_layout(devices, shards_per_device, shard_size)]
+
+    def shard_index(self, block):
+        return shard_index(block, len(self.shards))
+
+    def shard_for(self, block):
+        return self.shards[self.shard_index(block)]
+
+    def get_state(self, block):
+        return self.shard_for(block).load().get(block, {"state": "U", "owners": []})
+
+    def set_state(self, block, state, owners):
+        self.apply([(block, state, owners)])
+
+    def invalidate_others(self, block, requester):
+        def invalidate(segment):
+            if block in segment:
+                segment[block]["owners"] = [owner for owner in segment[block]["owners"] if owner == requester]
+        self.shard_for(block).modify(invalidate)
+
+    def _apply_to_shard(self, shard, updates):
+        def apply(segment):
+            for block, state, owners in updates:
+                segment[block] = {"state": state, "owners": list(owners)}
+        shard.modify(apply)
+
+    def apply(self, updates):
+        """
+        Apply (block, state, owners) updates, one read-modify-write per shard, shards in parallel.
+        """
+        by_shard = defaultdict(list)
+        for update in updates:
+            by_shard[self.shard_index(update[0])].append(update)
+        if len(by_shard) == 1:
+            index, shard_updates = next(iter(by_shard.items()))
+            self._apply_to_shard(self.shards[index], shard_updates)
+            return
+        with ThreadPoolExecutor(max_workers=len(by_shard)) as pool:
+            for future in [pool.submit(self._apply_to_shard, self.shards[index], shard_updates)
+                           for index, shard_updates in by_shard.items()]:
+                future.result()
+
+    def export_states(self):
+        states = {}
+        for shard in self.shards:
+            states.update(shard.load())
+        return states
+
+    def close(self):
+        for mapping in self.mappings:
+            mapping.close()
+
+
+def create_emulated_devices(directory, count, size):
+    """
+    Create zero-filled files standing in for DAX devices when none are attached.
+    """
+    devices = []
+    for index in range(count):
+        path = os.path.join(directory, f"dax{index}.0")
+        with open(path, "wb") as file:
+            file.truncate(size)
+        devices.append(path)
+    return devices
+
+
+# Test Scenarios
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as device_dir:
+        devices = create_emulated_devices(device_dir, 2, 2 * SHARD_SIZE)
+        directory = ShardedDirectory(devices, shards_per_device=2)
+
+        print("\nScenario 1: Updates spread over every shard")
+        start = time.perf_counter()
+        directory.apply([(hex(line * LINE_SIZE), "S", [1, 2]) for line in range(256)])
+        print(f"256 updates in {(time.perf_counter() - start) * 1000:.2f} ms")
+        for index, shard in enumerate(directory.shards):
+            print(f"Shard {index} ({os.path.basename(shard.filename)} @ {shard.offset:#x}): {len(shard.load())} entries")
+
+        print("\nScenario 2: Concurrent writers on one shard lose no updates")
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            for future in [pool.submit(directory.set_state, hex(line * len(directory.shards) * LINE_SIZE), "M", [2])
+                           for line in range(64)]:
+                future.result()
+        print(f"Shard 0: {len(directory.shards[0].load())} entries, {dict(directory.shards[0].entry.stats)}")
+
+        directory.close()
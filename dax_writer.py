@@ -1,44 +1,55 @@
-import mmap
-import os
 import sys
+from dax_mapping import DAXMapping
+from dax_reader import parse_entry
+from seqlock import VersionedEntry
 
 FILENAME = "/dev/dax0.0"
-REGION_SIZE = 4294967296  # 4 GB
+VERSION_CONFLICT = 2  # Exit status when the entry moved past the expected version
 
 
-def dax_writer():
+def dax_writer(argv=None, mapping=None):
     # Check command-line arguments
-    if len(sys.argv) != 2:
-        print(f"Usage: {sys.argv[0]} <string>")
+    argv = sys.argv if argv is None else argv
+    if len(argv) not in [2, 3, 4, 5]:
+        print(f"Usage: {argv[0]} <string> [<device> <offset>[:<size>]] [<expected version>]")
         return 1
 
-    string_to_write = sys.argv[1]
-    size_to_write = len(string_to_write) + 1  # Include null terminator
+    string_to_write = argv[1]
+    filename = argv[2] if len(argv) >= 4 else FILENAME
+    offset, size = parse_entry(argv[3]) if len(argv) >= 4 else (0, None)
+    # The version dax_reader printed: the write only lands if the entry is still at it
+    expected = int(argv[-1]) if len(argv) in [3, 5] else None
+
+    # Run as a script (ap_ad.sh), each write is its own process, so the mapping cannot outlive it:
+    # only the 2 MB window being written is mapped. Callers in a long-running process pass their
+    # own DAXMapping instead, and its windows are reused across writes.
+    owned = mapping is None
+    if owned:
+        try:
+            mapping = DAXMapping(filename)
+        except OSError as e:
+            print(f"Error opening file: {e}")
+            return 1
 
-    # Open the file
     try:
-        fd = os.open(FILENAME, os.O_RDWR)
-    except OSError as e:
-        print(f"Error opening file: {e}")
-        return 1
-
-    # Memory-map the file
-    try:
-        with mmap.mmap(fd, REGION_SIZE, access=mmap.ACCESS_WRITE) as mm:
-            # Clear the memory region
-            mm[:size_to_write] = b'\x00' * size_to_write
-
-            # Write the string to memory
-            mm[:size_to_write] = string_to_write.encode('utf-8') + b'\x00'  # Add null terminator
-            print("Paragraph written to DAX device successfully.")
+        # Write the string to memory behind the entry's sequence word, so readers never see it half-written
+        entry = VersionedEntry(mapping, offset, size or mapping.window_size - offset % mapping.window_size)
+        payload = string_to_write.encode('utf-8') + b'\x00'  # Add null terminator
+        if expected is None:
+            entry.store(payload)
+        elif not entry.compare_and_swap(expected, payload):
+            print(f"Version conflict: entry is at version {entry.version()}, expected {expected}.")
+            return VERSION_CONFLICT
+        print("Paragraph written to DAX device successfully.")
     except Exception as e:
         print(f"Error mapping file: {e}")
         return 1
     finally:
-        os.close(fd)
+        if owned:
+            mapping.close()
 
     return 0
 
 
 if __name__ == "__main__":
-    dax_writer()
+    sys.exit(dax_writer())
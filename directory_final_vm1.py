@@ -5,6 +5,11 @@ import time
 from collections import OrderedDict
 from lru_cache import LRUCache
 from dax_parser_new import DAXParser
+from dax_shards import shard_index
+from dax_writer import VERSION_CONFLICT
+from protocol_table import directory_access
+from directory_wal import LoggedDirectory
+from event_log import LOG, SCRIPT_OUTPUT
 
 
 # Centralized Directory
@@ -27,13 +32,21 @@ class Directory:
 
 
 # MESI Coherence Protocol for Each VM
+# Each VM runs this engine in its own process, so it takes no RegionTracker: a tracker would only see
+# its own VM's accesses and treat regions other VMs share as private. Regions need directory_final_vm2.
 class DirectoryCoherence:
-    def __init__(self, vm_id, directory, cache_size=2, cache_filename="cache_vm1.json"):
+    def __init__(self, vm_id, directory, cache_size=2, cache_filename="cache_vm1.json", log=None, shards=None):
         self.vm_id = vm_id
-        self.directory = directory
+        # With a DirectoryLog, changes are appended to the shared log instead of rewriting the directory
+        self.directory = directory if log is None else LoggedDirectory(log)
+        self.log = log
         self.lru_cache = LRUCache(cache_size)
         self.cache_filename = cache_filename
         self.dax_parser = DAXParser()
+        # Optional (device, offset) list from dax_shards.shard_layout: each access then reads and
+        # writes only the shard holding its block, so accesses to different shards never conflict.
+        # seqlock.slot_layout gives (device, offset, size) entries, one per line, for per-entry versions
+        self.shards = shards
 
     def _update_local_cache(self):
         if os.path.exists(self.cache_filename) and os.path.getsize(self.cache_filename) > 0:
@@ -44,67 +57,73 @@ class DirectoryCoherence:
         with open(self.cache_filename, "w") as file:
             json.dump(self.lru_cache.cache, file, indent=4)
 
-    def read(self, address):
-        self._update_local_cache()
-        dax_reader_output = self.run_daxreader(address)
-        print(dax_reader_output)
+    def _load_directory(self, address):
+        if self.log is not None:
+            self.directory.refresh()
+            return
+        self.dax_parser.set_output(self.run_daxreader(address))
         self.dax_parser.parse()
         self.directory = self.dax_parser.directory
-        self.dax_parser.display_data()
-
-        # Get directory state
-        state_info = self.directory.get_state(address)
-        if state_info["state"] == "U":
-            print(f"VM{self.vm_id} READ miss: Block {address} not cached. Fetching from memory.")
-            self.directory.set_state(address, "S", [self.vm_id])
-        elif state_info["state"] == "S" and self.vm_id not in state_info["owners"]:
-            print(f"VM{self.vm_id} READ hit: Adding VM{self.vm_id} as owner.")
-            state_info["owners"].append(self.vm_id)
-            self.directory.set_state(address, "S", state_info["owners"])
-        elif state_info["state"] == "M":
-            print(f"VM{self.vm_id} READ from owner VM{state_info['owners'][0]}.")
-            self.directory.set_state(address, "S", state_info["owners"] + [self.vm_id])
-
-        self.run_daxwriter()
+
+    def _shard_args(self, address):
+        if self.shards is None:
+            return []
+        device, offset, *size = self.shards[shard_index(address, len(self.shards))]
+        return [device, hex(offset) + "".join(f":{entry_size}" for entry_size in size)]
+
+    def _update_directory(self, address, op):
+        """
+        Read the shared directory, apply the access and write it back. The write only lands if no other
+        VM wrote the directory since it was read; otherwise it is re-read and the access applied again.
+        """
+        while True:
+            self._load_directory(address)
+            directory_access(self.directory, address, self.vm_id, op)
+            if self.run_daxwriter(address):
+                break
+
+    def read(self, address):
+        self._update_local_cache()
+        self._update_directory(address, "R")
         # Cache access
         self.lru_cache.access(address, "Data")
         self._persist_local_cache()
 
     def write(self, block, data):
         self._update_local_cache()
-        dax_reader_output = self.run_daxreader(block)
-        print(dax_reader_output)
-        self.dax_parser.parse()
-        self.directory = self.dax_parser.directory
-        state_info = self.directory.get_state(block)
-
-        if state_info["state"] in ["U", "S"]:
-            print(f"VM{self.vm_id} WRITE miss: Invalidating other caches.")
-            self.directory.invalidate_others(block, self.vm_id)
-            self.directory.set_state(block, "M", [self.vm_id])
-        elif state_info["state"] == "M":
-            print(f"VM{self.vm_id} WRITE hit: Block already in Modified state.")
-
-        self.run_daxwriter()
+        self._update_directory(block, "W")
         self.lru_cache.access(block, data)
         self._persist_local_cache()
 
     def run_shell_script(self, script_path, *args):
         try:
             result = subprocess.run([script_path, *args], text=True, capture_output=True, check=True)
+            LOG.emit(SCRIPT_OUTPUT, self.vm_id, script_path, len(result.stdout))
             return result.stdout
         except subprocess.CalledProcessError as e:
+            if e.returncode == VERSION_CONFLICT:
+                return None
             print(f"Error in script {script_path}: {e.stderr}")
         except FileNotFoundError:
             print(f"Script {script_path} not found.")
         return ""
 
     def run_daxreader(self, address):
-        return self.run_shell_script("./ap_ad2.sh", address)
-
-    def run_daxwriter(self):
+        return self.run_shell_script("./ap_ad2.sh", address, *self._shard_args(address))
+
+    def run_daxwriter(self, address):
+        """
+        Write the directory (or the shard holding address) back at the version it was read at.
+        Returns False if another VM wrote it since.
+        """
+        if self.log is not None:
+            # Only the entries this access changed are appended, group-committed with other writers,
+            # and only if no other VM changed them since the refresh
+            return self.directory.flush() is not None
         message = json.dumps({k: {"state": v["state"], "owners": list(v["owners"])} for k, v in self.directory.directory.items()})
-        return self.run_shell_script("./ap_ad.sh", message)
+        version = self.dax_parser.version
+        args = [message, *self._shard_args(address)] + ([] if version is None else [str(version)])
+        return self.run_shell_script("./ap_ad.sh", *args) is not None
 
 
 # Test Scenarios
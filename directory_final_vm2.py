@@ -5,6 +5,9 @@ import time
 from collections import OrderedDict
 from lru_cache import LRUCache
 from dax_parser_new import DAXParser
+from dax_writer import VERSION_CONFLICT
+from protocol_table import directory_access
+from event_log import LOG, REGION_SKIP, SCRIPT_OUTPUT
 
 
 # Centralized Directory
@@ -28,12 +31,13 @@ class Directory:
 
 # MESI Coherence Protocol for Each VM
 class DirectoryCoherence:
-    def __init__(self, vm_id, directory, cache_size=2, cache_filename="cache_vm2.json"):
+    def __init__(self, vm_id, directory, cache_size=2, cache_filename="cache_vm2.json", regions=None):
         self.vm_id = vm_id
         self.directory = directory
         self.lru_cache = LRUCache(cache_size)
         self.cache_filename = cache_filename
         self.dax_parser = DAXParser()
+        self.regions = regions  # Optional RegionTracker shared by all VMs
 
     def _update_local_cache(self):
         if os.path.exists(self.cache_filename) and os.path.getsize(self.cache_filename) > 0:
@@ -44,21 +48,26 @@ class DirectoryCoherence:
         with open(self.cache_filename, "w") as file:
             json.dump(self.lru_cache.cache, file, indent=4)
 
+    def _region_filtered(self, address, op, data):
+        """
+        Skip the per-line directory for regions known to be private or read-only.
+        """
+        if self.regions is None or self.regions.access(address, self.vm_id, op):
+            return False
+        LOG.emit(REGION_SKIP, self.vm_id, address, "READ" if op == "R" else "WRITE")
+        self.lru_cache.access(address, data)
+        self._persist_local_cache()
+        return True
+
     def read(self, address):
         self._update_local_cache()
+        if self._region_filtered(address, "R", "Data"):
+            return
 
-        # Get directory state
-        state_info = self.directory.get_state(address)
-        if state_info["state"] == "U":
-            print(f"VM{self.vm_id} READ miss: Block {address} not cached. Fetching from memory.")
-            self.directory.set_state(address, "S", [self.vm_id])
-        elif state_info["state"] == "S" and self.vm_id not in state_info["owners"]:
-            print(f"VM{self.vm_id} READ hit: Adding VM{self.vm_id} as owner.")
-            state_info["owners"].append(self.vm_id)
-            self.directory.set_state(address, "S", state_info["owners"])
-        elif state_info["state"] == "M":
-            print(f"VM{self.vm_id} READ from owner VM{state_info['owners'][0]}.")
-            self.directory.set_state(address, "S", state_info["owners"] + [self.vm_id])
+        if self.regions is not None:
+            self.regions.flush_into(self.directory)
+
+        directory_access(self.directory, address, self.vm_id, "R")
 
         # Cache access
         self.lru_cache.access(address, "Data")
@@ -66,14 +75,11 @@ class DirectoryCoherence:
 
     def write(self, block, data):
         self._update_local_cache()
-        state_info = self.directory.get_state(block)
-
-        if state_info["state"] in ["U", "S"]:
-            print(f"VM{self.vm_id} WRITE miss: Invalidating other caches.")
-            self.directory.invalidate_others(block, self.vm_id)
-            self.directory.set_state(block, "M", [self.vm_id])
-        elif state_info["state"] == "M":
-            print(f"VM{self.vm_id} WRITE hit: Block already in Modified state.")
+        if self._region_filtered(block, "W", data):
+            return
+        if self.regions is not None:
+            self.regions.flush_into(self.directory)
+        directory_access(self.directory, block, self.vm_id, "W")
 
         self.lru_cache.access(block, data)
         self._persist_local_cache()
@@ -81,8 +87,11 @@ class DirectoryCoherence:
     def run_shell_script(self, script_path, *args):
         try:
             result = subprocess.run([script_path, *args], text=True, capture_output=True, check=True)
+            LOG.emit(SCRIPT_OUTPUT, self.vm_id, script_path, len(result.stdout))
             return result.stdout
         except subprocess.CalledProcessError as e:
+            if e.returncode == VERSION_CONFLICT:
+                return None
             print(f"Error in script {script_path}: {e.stderr}")
         except FileNotFoundError:
             print(f"Script {script_path} not found.")
@@ -0,0 +1,473 @@
+import fcntl
+import json
+import mmap
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dax_mapping import DAXMapping, HUGE_PAGE_SIZE
+from dax_parser_new import Directory
+from seqlock import HEADER, SEQUENCE, VersionedEntry
+
+# Layout of one 2 MB window: log state, then two sides of (checkpoint table, log). One side is live;
+# compaction builds the other and switches to it, so a crash mid-compaction leaves the live side intact.
+# The state itself alternates between two checksummed slots, so a crash mid-update leaves the previous one.
+STATE_SIZE = mmap.PAGESIZE
+TABLE_SIZE = 512 * 1024
+LOG_OFFSET = STATE_SIZE + 2 * TABLE_SIZE
+LOG_SIZE = (HUGE_PAGE_SIZE - LOG_OFFSET) // 2
+
+LOG_STATE = struct.Struct("<QQQBQ")  # log tail, next LSN, epoch, live side, generation
+STATE_SLOT = struct.Struct(f"<{LOG_STATE.size}sI")  # state, crc32
+TABLE_HEADER = struct.Struct("<QII")  # LSN folded into the table, length, crc32
+RECORD_HEADER = struct.Struct("<IIQQ")  # length, crc32, LSN, epoch
+GROUP_WINDOW = 0.0002  # Seconds a commit leader waits for other writers to join its record
+MAX_BATCH = 256  # Updates that close a batch early
+COMPACT_THRESHOLD = LOG_SIZE // 2  # Log bytes that trigger a background compaction
+# Bytes of the state page locked with fcntl, clear of the sequence word the state entry locks itself
+APPEND_LOCK = STATE_SIZE - 1
+COMPACT_LOCK = STATE_SIZE - 2
+
+
+def _crc(lsn, epoch, payload):
+    return zlib.crc32(payload, zlib.crc32(struct.pack("<QQ", lsn, epoch)))
+
+
+# Write-ahead log of directory updates in the shared region
+# An update costs one appended record instead of a rewrite of the whole directory. Concurrent
+# writers are group-committed into a single record and flush, and a background compactor folds
+# the log into a checkpoint table. Recovery is the live table plus a replay of the log.
+class DirectoryLog:
+    def __init__(self, mapping, base=0, group_window=GROUP_WINDOW, max_batch=MAX_BATCH,
+                 compact_threshold=COMPACT_THRESHOLD):
+        if base % mapping.window_size:
+            raise ValueError(f"Log base {base:#x} does not start a {mapping.window_size} byte window.")
+        self.mapping = mapping
+        self.base = base
+        self.group_window = group_window
+        self.max_batch = max_batch
+        self.compact_threshold = compact_threshold
+        self.state = VersionedEntry(mapping, base, STATE_SIZE)
+        # fcntl locks belong to the process, so threads of one VM also need their own locks
+        self.append_lock = threading.Lock()
+        self.compact_lock = threading.Lock()
+        self.batch_lock = threading.Lock()
+        self.batch = self._new_batch()
+        self.compactor = None
+        # LSN of the last record that changed each block, caught up from the live log under the append lock
+        self.changed = {}
+        self.index = (None, 0, 0)  # epoch, log offset scanned to, LSN folded into the live table
+        self.stats = OrderedDict([("commits", 0), ("records", 0), ("log_bytes", 0), ("flushes", 0),
+                                  ("compactions", 0), ("conflicts", 0)])
+
+    @staticmethod
+    def _new_batch():
+        return {"groups": [], "size": 0, "full": threading.Event(), "done": threading.Event(), "lsn": None,
+                "error": None}
+
+    def _window(self):
+        mm, start = self.mapping.window(self.base)
+        return mm, start
+
+    def _lock(self, offset):
+        fcntl.lockf(self.mapping.fd, fcntl.LOCK_EX, 1, self.base + offset)
+
+    def _unlock(self, offset):
+        fcntl.lockf(self.mapping.fd, fcntl.LOCK_UN, 1, self.base + offset)
+
+    def _state_slots(self):
+        """
+        Return the state entry's two slots and the newest intact state in them, or None.
+        """
+        _, payload = self.state.read()
+        slots = bytearray(bytes(payload[:2 * STATE_SLOT.size]).ljust(2 * STATE_SLOT.size, b"\0"))
+        newest = None
+        for index in range(2):
+            packed, crc = STATE_SLOT.unpack_from(slots, index * STATE_SLOT.size)
+            if zlib.crc32(packed) == crc and any(packed):
+                state = LOG_STATE.unpack(packed)
+                if newest is None or state[4] > newest[4]:
+                    newest = state
+        return slots, newest
+
+    def read_state(self):
+        """
+        Return (tail, next lsn, epoch, live side). A zeroed region is an empty log.
+        """
+        _, newest = self._state_slots()
+        if newest is None:
+            return 0, 1, 0, 0
+        return newest[:4]
+
+    def _store_state(self, tail, lsn, epoch, side):
+        """
+        Publish a new state into the slot the current state is not in, and flush it before returning:
+        an LSN is only handed back once the tail that covers it is durable. Callers hold the append lock.
+        """
+        slots, newest = self._state_slots()
+        generation = 1 if newest is None else newest[4] + 1
+        packed = LOG_STATE.pack(tail, lsn, epoch, side, generation)
+        STATE_SLOT.pack_into(slots, generation % 2 * STATE_SLOT.size, packed, zlib.crc32(packed))
+        self.state.store(bytes(slots))
+        mm, start = self._window()
+        self._flush(mm, start, STATE_SIZE)
+
+    def _flush(self, mm, start, length):
+        # Persist a byte range; msync wants a page-aligned start
+        aligned = start - start % mmap.PAGESIZE
+        mm.flush(aligned, start + length - aligned)
+        self.stats["flushes"] += 1
+
+    def _catch_up(self, tail, epoch, side):
+        """
+        Index the blocks changed by records this process has not scanned yet. Callers hold the append lock.
+        """
+        index_epoch, offset, table_lsn = self.index
+        if epoch != index_epoch:
+            mm, base = self._window()
+            table_lsn = TABLE_HEADER.unpack_from(mm, base + STATE_SIZE + side * TABLE_SIZE)[0]
+            self.changed = {}
+            offset = 0
+        for offset, lsn, updates in self.records(epoch, side, offset, tail):
+            for block, _, _ in updates:
+                self.changed[block] = lsn
+        self.index = (epoch, offset, table_lsn)
+
+    def _changed_since(self, block, base):
+        # A block the live log does not touch last changed at or before the table's LSN
+        return self.changed.get(block, self.index[2]) > base
+
+    def _append(self, groups):
+        """
+        Append one record of every group whose blocks no other record changed since its base LSN,
+        and publish it by moving the tail. Rejected groups are marked and left out; if every group is
+        rejected nothing is written and None is returned. Appends from every VM are serialised, so the
+        tail never passes a record that is not fully written and flushed.
+        """
+        while True:
+            with self.append_lock:
+                self._lock(APPEND_LOCK)
+                try:
+                    tail, lsn, epoch, side = self.read_state()
+                    self._catch_up(tail, epoch, side)
+                    updates = []
+                    claimed = set()  # Blocks an earlier group of this batch changes
+                    for group in groups:
+                        blocks = [update[0] for update in group["updates"]]
+                        group["accepted"] = group["base"] is None or not any(
+                            block in claimed or self._changed_since(block, group["base"]) for block in blocks)
+                        if group["accepted"]:
+                            updates.extend(group["updates"])
+                            claimed.update(blocks)
+                    if not updates:
+                        return None
+                    payload = json.dumps(updates).encode("utf-8")
+                    size = RECORD_HEADER.size + len(payload)
+                    if tail + size <= LOG_SIZE:
+                        mm, start = self._window()
+                        offset = start + LOG_OFFSET + side * LOG_SIZE + tail
+                        RECORD_HEADER.pack_into(mm, offset, len(payload), _crc(lsn, epoch, payload), lsn, epoch)
+                        mm[offset + RECORD_HEADER.size:offset + size] = payload
+                        self._flush(mm, offset, size)
+                        self._store_state(tail + size, lsn + 1, epoch, side)
+                        for block in claimed:
+                            self.changed[block] = lsn
+                        self.index = (epoch, tail + size, self.index[2])
+                        self.stats["records"] += 1
+                        self.stats["log_bytes"] += size
+                        return lsn
+                finally:
+                    self._unlock(APPEND_LOCK)
+            if size > LOG_SIZE // 2:
+                raise ValueError(f"A {size} byte record does not fit in the {LOG_SIZE} byte log.")
+            # Log full: fold it into the table in the foreground, then retry
+            if not self.compact():
+                raise ValueError("The directory log is damaged and cannot be compacted.")
+
+    def commit(self, updates, base=None):
+        """
+        Durably log [(block, state, owners)] and return its LSN. With a base LSN the updates only land
+        if no record after base changed any of their blocks; otherwise nothing is logged and None is
+        returned, so the caller re-reads and retries. The first writer of a batch waits up to
+        group_window for others, then appends everyone's updates as one record.
+        """
+        group = {"updates": [[block, state, list(owners)] for block, state, owners in updates], "base": base,
+                 "accepted": False}
+        with self.batch_lock:
+            batch = self.batch
+            leader = not batch["groups"]
+            batch["groups"].append(group)
+            batch["size"] += len(group["updates"])
+            if batch["size"] >= self.max_batch:
+                batch["full"].set()
+                self.batch = self._new_batch()
+            self.stats["commits"] += 1
+        if leader:
+            batch["full"].wait(self.group_window)
+            with self.batch_lock:
+                if self.batch is batch:
+                    self.batch = self._new_batch()
+            try:
+                batch["lsn"] = self._append(batch["groups"])
+            except Exception as e:
+                batch["error"] = e
+            finally:
+                batch["done"].set()
+        else:
+            batch["done"].wait()
+        if batch["error"] is not None:
+            raise batch["error"]  # The leader's append failed, and these updates went with it
+        if not group["accepted"]:
+            self.stats["conflicts"] += 1
+            return None
+        return batch["lsn"]
+
+    def records(self, epoch, side, start=0, end=None):
+        """
+        Yield (offset after the record, lsn, updates) for intact records of `epoch` between start and end
+        of a side's log. Stops at the first torn or foreign record.
+        """
+        mm, base = self._window()
+        base += LOG_OFFSET + side * LOG_SIZE
+        end = LOG_SIZE if end is None else end
+        offset = start
+        while offset + RECORD_HEADER.size <= end:
+            length, crc, lsn, record_epoch = RECORD_HEADER.unpack_from(mm, base + offset)
+            payload_start = base + offset + RECORD_HEADER.size
+            if record_epoch != epoch or offset + RECORD_HEADER.size + length > end:
+                return
+            payload = mm[payload_start:payload_start + length]
+            if length == 0 or _crc(lsn, epoch, payload) != crc:
+                return
+            offset += RECORD_HEADER.size + length
+            yield offset, lsn, json.loads(payload)
+
+    def load_table(self, side):
+        """
+        Return (lsn, {block: entry}) from a side's checkpoint table; a torn table reads as empty.
+        """
+        mm, base = self._window()
+        start = base + STATE_SIZE + side * TABLE_SIZE
+        lsn, length, crc = TABLE_HEADER.unpack_from(mm, start)
+        payload = mm[start + TABLE_HEADER.size:start + TABLE_HEADER.size + length]
+        if length == 0 or length > TABLE_SIZE - TABLE_HEADER.size or zlib.crc32(payload) != crc:
+            return 0, {}
+        return lsn, json.loads(payload)
+
+    def compact(self):
+        """
+        Fold the live side into the idle side's table, then switch sides in a new epoch.
+        Records appended while the table was being written are carried over to the idle side's log.
+        """
+        with self.compact_lock:
+            self._lock(COMPACT_LOCK)  # One compactor at a time across all VMs
+            try:
+                return self._compact()
+            finally:
+                self._unlock(COMPACT_LOCK)
+
+    def _compact(self):
+        tail, _, epoch, side = self.read_state()
+        lsn, directory = self.load_table(side)
+        folded = 0
+        for folded, lsn, updates in self.records(epoch, side, 0, tail):
+            for block, state, owners in updates:
+                directory[block] = {"state": state, "owners": owners}
+        if folded != tail:
+            return False  # The log is damaged past this point; leave it for recovery
+        payload = json.dumps(directory).encode("utf-8")
+        if TABLE_HEADER.size + len(payload) > TABLE_SIZE:
+            raise ValueError(f"Directory of {len(payload)} bytes does not fit in a {TABLE_SIZE} byte table.")
+        mm, base = self._window()
+        idle = 1 - side
+        start = base + STATE_SIZE + idle * TABLE_SIZE
+        mm[start + TABLE_HEADER.size:start + TABLE_HEADER.size + len(payload)] = payload
+        TABLE_HEADER.pack_into(mm, start, lsn, len(payload), zlib.crc32(payload))
+        self._flush(mm, start, TABLE_HEADER.size + len(payload))
+
+        with self.append_lock:
+            self._lock(APPEND_LOCK)
+            try:
+                new_tail, next_lsn, _, _ = self.read_state()
+                carried = bytearray()
+                for _, record_lsn, updates in self.records(epoch, side, tail, new_tail):
+                    record = json.dumps(updates).encode("utf-8")
+                    carried += RECORD_HEADER.pack(len(record), _crc(record_lsn, epoch + 1, record),
+                                                  record_lsn, epoch + 1) + record
+                log_start = base + LOG_OFFSET + idle * LOG_SIZE
+                mm[log_start:log_start + len(carried)] = carried
+                if carried:
+                    self._flush(mm, log_start, len(carried))
+                # The state switch is the commit point: until it lands, the live side is untouched
+                self._store_state(len(carried), next_lsn, epoch + 1, idle)
+            finally:
+                self._unlock(APPEND_LOCK)
+        self.stats["compactions"] += 1
+        return True
+
+    def start_compactor(self, interval=0.05):
+        """
+        Compact in a background thread whenever the log passes compact_threshold.
+        """
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                if self.read_state()[0] >= self.compact_threshold:
+                    self.compact()
+
+        self.compactor = (stop, threading.Thread(target=run, daemon=True))
+        self.compactor[1].start()
+
+    def close(self):
+        if self.compactor is not None:
+            self.compactor[0].set()
+            self.compactor[1].join()
+            self.compactor = None
+
+
+# Directory whose changes go to the log; refresh() catches up on other VMs' records
+class LoggedDirectory(Directory):
+    def __init__(self, log, compact=True):
+        super().__init__()
+        self.log = log
+        self.pending = OrderedDict()  # block -> entry changed since the last flush
+        self.undo = {}  # block -> entry before the first unflushed change, restored on a conflict
+        self.lsn = 0
+        self.epoch = None
+        self.offset = 0
+        if compact and log.compactor is None:
+            log.start_compactor()
+        self.refresh()
+
+    def refresh(self):
+        """
+        Recovery and catch-up are the same: load the live table if the log was compacted since the
+        last call, then replay records past the last applied LSN.
+        """
+        tail, _, epoch, side = self.log.read_state()
+        if epoch != self.epoch:
+            self.lsn, self.directory = self.log.load_table(side)
+            self.epoch = epoch
+            self.offset = 0
+        for self.offset, lsn, updates in self.log.records(epoch, side, self.offset, tail):
+            if lsn > self.lsn:
+                for block, state, owners in updates:
+                    self.directory[block] = {"state": state, "owners": owners}
+                self.lsn = lsn
+
+    def _save(self, block):
+        if block not in self.undo:
+            entry = self.directory.get(block)
+            self.undo[block] = None if entry is None else {"state": entry["state"], "owners": list(entry["owners"])}
+
+    def set_state(self, block, state, owners):
+        self._save(block)
+        super().set_state(block, state, owners)
+        self.pending[block] = self.directory[block]
+
+    def invalidate_others(self, block, requester):
+        self._save(block)
+        super().invalidate_others(block, requester)
+        if block in self.directory:
+            self.pending[block] = self.directory[block]
+
+    def flush(self):
+        """
+        Log the changes made since the last refresh and return the LSN they landed at, then replay every
+        record up to it. Returns None, with the changes undone, if another VM changed one of the blocks
+        first: refresh and apply the access again.
+        """
+        if not self.pending:
+            return self.lsn
+        updates = [(block, entry["state"], entry["owners"]) for block, entry in self.pending.items()]
+        self.pending.clear()
+        undo, self.undo = self.undo, {}
+        lsn = self.log.commit(updates, base=self.lsn)
+        if lsn is None:
+            for block, entry in undo.items():
+                if entry is None:
+                    self.directory.pop(block, None)
+                else:
+                    self.directory[block] = entry
+        # Records other VMs appended before ours are replayed here; skipping past them would lose them
+        self.refresh()
+        return lsn
+
+    def export_states(self):
+        return self.directory
+
+
+# Benchmark: whole-directory rewrite per update against group-committed log appends, then recovery
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+    from dax_shards import create_emulated_devices
+
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    updates_per_writer = 250
+    blocks = [hex(line * 64) for line in range(2048)]
+    with tempfile.TemporaryDirectory() as device_dir:
+        device = create_emulated_devices(device_dir, 1, 2 * HUGE_PAGE_SIZE)[0]
+        mapping = DAXMapping(device)
+
+        # Baseline: what run_daxwriter does, a versioned store of the whole serialised directory per change
+        table = VersionedEntry(mapping, HUGE_PAGE_SIZE, HUGE_PAGE_SIZE)
+        directory = {block: {"state": "S", "owners": [1, 2]} for block in blocks}
+        written = 0
+        start = time.perf_counter()
+        for number in range(writers * updates_per_writer):
+            directory[blocks[number % len(blocks)]] = {"state": "M", "owners": [1 + number % 4]}
+            payload = json.dumps(directory).encode("utf-8")
+            table.store(payload)
+            mm, offset = mapping.window(HUGE_PAGE_SIZE)
+            mm.flush(offset, len(payload))
+            written += len(payload)
+        rewrite = time.perf_counter() - start
+        print(f"Full rewrite: {writers * updates_per_writer / rewrite:.0f} updates/s, "
+              f"{written / (writers * updates_per_writer):.0f} bytes per update")
+
+        log = DirectoryLog(mapping, compact_threshold=64 * 1024)
+        log.commit([(block, "S", [1, 2]) for block in blocks])
+        log.start_compactor()
+
+        def writer(vm_id):
+            for number in range(updates_per_writer):
+                log.commit([(blocks[(vm_id * updates_per_writer + number) % len(blocks)], "M", [vm_id])])
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=writers) as pool:
+            list(pool.map(writer, range(1, writers + 1)))
+        logged = time.perf_counter() - start
+        log.close()
+        print(f"Log, {writers} writers: {writers * updates_per_writer / logged:.0f} updates/s, "
+              f"{log.stats['log_bytes'] / log.stats['commits']:.0f} bytes per update, "
+              f"{log.stats['commits'] / log.stats['records']:.1f} updates per record")
+        print(f"Log stats: {dict(log.stats)}")
+
+        # Crash in the middle of an append: bytes past the tail are never replayed
+        mm, base = mapping.window(0)
+        tail, _, _, side = log.read_state()
+        torn = base + LOG_OFFSET + side * LOG_SIZE + tail
+        mm[torn:torn + 64] = b"\xff" * 64
+        recovered = LoggedDirectory(DirectoryLog(mapping), compact=False)
+        expected = {block: {"state": "S", "owners": [1, 2]} for block in blocks}
+        for vm_id in range(1, writers + 1):
+            for number in range(updates_per_writer):
+                expected[blocks[(vm_id * updates_per_writer + number) % len(blocks)]] = {"state": "M", "owners": [vm_id]}
+        print(f"Recovered {len(recovered.directory)} entries at LSN {recovered.lsn}: "
+              f"{'matches' if recovered.directory == expected else 'DIFFERS from'} the committed updates")
+
+        # Crash in the middle of a state update: the word is left odd and the slot being written is torn
+        generation = recovered.log._state_slots()[1][4]
+        SEQUENCE.pack_into(mm, base, recovered.log.state.version() + 1)
+        slot = base + HEADER.size + (generation + 1) % 2 * STATE_SLOT.size
+        mm[slot:slot + STATE_SLOT.size] = b"\xff" * STATE_SLOT.size
+        start = time.perf_counter()
+        recovered = LoggedDirectory(DirectoryLog(mapping), compact=False)
+        print(f"Dead state writer recovered in {time.perf_counter() - start:.1f} s: {len(recovered.directory)} "
+              f"entries at LSN {recovered.lsn}, {'matches' if recovered.directory == expected else 'DIFFERS from'} "
+              f"the committed updates")
+        mapping.close()
@@ -0,0 +1,183 @@
+from collections import OrderedDict
+from lru_cache import LRUCache
+from coherence_bus import CoherenceBus, LINE_SIZE, REGION_SIZE
+from event_log import LOG, FETCH, READ_HIT, READ_MISS, SUPPLY, UPDATE, WRITE, WRITE_HIT, WRITE_MISS
+
+MESSAGE_HEADER_BYTES = 16  # Command + address flit on the link
+
+
+# Shared bus with the extra accounting a write-update protocol needs
+class UpdateBus(CoherenceBus):
+    def __init__(self, line_size=LINE_SIZE, region_size=REGION_SIZE):
+        super().__init__(line_size, region_size)
+        self.traffic.update([
+            ("updates", 0),
+            ("update_deliveries", 0),
+            ("update_bytes", 0),
+            ("useful_updates", 0),
+            ("useless_updates", 0),
+            ("invalidations_avoided", 0),
+        ])
+        self.pending = set()  # (vm_id, address) updated since that VM last read it
+
+    def deliver_update(self, vm_id, address):
+        """
+        Record one update pushed to a sharer.
+        A first delivery stands in for the invalidation a write-invalidate protocol would send;
+        a repeat delivery before the sharer reads the line is wasted.
+        """
+        key = (vm_id, address)
+        if key in self.pending:
+            self.traffic["useless_updates"] += 1
+        else:
+            self.traffic["invalidations_avoided"] += 1
+            self.pending.add(key)
+
+    def consume(self, vm_id, address):
+        """
+        A sharer read an updated line: under write-invalidate this would have been a miss.
+        """
+        key = (vm_id, address)
+        if key in self.pending:
+            self.pending.discard(key)
+            self.traffic["useful_updates"] += 1
+
+    def drop(self, vm_id, address):
+        key = (vm_id, address)
+        if key in self.pending:
+            self.pending.discard(key)
+            self.traffic["useless_updates"] += 1
+
+    def traffic_report(self):
+        """
+        Compare bytes moved by write-update against a write-invalidate run of the same trace.
+        """
+        update_bytes = self.traffic["update_bytes"]
+        invalidate_bytes = (self.traffic["invalidations_avoided"] * MESSAGE_HEADER_BYTES
+                            + self.traffic["useful_updates"] * (MESSAGE_HEADER_BYTES + self.line_size))
+        report = OrderedDict([
+            ("update_bytes", update_bytes),
+            ("invalidate_bytes_estimate", invalidate_bytes),
+            ("misses_avoided", self.traffic["useful_updates"]),
+            ("wasted_updates", self.traffic["useless_updates"]),
+            ("winner", "update" if update_bytes < invalidate_bytes else "invalidate"),
+        ])
+        return report
+
+
+# Dragon (write-update) Coherence: writes to shared lines are pushed to sharers instead of invalidating them
+class DragonCoherence:
+    def __init__(self, vm_id, bus, cache_size=2):
+        self.vm_id = vm_id
+        self.bus = bus
+        self.lru_cache = LRUCache(cache_size, on_evict=self._evict, line_size=bus.line_size)
+        self.bus.attach(vm_id, self.lru_cache, "dragon")
+
+    def _evict(self, address, line):
+        self.bus.drop(self.vm_id, address)
+        self.bus.back_invalidate(self.vm_id, address)
+        if line[1] in ["M", "Sm"]:
+            self.bus.traffic["writebacks"] += 1
+            self.bus.stats.writeback(self.vm_id)
+            self.bus.write_memory(self.vm_id, address, line[0])
+
+    def _sharers(self, address):
+        return [(peer_id, cache.cache[address]) for peer_id, cache in self.bus.peers(self.vm_id)
+                if address in cache.cache]
+
+    def read(self, address):
+        address &= self.bus.line_mask
+        if address in self.lru_cache.cache:
+            line = self.lru_cache.cache[address]
+            self.lru_cache.access(address)
+            self.bus.consume(self.vm_id, address)
+            self.bus.stats.hit(self.vm_id, "read", line[1])
+            LOG.emit(READ_HIT, self.vm_id, address, line[1])
+            return self.bus.line(line[0])
+
+        LOG.emit(READ_MISS, self.vm_id, address)
+        self.bus.stats.miss(self.vm_id, "read", "-")
+        sharers = self._sharers(address)
+        owner = next(((peer_id, line) for peer_id, line in sharers if line[1] in ["M", "Sm"]), None)
+        if owner is not None:
+            peer_id, line = owner
+            data = line[0]
+            line[1] = "Sm"
+            self.bus.traffic["cache_to_cache"] += 1
+            self.bus.stats.transfer(peer_id, self.vm_id, address)
+            LOG.emit(SUPPLY, self.vm_id, address, peer=peer_id)
+        else:
+            data = self.bus.read_memory(self.vm_id, address)
+        for peer_id, line in sharers:
+            if line[1] == "E":
+                line[1] = "Sc"
+
+        state = "Sc" if sharers else "E"
+        self.lru_cache.access(address, [data, state])
+        LOG.emit(FETCH, self.vm_id, address, state)
+        return self.bus.line(data)
+
+    def write(self, address, data):
+        address &= self.bus.line_mask
+        sharers = self._sharers(address)
+        if address in self.lru_cache.cache:
+            self.lru_cache.access(address)
+            self.bus.stats.hit(self.vm_id, "write", self.lru_cache.cache[address][1])
+            LOG.emit(WRITE_HIT, self.vm_id, address, self.lru_cache.cache[address][1])
+        else:
+            LOG.emit(WRITE_MISS, self.vm_id, address)
+            self.bus.stats.miss(self.vm_id, "write", "-")
+            self.lru_cache.access(address, [data, "M"])
+
+        if not sharers:
+            self.lru_cache.cache[address] = [data, "M"]
+            return
+
+        self.broadcast_update(address, data, sharers)
+        self.lru_cache.cache[address] = [data, "Sm"]
+        LOG.emit(WRITE, self.vm_id, address, "SHARED-MODIFIED")
+
+    def broadcast_update(self, address, data, sharers):
+        payload = len(data)
+        self.bus.traffic["updates"] += 1
+        for peer_id, line in sharers:
+            # Only one cache may own the line, so the writer takes Sm and the rest drop to Sc
+            line[0] = data
+            line[1] = "Sc"
+            self.bus.traffic["update_deliveries"] += 1
+            self.bus.traffic["update_bytes"] += MESSAGE_HEADER_BYTES + payload
+            self.bus.deliver_update(peer_id, address)
+            self.bus.stats.update(self.vm_id, peer_id, address, MESSAGE_HEADER_BYTES + payload)
+            LOG.emit(UPDATE, self.vm_id, address, peer=peer_id)
+
+
+# Test Scenarios
+def run_producer_consumer(writes_per_read, consumers=3, rounds=4):
+    bus = UpdateBus()
+    producer = DragonCoherence(1, bus)
+    readers = [DragonCoherence(vm_id, bus) for vm_id in range(2, consumers + 2)]
+    bus.store(0xAC0, b"Data")
+
+    for vm in readers:
+        vm.read(0xAC0)
+    for round_number in range(rounds):
+        for write_number in range(writes_per_read):
+            producer.write(0xAC0, f"Data{round_number}.{write_number}".encode())
+        for vm in readers:
+            vm.read(0xAC0)
+    return bus
+
+
+if __name__ == "__main__":
+    print("\n--- Producer/consumer: one write per read ---")
+    fine_grained = run_producer_consumer(writes_per_read=1)
+
+    print("\n--- Producer/consumer: write bursts between reads ---")
+    bursty = run_producer_consumer(writes_per_read=8)
+
+    print("\n--- Traffic: one write per read ---")
+    for key, value in fine_grained.traffic_report().items():
+        print(f"{key}: {value}")
+    print("\n--- Traffic: write bursts ---")
+    for key, value in bursty.traffic_report().items():
+        print(f"{key}: {value}")
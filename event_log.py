@@ -0,0 +1,288 @@
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+DEBUG, INFO, WARNING, OFF = 10, 20, 30, 100
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "off": OFF}
+
+MAGIC = b"CXLEVLOG"
+# timestamp ns, event, vm_id, peer, address kind, detail kind, address, detail
+RECORD = struct.Struct("<QHHHBBQQ")
+TRAILER = struct.Struct("<Q8s")  # value table length, magic
+DEFAULT_CAPACITY = 1 << 16  # Records kept in memory; older ones are overwritten
+INTERN_LIMIT = 4096  # Distinct non-integer values kept; later ones are logged as DROPPED
+# How a record field holds its value: integers and hex address text are stored in the record itself,
+# so only the small vocabulary of states, op names and script paths is interned
+NONE, INTEGER, HEX_TEXT, INTERNED, DROPPED = range(5)
+
+# Event code -> (level, template). Templates are only formatted when the log is dumped or echoed.
+EVENTS = []
+
+
+def event(level, template):
+    EVENTS.append((level, template))
+    return len(EVENTS) - 1
+
+
+READ_HIT = event(DEBUG, "VM{vm} READ hit: address {address}, State {detail}")
+READ_MISS = event(DEBUG, "VM{vm} READ miss: address {address}")
+WRITE_HIT = event(DEBUG, "VM{vm} WRITE hit: address {address}, State {detail}")
+WRITE_MISS = event(DEBUG, "VM{vm} WRITE miss: address {address}")
+FETCH = event(DEBUG, "VM{vm} FETCH: address {address} set to {detail}")
+WRITE = event(DEBUG, "VM{vm} WRITE: address {address} set to {detail}")
+FORWARD = event(DEBUG, "VM{peer} FORWARD: address {address} to VM{vm}")
+SUPPLY = event(DEBUG, "VM{peer} SUPPLY: address {address} to VM{vm}")
+MIGRATE = event(DEBUG, "VM{peer} MIGRATE: address {address} to VM{vm}")
+INVALIDATE = event(DEBUG, "VM{peer} INVALIDATE: Address {address}")
+UPDATE = event(DEBUG, "VM{peer} UPDATE: Address {address}")
+EXCLUSIVE = event(DEBUG, "VM{vm} EXCLUSIVE: Address {address}")
+OWNED = event(DEBUG, "VM{vm} OWNED: Address {address}")
+SHARE = event(DEBUG, "VM{vm} READ Hit change {detail} to Shared: address {address}")
+MEMORY_READ = event(DEBUG, "Read from the Memory for {address}, as state: {detail}")
+EVICT = event(DEBUG, "Evicting LRU: {address}")
+RECLASSIFY = event(INFO, "Line {address} reclassified: {detail[0]} -> {detail[1]}")
+REGION_PROMOTE = event(INFO, "Region {address} promoted to per-line tracking")
+REGION_SKIP = event(DEBUG, "VM{vm} {detail}: region of {address} not shared, directory skipped.")
+DIR_READ_MISS = event(DEBUG, "VM{vm} READ miss: Block {address} not cached. Fetching from memory.")
+DIR_READ_SHARED = event(DEBUG, "VM{vm} READ hit: Adding VM{vm} as owner.")
+DIR_READ_OWNER = event(DEBUG, "VM{vm} READ from owner VM{peer}.")
+DIR_WRITE_MISS = event(DEBUG, "VM{vm} WRITE miss: Invalidating other caches.")
+DIR_WRITE_HIT = event(DEBUG, "VM{vm} WRITE hit: Block already in Modified state.")
+DIR_INVALIDATE = event(DEBUG, "Invalidate block {address} in VM{peer}.")
+DIR_ENTRY = event(DEBUG, "Address: {address}, State: {detail[0]}, Owners: {detail[1]}")
+SCRIPT_OUTPUT = event(DEBUG, "Script {address} returned {detail} bytes")
+ATOMIC = event(DEBUG, "VM{vm} ATOMIC {detail}: address {address}")
+
+
+def _discard(code, vm=0, address=None, detail=None, peer=0):
+    pass
+
+
+def _decode(kind, value, values):
+    if kind == NONE:
+        return None
+    if kind == INTEGER:
+        return value
+    if kind == HEX_TEXT:
+        return hex(value)
+    if kind == INTERNED:
+        return values[value]
+    return "?"
+
+
+def format_event(code, vm, peer, address, detail):
+    # Engines log integer line addresses; they only become hex text here
+    if isinstance(address, int):
+        address = hex(address)
+    return EVENTS[code][1].format(vm=vm, peer=peer, address=address, detail=detail)
+
+
+# Fixed-size binary ring of coherence events; off unless a level is set
+class EventLog:
+    def __init__(self, capacity=DEFAULT_CAPACITY, level=OFF, echo=False):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD.size)
+        self.count = 0  # Records ever emitted; the ring holds the last `capacity` of them
+        self.values = []  # Interned non-integer values, at most INTERN_LIMIT; records store their index
+        self.ids = {}
+        self.dropped_values = 0
+        self.echo = False
+        self.stream = None
+        self.set_level(level, echo)
+
+    def set_level(self, level, echo=False):
+        """
+        Enable events at `level` and above. With echo, each event is also printed as it happens.
+        """
+        if isinstance(level, str):
+            if level.lower() not in LEVELS:
+                raise ValueError(f"Unknown event log level {level!r}; expected one of {', '.join(LEVELS)}.")
+            level = LEVELS[level.lower()]
+        self.level = level
+        self.echo = echo
+        # Disabled logging costs one call to a no-op: nothing is packed, interned or formatted
+        self.emit = _discard if self.level >= OFF else self._record
+
+    def _encode(self, value):
+        """
+        Return (kind, value) for a record field.
+        """
+        if value is None:
+            return NONE, 0
+        if type(value) is int and 0 <= value < 1 << 64:
+            return INTEGER, value
+        if type(value) is str and value[:2] in ("0x", "0X"):
+            try:
+                return HEX_TEXT, int(value, 16)
+            except ValueError:
+                pass
+        index = self.ids.get(value)
+        if index is None:
+            if len(self.values) >= INTERN_LIMIT:
+                self.dropped_values += 1
+                return DROPPED, 0
+            index = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return INTERNED, index
+
+    def _record(self, code, vm=0, address=None, detail=None, peer=0):
+        if EVENTS[code][0] < self.level:
+            return
+        address_kind, address_value = self._encode(address)
+        detail_kind, detail_value = self._encode(detail)
+        RECORD.pack_into(self.buffer, (self.count % self.capacity) * RECORD.size, time.perf_counter_ns(), code,
+                         vm, peer, address_kind, detail_kind, address_value, detail_value)
+        self.count += 1
+        if self.echo:
+            print(format_event(code, vm, peer, address, detail))
+
+    def records(self, last=None):
+        """
+        Yield (timestamp ns, code, vm, peer, address, detail) for the records still in the ring, oldest first.
+        """
+        first = max(self.count - self.capacity, 0 if last is None else self.count - last, 0)
+        for position in range(first, self.count):
+            timestamp, code, vm, peer, address_kind, detail_kind, address, detail = RECORD.unpack_from(
+                self.buffer, (position % self.capacity) * RECORD.size)
+            yield (timestamp, code, vm, peer, _decode(address_kind, address, self.values),
+                   _decode(detail_kind, detail, self.values))
+
+    def dump(self, file=None, last=None):
+        file = file or sys.stdout
+        for timestamp, code, vm, peer, address, detail in self.records(last):
+            file.write(format_event(code, vm, peer, address, detail) + "\n")
+
+    def clear(self):
+        self.count = 0
+        if self.stream is None:
+            # A stream still being written needs the table to decode what it already holds
+            self.values = []
+            self.ids = {}
+            self.dropped_values = 0
+
+    def stream_to(self, path, interval=0.1):
+        """
+        Append new records to path from a background thread until close().
+        Records overwritten before the thread copied them are counted as dropped.
+        """
+        self.stream = {"file": open(path, "wb"), "flushed": self.count, "dropped": 0,
+                       "stop": threading.Event()}
+        self.stream["file"].write(MAGIC)
+
+        def run():
+            while not self.stream["stop"].wait(interval):
+                self._flush()
+
+        self.stream["thread"] = threading.Thread(target=run, daemon=True)
+        self.stream["thread"].start()
+
+    def _flush(self):
+        """
+        Copy records [flushed, count) out of the ring. count is the ring's sequence: the producer may be
+        writing the slot of position count, which holds position count - capacity, so that one is left
+        out too. Positions the producer reached while the copy ran are cut off the front afterwards.
+        """
+        stream = self.stream
+        end = self.count
+        start = max(stream["flushed"], end - self.capacity + 1)
+        if start < end:
+            first, last = start % self.capacity, end % self.capacity
+            if first < last:
+                data = self.buffer[first * RECORD.size:last * RECORD.size]
+            else:
+                data = self.buffer[first * RECORD.size:] + self.buffer[:last * RECORD.size]
+            intact = min(self.count - self.capacity + 1, end)
+            if intact > start:
+                data = data[(intact - start) * RECORD.size:]
+                start = intact
+            stream["file"].write(data)
+        stream["dropped"] += start - stream["flushed"]
+        stream["flushed"] = end
+
+    def close(self):
+        """
+        Stop streaming; the value table goes after the records so the file decodes on its own.
+        """
+        if self.stream is None:
+            return 0
+        self.stream["stop"].set()
+        self.stream["thread"].join()
+        self._flush()
+        values = json.dumps(self.values).encode("utf-8")
+        self.stream["file"].write(values)
+        self.stream["file"].write(TRAILER.pack(len(values), MAGIC))
+        self.stream["file"].close()
+        dropped = self.stream["dropped"]
+        self.stream = None
+        return dropped
+
+
+def read_log(path):
+    """
+    Decode a streamed log file into formatted lines.
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    values_length, magic = TRAILER.unpack_from(data, len(data) - TRAILER.size)
+    if data[:len(MAGIC)] != MAGIC or magic != MAGIC:
+        raise ValueError(f"{path} is not a complete event log.")
+    values_start = len(data) - TRAILER.size - values_length
+    values = json.loads(data[values_start:values_start + values_length])
+    for timestamp, code, vm, peer, address_kind, detail_kind, address, detail in RECORD.iter_unpack(
+            data[len(MAGIC):values_start]):
+        yield format_event(code, vm, peer, _decode(address_kind, address, values), _decode(detail_kind, detail, values))
+
+
+def _environment_level():
+    name = os.environ.get("CXL_EVENT_LOG", "off")
+    if name.lower() not in LEVELS:
+        print(f"Ignoring CXL_EVENT_LOG={name}: expected one of {', '.join(LEVELS)}. Event log is off.",
+              file=sys.stderr)
+        return OFF
+    return LEVELS[name.lower()]
+
+
+# Shared by every engine; CXL_EVENT_LOG=debug|info|warning turns it on for a whole run,
+# and CXL_EVENT_ECHO=1 also prints each event as it happens
+LOG = EventLog(level=_environment_level(), echo=os.environ.get("CXL_EVENT_ECHO") == "1")
+
+
+# Benchmark: engine throughput with the log off, recording, and echoing like the old print() calls
+if __name__ == "__main__":
+    import tempfile
+    from contextlib import redirect_stdout
+    from coherence_bus import CoherenceBus
+    from mesif_coh import MESIFCoherence
+    from workloads import drive, zipfian
+    from event_log import LOG, read_log  # The engines log through the imported module, not __main__
+
+    def run(ops=100000):
+        bus = CoherenceBus()
+        agents = {vm_id: MESIFCoherence(vm_id, bus, cache_size=64) for vm_id in range(1, 5)}
+        start = time.perf_counter()
+        drive(agents, zipfian(ops, seed=42))
+        return ops / (time.perf_counter() - start)
+
+    print(f"Log off: {run() / 1e3:.0f} K ops/s")
+    LOG.set_level(DEBUG)
+    print(f"Log recording: {run() / 1e3:.0f} K ops/s")
+    LOG.set_level(DEBUG, echo=True)
+    with open(os.devnull, "w") as quiet, redirect_stdout(quiet):
+        echoed = run()
+    print(f"Log echoing to stdout: {echoed / 1e3:.0f} K ops/s")
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        path = os.path.join(log_dir, "events.bin")
+        LOG.set_level(DEBUG)
+        LOG.stream_to(path)
+        run()
+        dropped = LOG.close()
+        lines = sum(1 for _ in read_log(path))
+        print(f"Streamed {lines} events ({os.path.getsize(path)} bytes), {dropped} dropped, "
+              f"{len(LOG.values)} interned values")
+
+    print("\n--- Last events in the ring ---")
+    LOG.dump(last=5)
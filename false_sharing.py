@@ -0,0 +1,180 @@
+import csv
+import os
+from collections import Counter, OrderedDict
+from contextlib import redirect_stdout
+
+LINE_SIZE = 64
+ACCESS_SIZE = 8  # Bytes touched by one access when the caller does not say
+
+
+def _ranges(mask):
+    """
+    Turn a byte mask into [(first byte, last byte)] runs.
+    """
+    ranges = []
+    offset = 0
+    while mask:
+        if mask & 1:
+            start = offset
+            while mask & 1:
+                mask >>= 1
+                offset += 1
+            ranges.append((start, offset - 1))
+        else:
+            skip = (mask & -mask).bit_length() - 1
+            mask >>= skip
+            offset += skip
+    return ranges
+
+
+# Sub-line access tracking: which bytes of each line every VM touched since it last fetched the line
+class FalseSharingDetector:
+    def __init__(self, line_size=LINE_SIZE):
+        self.line_size = line_size
+        self.masks = {}  # (vm_id, line) -> bytes touched while the VM held its current copy
+        self.footprints = {}  # (vm_id, line) -> every byte the VM ever touched in the line
+        self.lines = {}  # line -> Counter of coherence events by kind
+        self.stats = OrderedDict([("accesses", 0), ("true_sharing", 0), ("false_sharing", 0)])
+
+    def line_of(self, address):
+        """
+        Return (line address, byte offset in the line) for a byte address.
+        """
+        offset = address % self.line_size
+        return address - offset, offset
+
+    def touch(self, vm_id, line, offset, size):
+        self.stats["accesses"] += 1
+        end = min(offset + size, self.line_size)
+        mask = ((1 << (end - offset)) - 1) << offset
+        key = (vm_id, line)
+        self.masks[key] = self.masks.get(key, 0) | mask
+        self.footprints[key] = self.footprints.get(key, 0) | mask
+        return mask
+
+    def refetch(self, vm_id, line):
+        # The VM lost its copy, so earlier accesses no longer explain the next invalidation
+        self.masks.pop((vm_id, line), None)
+
+    def write(self, writer, line, mask, holders):
+        """
+        Classify the invalidation (or update) each holder receives for this write.
+        A holder whose touched bytes do not overlap the written bytes is falsely shared.
+        """
+        events = self.lines.get(line)
+        if events is None:
+            events = self.lines[line] = Counter()
+        for holder in holders:
+            if self.masks.get((holder, line), 0) & mask:
+                kind = "true_sharing"
+            else:
+                kind = "false_sharing"
+                events[f"VM{writer}->VM{holder}"] += 1
+            events[kind] += 1
+            self.stats[kind] += 1
+            self.masks.pop((holder, line), None)
+
+    def flagged(self, min_events=4, threshold=0.5):
+        """
+        Lines with at least min_events invalidations, of which at least threshold were false sharing.
+        """
+        flagged = []
+        for line, events in self.lines.items():
+            total = events["true_sharing"] + events["false_sharing"]
+            if total >= min_events and events["false_sharing"] / total >= threshold:
+                flagged.append(line)
+        return sorted(flagged, key=lambda line: self.lines[line]["false_sharing"], reverse=True)
+
+    def report(self, min_events=4, threshold=0.5):
+        report = []
+        for line in self.flagged(min_events, threshold):
+            events = self.lines[line]
+            vms = OrderedDict((vm_id, _ranges(mask)) for (vm_id, footprint_line), mask
+                              in sorted(self.footprints.items()) if footprint_line == line)
+            report.append(OrderedDict([
+                ("line", hex(line)),
+                ("false_sharing", events["false_sharing"]),
+                ("true_sharing", events["true_sharing"]),
+                ("pairs", OrderedDict((pair, count) for pair, count in events.most_common()
+                                      if pair.startswith("VM"))),
+                ("vm_bytes", vms),
+            ]))
+        return report
+
+    def export_csv(self, path, min_events=4, threshold=0.5):
+        """
+        One row per (flagged line, VM) with the byte ranges that VM touched.
+        """
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["line", "false_sharing", "true_sharing", "vm_id", "byte_ranges"])
+            for entry in self.report(min_events, threshold):
+                for vm_id, ranges in entry["vm_bytes"].items():
+                    writer.writerow([entry["line"], entry["false_sharing"], entry["true_sharing"], vm_id,
+                                     " ".join(f"{start}-{end}" for start, end in ranges)])
+
+    def display_data(self, min_events=4, threshold=0.5):
+        for entry in self.report(min_events, threshold):
+            print(f"{entry['line']}: {entry['false_sharing']} false / {entry['true_sharing']} true invalidations")
+            for vm_id, ranges in entry["vm_bytes"].items():
+                print(f"  VM{vm_id} bytes {', '.join(f'{start}-{end}' for start, end in ranges)}")
+
+
+# Line-granular mode: maps byte addresses onto their line before the protocol engine sees them
+class LineGranularAgent:
+    def __init__(self, agent, detector, access_size=ACCESS_SIZE):
+        self.agent = agent
+        self.vm_id = agent.vm_id
+        self.detector = detector
+        self.access_size = access_size
+
+    def _holds(self, cache, line):
+        entry = cache.cache.get(line)
+        return entry is not None and entry[1] != "I"
+
+    def read(self, address, size=None):
+        line, offset = self.detector.line_of(address)
+        if not self._holds(self.agent.lru_cache, line):
+            self.detector.refetch(self.vm_id, line)
+        self.detector.touch(self.vm_id, line, offset, size or self.access_size)
+        return self.agent.read(line)
+
+    def write(self, address, data, size=None):
+        # The engine stores one value per line; only the byte ranges are tracked per access
+        line, offset = self.detector.line_of(address)
+        if not self._holds(self.agent.lru_cache, line):
+            self.detector.refetch(self.vm_id, line)
+        mask = self.detector.touch(self.vm_id, line, offset, size or self.access_size)
+        holders = [peer_id for peer_id, cache in self.agent.bus.peers(self.vm_id) if self._holds(cache, line)]
+        self.detector.write(self.vm_id, line, mask, holders)
+        self.agent.write(line, data)
+
+
+def run_detector(workload, line_size=LINE_SIZE, vm_count=4):
+    from coherence_bus import CoherenceBus
+    from mesif_coh import MESIFCoherence
+    from workloads import drive
+
+    bus = CoherenceBus(line_size=line_size)
+    detector = FalseSharingDetector(line_size)
+    agents = {vm_id: LineGranularAgent(MESIFCoherence(vm_id, bus, cache_size=64), detector)
+              for vm_id in range(1, vm_count + 1)}
+    with open(os.devnull, "w") as quiet, redirect_stdout(quiet):
+        drive(agents, workload)
+    return bus, detector
+
+
+# Test Scenarios: per-VM fields packed into shared lines, then genuinely shared lines
+if __name__ == "__main__":
+    from workloads import false_sharing, producer_consumer
+
+    for name, workload in [("false_sharing", false_sharing(20000, lines=4, seed=42)),
+                           ("producer_consumer", producer_consumer(20000, lines=4, seed=42))]:
+        bus, detector = run_detector(workload)
+        print(f"\n--- {name} ---")
+        for key, value in detector.stats.items():
+            print(f"{key}: {value}")
+        print(f"invalidations: {bus.traffic['invalidations']}")
+        flagged = detector.flagged()
+        print(f"Flagged lines: {len(flagged)}")
+        detector.display_data()
@@ -0,0 +1,287 @@
+import argparse
+import heapq
+import random
+from collections import OrderedDict, deque
+from dragon_coh import MESSAGE_HEADER_BYTES
+
+LINK_GBPS = 32.0  # Usable link bandwidth in GB/s, i.e. bytes per ns
+DEVICE_GBPS = 24.0  # Rate the device's media serves requests at, one at a time in arrival order
+DEVICE_NS = 150.0  # Device access latency on top of its service time; overlaps with other requests
+DEVICE_MESSAGES = ["device_reads", "device_writes"]  # Kinds that queue at the device after the link
+
+
+def message_bytes(line_size):
+    """
+    Bytes each kind of coherence message puts on a link carrying line_size byte lines. Writebacks are
+    not listed: each one goes through write_memory and is already counted as a device write.
+    """
+    return OrderedDict([
+        ("device_reads", MESSAGE_HEADER_BYTES + line_size),
+        ("device_writes", MESSAGE_HEADER_BYTES + line_size),
+        ("cache_to_cache", MESSAGE_HEADER_BYTES + line_size),
+        ("update_deliveries", MESSAGE_HEADER_BYTES + line_size),  # One message per sharer updated
+        ("invalidations", MESSAGE_HEADER_BYTES),
+        ("upgrades", MESSAGE_HEADER_BYTES),
+    ])
+
+
+# Scheduling policies: push((arrival, vm_id, size, to device)), pop() -> the request the link serves next
+class FIFOScheduler:
+    def __init__(self, weights):
+        self.queue = deque()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def push(self, request):
+        self.queue.append(request)
+
+    def pop(self):
+        return self.queue.popleft()
+
+
+class RoundRobinScheduler:
+    def __init__(self, weights):
+        self.queues = OrderedDict((vm_id, deque()) for vm_id in weights)
+        self.order = deque(weights)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def push(self, request):
+        self.queues[request[1]].append(request)
+        self.count += 1
+
+    def pop(self):
+        while not self.queues[self.order[0]]:
+            self.order.rotate(-1)
+        vm_id = self.order[0]
+        self.order.rotate(-1)
+        self.count -= 1
+        return self.queues[vm_id].popleft()
+
+
+class WeightedFairScheduler:
+    """
+    Self-clocked fair queueing: each request is tagged with a virtual finish time of
+    max(virtual time, the VM's last tag) + size / weight, and the smallest tag goes first.
+    """
+    def __init__(self, weights):
+        self.weights = weights
+        self.heap = []
+        self.last_tag = {vm_id: 0.0 for vm_id in weights}
+        self.virtual_time = 0.0
+        self.sequence = 0  # Keeps equal tags in arrival order
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, request):
+        vm_id = request[1]
+        tag = max(self.virtual_time, self.last_tag[vm_id]) + request[2] / self.weights[vm_id]
+        self.last_tag[vm_id] = tag
+        heapq.heappush(self.heap, (tag, self.sequence, request))
+        self.sequence += 1
+
+    def pop(self):
+        tag, _, request = heapq.heappop(self.heap)
+        self.virtual_time = tag
+        return request
+
+
+SCHEDULERS = {
+    "fifo": FIFOScheduler,
+    "rr": RoundRobinScheduler,
+    "wfq": WeightedFairScheduler,
+}
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+def fair_shares(demands, weights, capacity):
+    """
+    Weighted max-min fair allocation: VMs asking for less than their weighted share get their demand,
+    and what they leave is split among the rest by weight.
+    """
+    shares = {}
+    remaining = dict(demands)
+    while remaining:
+        total_weight = sum(weights[vm_id] for vm_id in remaining)
+        satisfied = {vm_id: demand for vm_id, demand in remaining.items()
+                     if demand <= capacity * weights[vm_id] / total_weight}
+        if not satisfied:
+            for vm_id in remaining:
+                shares[vm_id] = capacity * weights[vm_id] / total_weight
+            break
+        for vm_id, demand in satisfied.items():
+            shares[vm_id] = demand
+            capacity -= demand
+            del remaining[vm_id]
+    return shares
+
+
+# One link shared by every VM, in front of one device: requests queue per policy and are serialised
+# at the link bandwidth. Device reads and writes then queue again at the device, which serves them
+# in the order they come off the link at device_gbps, each taking device_ns more to complete.
+class SharedLink:
+    def __init__(self, policy="fifo", weights=None, bandwidth_gbps=LINK_GBPS, device_ns=DEVICE_NS,
+                 device_gbps=DEVICE_GBPS):
+        if policy not in SCHEDULERS:
+            raise ValueError(f"Scheduling policy must be one of {sorted(SCHEDULERS)}, got {policy}.")
+        self.policy = policy
+        self.weights = weights
+        self.bandwidth = bandwidth_gbps
+        self.device_ns = device_ns
+        self.device_bandwidth = device_gbps
+
+    def run(self, arrivals, horizon=None):
+        """
+        Serve [(arrival ns, vm_id, bytes, to device)] sorted by arrival. Only requests arriving by the
+        horizon are measured, and throughput counts what completed by then. The default horizon is the
+        first VM's last arrival, so every VM is still offering load for the whole measured window.
+        """
+        last_arrival = OrderedDict()
+        for arrival, vm_id, _, _ in arrivals:
+            last_arrival[vm_id] = arrival
+        weights = self.weights or {vm_id: 1.0 for vm_id in sorted(last_arrival)}
+        scheduler = SCHEDULERS[self.policy](weights)
+        horizon = horizon if horizon is not None else min(last_arrival.values(), default=0.0)
+        latencies = {vm_id: [] for vm_id in weights}
+        served = {vm_id: 0 for vm_id in weights}
+        offered = {vm_id: 0 for vm_id in weights}
+        now = 0.0
+        device_free = 0.0  # When the device finishes the requests already handed to it
+        device_busy = 0.0
+        device_wait = []
+        device_offered = 0
+        index = 0
+        while index < len(arrivals) or len(scheduler):
+            if not len(scheduler) and arrivals[index][0] > now:
+                now = arrivals[index][0]  # Link idle until the next request arrives
+            while index < len(arrivals) and arrivals[index][0] <= now:
+                scheduler.push(arrivals[index])
+                if arrivals[index][0] <= horizon:
+                    offered[arrivals[index][1]] += arrivals[index][2]
+                    device_offered += arrivals[index][2] if arrivals[index][3] else 0
+                index += 1
+            arrival, vm_id, size, to_device = scheduler.pop()
+            now += size / self.bandwidth
+            done = now
+            if to_device:
+                start = max(now, device_free)
+                device_free = start + size / self.device_bandwidth
+                done = device_free + self.device_ns
+                if start <= horizon:
+                    device_busy += min(device_free, horizon) - start
+                if arrival <= horizon:
+                    device_wait.append(start - now)
+            if arrival <= horizon:
+                latencies[vm_id].append(done - arrival)
+            if done <= horizon:
+                served[vm_id] += size
+        # Every byte crosses the link, device bytes also cross the device: the slower of the two bounds the total
+        total = sum(offered.values())
+        capacity = min(self.bandwidth, self.device_bandwidth * total / device_offered if device_offered else self.bandwidth)
+        report = self.report(latencies, served, offered, weights, horizon, capacity)
+        report["device_utilization"] = device_busy / horizon if horizon else 0.0
+        report["device_wait_ns"] = sum(device_wait) / len(device_wait) if device_wait else 0.0
+        return report
+
+    def report(self, latencies, served, offered, weights, horizon, capacity):
+        report = OrderedDict()
+        demands = {vm_id: offered[vm_id] / horizon if horizon else 0.0 for vm_id in weights}
+        fair = fair_shares(demands, weights, capacity)
+        ratios = []
+        for vm_id in weights:
+            ordered = sorted(latencies[vm_id])
+            throughput = served[vm_id] / horizon if horizon else 0.0  # bytes per ns, i.e. GB/s
+            ratios.append(throughput / fair[vm_id] if fair[vm_id] else 1.0)
+            report[vm_id] = OrderedDict([
+                ("requests", len(ordered)),
+                ("offered_gbps", demands[vm_id]),
+                ("throughput_gbps", throughput),
+                ("fair_share_gbps", fair[vm_id]),
+                ("mean_ns", sum(ordered) / len(ordered) if ordered else 0.0),
+                ("p50_ns", _percentile(ordered, 0.5)),
+                ("p99_ns", _percentile(ordered, 0.99)),
+                ("p999_ns", _percentile(ordered, 0.999)),
+            ])
+        # Jain's index over throughput relative to the weighted max-min fair share: 1.0 is perfectly fair
+        total = sum(ratios)
+        report["fairness"] = total * total / (len(ratios) * sum(ratio * ratio for ratio in ratios)) if total else 1.0
+        return report
+
+
+def link_messages(agents, bus, workload):
+    """
+    Drive the agents and yield (vm_id, bytes, to device) for every message each access put on the link.
+    """
+    payloads = {vm_id: f"VM{vm_id}".encode() for vm_id in agents}
+    sizes = message_bytes(bus.line_size)
+    kinds = [kind for kind in sizes if kind in bus.traffic]
+    for vm_id, op, address in workload:
+        before = [bus.traffic[kind] for kind in kinds]
+        if op == "R":
+            agents[vm_id].read(address)
+        else:
+            agents[vm_id].write(address, payloads[vm_id])
+        for kind, count in zip(kinds, before):
+            for _ in range(bus.traffic[kind] - count):
+                yield vm_id, sizes[kind], kind in DEVICE_MESSAGES
+
+
+def poisson_arrivals(messages, rates, seed=0):
+    """
+    Give each VM's messages, in order, Poisson arrival times at rates[vm_id] requests per ns.
+    """
+    rng = random.Random(seed)
+    clocks = {vm_id: 0.0 for vm_id in rates}
+    arrivals = []
+    for vm_id, size, to_device in messages:
+        clocks[vm_id] += rng.expovariate(rates[vm_id])
+        arrivals.append((clocks[vm_id], vm_id, size, to_device))
+    arrivals.sort()
+    return arrivals
+
+
+# Benchmark: a noisy neighbour pushes the link past capacity; who keeps their latency under each policy?
+if __name__ == "__main__":
+    from coherence_bus import CoherenceBus
+    from mesif_coh import MESIFCoherence
+    from workloads import WORKLOADS
+
+    parser = argparse.ArgumentParser(description="Queueing on a CXL link shared by several VMs")
+    parser.add_argument("--workload", default="partitioned", choices=sorted(WORKLOADS))
+    parser.add_argument("--ops", type=int, default=100000)
+    parser.add_argument("--bandwidth", type=float, default=LINK_GBPS, help="Link bandwidth in GB/s")
+    parser.add_argument("--load", type=float, default=2.0, help="Offered load as a fraction of the link")
+    parser.add_argument("--noisy", type=float, default=4.0, help="How much more VM1 offers than each other VM")
+    args = parser.parse_args()
+
+    vm_count = 4
+    bus = CoherenceBus()
+    agents = {vm_id: MESIFCoherence(vm_id, bus, cache_size=64) for vm_id in range(1, vm_count + 1)}
+    messages = list(link_messages(agents, bus, WORKLOADS[args.workload](args.ops, vm_count=vm_count, seed=42)))
+    mean_size = sum(size for _, size, _ in messages) / len(messages)
+    # Per-VM request rates that add up to the offered load, VM1 taking `noisy` shares
+    shares = {vm_id: args.noisy if vm_id == 1 else 1.0 for vm_id in agents}
+    capacity = args.bandwidth / mean_size  # requests per ns
+    rates = {vm_id: args.load * capacity * share / sum(shares.values()) for vm_id, share in shares.items()}
+    arrivals = poisson_arrivals(messages, rates)
+    print(f"{len(messages)} link messages, mean {mean_size:.0f} bytes, offered load {args.load:.0%} "
+          f"of {args.bandwidth:.0f} GB/s, VM1 offers {args.noisy:.0f}x the others")
+
+    for policy, weights in [("fifo", None), ("rr", None), ("wfq", None),
+                            ("wfq", {1: 1.0, 2: 2.0, 3: 1.0, 4: 1.0})]:
+        report = SharedLink(policy, weights, args.bandwidth).run(arrivals)
+        label = policy if weights is None else f"{policy} {weights}"
+        print(f"\n--- {label}: fairness {report['fairness']:.3f}, device {report['device_utilization']:.0%} busy, "
+              f"mean device queue {report['device_wait_ns']:.0f} ns ---")
+        for vm_id in agents:
+            stats = report[vm_id]
+            print(f"VM{vm_id}: {stats['throughput_gbps']:5.2f} of {stats['offered_gbps']:5.2f} GB/s "
+                  f"(fair {stats['fair_share_gbps']:5.2f})  mean={stats['mean_ns']:9.0f} ns  "
+                  f"p50={stats['p50_ns']:9.0f}  p99={stats['p99_ns']:9.0f}  p99.9={stats['p999_ns']:9.0f}")
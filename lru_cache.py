@@ -1,9 +1,15 @@
 from collections import OrderedDict
+from event_log import LOG, EVICT
+
+LINE_SIZE = 64
 
 class LRUCache:
-    def __init__(self, capacity):
+    def __init__(self, capacity, on_evict=None, ways=None, line_size=LINE_SIZE):
         self.capacity = capacity
         self.cache = OrderedDict()
+        self.on_evict = on_evict  # Called with (key, value) so dirty lines can be written back
+        self.ways = ways  # None for fully associative, else lines per set; keys are integer line addresses
+        self.line_size = line_size  # The owner's line size, so consecutive lines map to consecutive sets
         self.miss_count = 0
         self.total_count = 0
 
@@ -14,12 +20,26 @@ class LRUCache:
             return f"Cache hit: {key} -> {self.cache[key]}"
         else:
             self.miss_count += 1
-            if len(self.cache) >= self.capacity:
-                evicted_key, evicted_value = self.cache.popitem(last=False)
-                print(f"Evicting LRU: {evicted_key} -> {evicted_value}")
+            victim = self._victim(key)
+            if victim is not None:
+                evicted_key, evicted_value = victim, self.cache.pop(victim)
+                LOG.emit(EVICT, address=evicted_key)
+                if self.on_evict is not None:
+                    self.on_evict(evicted_key, evicted_value)
             self.cache[key] = value
             return f"Cache miss: Added {key} -> {value}"
 
+    def set_of(self, key):
+        return key // self.line_size % max(self.capacity // self.ways, 1)
+
+    def _victim(self, key):
+        if self.ways is None:
+            return next(iter(self.cache)) if len(self.cache) >= self.capacity else None
+        # The OrderedDict is in LRU order, so the first member of the set is its LRU way
+        index = self.set_of(key)
+        members = [other for other in self.cache if self.set_of(other) == index]
+        return members[0] if len(members) >= self.ways else None
+
     def display(self):
         return list(self.cache.items())
 
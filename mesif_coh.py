@@ -0,0 +1,180 @@
+from lru_cache import LRUCache
+from atomics import AtomicOps
+from coherence_bus import CoherenceBus
+from event_log import LOG, FETCH, FORWARD, INVALIDATE, READ_HIT, READ_MISS, WRITE, WRITE_HIT, WRITE_MISS
+
+
+# MESIF Coherence: one sharer holds F and answers read misses instead of the device
+class MESIFCoherence(AtomicOps):
+    def __init__(self, vm_id, bus, cache_size=2, forwarding=True):
+        self.vm_id = vm_id
+        self.bus = bus
+        self.forwarding = forwarding  # False gives plain MESI for head to head runs
+        self.lru_cache = LRUCache(cache_size, on_evict=self._evict, line_size=bus.line_size)
+        self.bus.attach(vm_id, self.lru_cache, "mesif" if forwarding else "mesi")
+
+    def _evict(self, address, line):
+        self.bus.back_invalidate(self.vm_id, address)
+        if line[1] == "M":
+            self.bus.traffic["writebacks"] += 1
+            self.bus.stats.writeback(self.vm_id)
+            self.bus.write_memory(self.vm_id, address, line[0])
+
+    def _fill(self, address, data, state):
+        if address in self.lru_cache.cache:
+            # Line was held in I, so this is a coherence miss rather than a capacity miss
+            self.lru_cache.total_count += 1
+            self.lru_cache.miss_count += 1
+            self.lru_cache.cache.move_to_end(address)
+            self.lru_cache.cache[address] = [data, state]
+        else:
+            self.lru_cache.access(address, [data, state])
+
+    def _find_responder(self, address):
+        """
+        Return the peer allowed to answer a read miss and whether any peer holds the line.
+        """
+        responder = None
+        shared = False
+        for peer_id, cache in self.bus.peers(self.vm_id):
+            line = cache.cache.get(address)
+            if line is None or line[1] == "I":
+                continue
+            shared = True
+            if line[1] == "M" or (self.forwarding and line[1] in ["F", "E"]):
+                responder = (peer_id, line)
+        return responder, shared
+
+    def read(self, address):
+        address &= self.bus.line_mask
+        line = self.lru_cache.cache.get(address)
+        if line is not None and line[1] != "I":
+            self.lru_cache.access(address)
+            self.bus.stats.hit(self.vm_id, "read", line[1])
+            LOG.emit(READ_HIT, self.vm_id, address, line[1])
+            return self.bus.line(line[0])
+
+        LOG.emit(READ_MISS, self.vm_id, address)
+        self.bus.stats.miss(self.vm_id, "read", "-" if line is None else line[1])
+        responder, shared = self._find_responder(address)
+        if responder is not None:
+            peer_id, peer_line = responder
+            if peer_line[1] == "M":
+                self.bus.traffic["writebacks"] += 1
+                self.bus.stats.writeback(peer_id)
+                self.bus.write_memory(peer_id, address, peer_line[0])
+            data = peer_line[0]
+            peer_line[1] = "S"
+            self.bus.traffic["cache_to_cache"] += 1
+            self.bus.stats.transfer(peer_id, self.vm_id, address)
+            LOG.emit(FORWARD, self.vm_id, address, peer=peer_id)
+        else:
+            data = self.bus.read_memory(self.vm_id, address)
+            if not self.forwarding:
+                # Plain MESI drops E once a second reader appears
+                for peer_id, cache in self.bus.peers(self.vm_id):
+                    peer_line = cache.cache.get(address)
+                    if peer_line is not None and peer_line[1] == "E":
+                        peer_line[1] = "S"
+
+        if not shared:
+            state = "E"
+        elif self.forwarding:
+            state = "F"  # The most recent requester takes over forwarding
+        else:
+            state = "S"
+        self._fill(address, data, state)
+        LOG.emit(FETCH, self.vm_id, address, state)
+        return self.bus.line(data)
+
+    def write(self, address, data):
+        address &= self.bus.line_mask
+        line = self.lru_cache.cache.get(address)
+        if line is not None and line[1] in ["M", "E"]:
+            self.lru_cache.access(address)
+            self.bus.stats.hit(self.vm_id, "write", line[1])
+            LOG.emit(WRITE_HIT, self.vm_id, address, line[1])
+            self.lru_cache.cache[address] = [data, "M"]
+            return
+
+        if line is not None and line[1] in ["S", "F"]:
+            self.bus.traffic["upgrades"] += 1
+            self.bus.stats.upgrade(self.vm_id, address)
+            self.lru_cache.access(address)
+            self.lru_cache.cache[address] = [data, "M"]
+        else:
+            LOG.emit(WRITE_MISS, self.vm_id, address)
+            self.bus.stats.miss(self.vm_id, "write", "-" if line is None else line[1])
+            self._fill(address, data, "M")
+        self.invalidate_peers(address)
+        LOG.emit(WRITE, self.vm_id, address, "MODIFIED")
+
+    def _own(self, address, op):
+        """
+        Read for ownership: one transaction that brings the line's data in and leaves it in M.
+        """
+        line = self.lru_cache.cache.get(address)
+        if line is not None and line[1] in ["M", "E"]:
+            self.lru_cache.access(address)
+            self.bus.stats.hit(self.vm_id, op, line[1])
+            line[1] = "M"
+            return line
+
+        if line is not None and line[1] in ["S", "F"]:
+            self.bus.traffic["upgrades"] += 1
+            self.bus.stats.upgrade(self.vm_id, address)
+            self.lru_cache.access(address)
+            line[1] = "M"
+        else:
+            self.bus.stats.miss(self.vm_id, op, "-" if line is None else line[1])
+            responder, _ = self._find_responder(address)
+            if responder is not None:
+                # A dirty line moves with its ownership, so it is not written back
+                peer_id, peer_line = responder
+                data = peer_line[0]
+                self.bus.traffic["cache_to_cache"] += 1
+                self.bus.stats.transfer(peer_id, self.vm_id, address)
+                LOG.emit(FORWARD, self.vm_id, address, peer=peer_id)
+            else:
+                data = self.bus.read_memory(self.vm_id, address)
+            self._fill(address, data, "M")
+            line = self.lru_cache.cache[address]
+        self.invalidate_peers(address)
+        return line
+
+    def invalidate_peers(self, address):
+        for peer_id, cache in self.bus.peers(self.vm_id):
+            line = cache.cache.get(address)
+            if line is not None and line[1] != "I":
+                # A whole-line write supersedes a peer's dirty copy, so no writeback is needed
+                line[1] = "I"
+                self.bus.back_invalidate(peer_id, address)
+                self.bus.traffic["invalidations"] += 1
+                self.bus.stats.invalidation(self.vm_id, peer_id, address)
+                LOG.emit(INVALIDATE, self.vm_id, address, peer=peer_id)
+
+
+# Test Scenarios: widely shared, read-heavy data
+def run_shared_reads(forwarding, vm_count=4, rounds=3):
+    bus = CoherenceBus()
+    vms = [MESIFCoherence(vm_id, bus, cache_size=2, forwarding=forwarding) for vm_id in range(1, vm_count + 1)]
+    bus.store(0xAC0, b"Data")
+
+    for _ in range(rounds):
+        for vm in vms:
+            vm.read(0xAC0)
+        vms[0].write(0xAC0, b"Updated Data")
+    return bus
+
+
+if __name__ == "__main__":
+    print("\n--- MESI baseline ---")
+    mesi_bus = run_shared_reads(forwarding=False)
+
+    print("\n--- MESIF ---")
+    mesif_bus = run_shared_reads(forwarding=True)
+
+    print("\n--- Traffic: MESI ---")
+    mesi_bus.display_traffic()
+    print("\n--- Traffic: MESIF ---")
+    mesif_bus.display_traffic()
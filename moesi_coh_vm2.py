@@ -5,6 +5,9 @@ import sys
 import json
 from lru_cache import *
 from dax_parser import *
+from dax_writer import VERSION_CONFLICT
+from event_log import (LOG, EXCLUSIVE, FETCH, INVALIDATE, MEMORY_READ, OWNED, READ_HIT, READ_MISS,
+                       SCRIPT_OUTPUT, SHARE, WRITE)
 
 
 # MESI Coherence for VM2
@@ -34,21 +37,21 @@ class MESICoherence:
         self.read_from_local_cache(self.vm2_cache_filename)
         if self.address in self.lru_cache.cache.keys():
             state = self.lru_cache.cache[self.address]
-            print(f"VM2 READ hit: address {self.address}, State {state}")
+            LOG.emit(READ_HIT, 2, self.address, state[1])
             if state[1] == "I":
-                print(f"Read from the Memory for {self.address}, as state: {state}")
+                LOG.emit(MEMORY_READ, 2, self.address, state[1])
                 output = self.run_daxreader(self.address)
                 self.parse_shared_cache(output, self.address)
                 self.lru_cache.access(self.address, "S")
                 return True
             elif state[1] in ["E", "O"]:
-                print(f"VM1 READ Hit change {state} to Shared: address {self.address}")
+                LOG.emit(SHARE, 2, self.address, state[1])
                 self.read_from_local_cache(self.vm1_cache_filename)
                 self.lru_cache.cache[self.address] = [self.data, "S"]
                 self.write_to_local_cache(self.vm1_cache_filename)
                 return True
         else:
-            print(f"VM2 READ miss: address {self.address}")
+            LOG.emit(READ_MISS, 2, self.address)
             self.lru_cache.cache[self.address] = [self.data, "I"]
             output = self.run_daxreader(self.address)
             self.parse_shared_cache(output, self.address)
@@ -58,33 +61,35 @@ class MESICoherence:
         self.dax_parser.dax_output = output
         self.dax_parser.parse()
         data = self.dax_parser.read_address(address)
-        print(data)
         self.read_from_local_cache(self.vm2_cache_filename)
         self.lru_cache.cache[self.address] = [data, "S"]
         self.write_to_local_cache(self.vm2_cache_filename)
-        print(f"VM2 FETCH: Address {address} set to SHARED")
+        LOG.emit(FETCH, 2, address, "SHARED")
 
     def write(self):
         vm1_exists = self.invalidate_vm1_cache(self.address)
-        output = self.run_daxreader(self.address)
-        self.dax_parser.dax_output = output
-        self.dax_parser.parse()
-        self.lru_cache.cache[self.address] = [self.data, "M"]
-        self.dax_parser.write_address(self.address, self.data)
-        self.run_daxwriter(self.dax_parser.data)
+        # Read-modify-write of the shared dict: if the other VM rewrote it in between, re-read and retry
+        while True:
+            output = self.run_daxreader(self.address)
+            self.dax_parser.dax_output = output
+            self.dax_parser.parse()
+            self.lru_cache.cache[self.address] = [self.data, "M"]
+            self.dax_parser.write_address(self.address, self.data)
+            if self.run_daxwriter(self.dax_parser.data, self.dax_parser.version):
+                break
         if not vm1_exists:
             self.read_from_local_cache(self.vm2_cache_filename)
             self.lru_cache.cache[self.address] = [self.data, "E"]
             self.write_to_local_cache(self.vm2_cache_filename)
-            print(f"VM2 EXCLUSIVE: Address {self.address}")
+            LOG.emit(EXCLUSIVE, 2, self.address)
         else:
             self.read_from_local_cache(self.vm1_cache_filename)
             self.lru_cache.cache[self.address] = [self.data, "O"]
             self.write_to_local_cache(self.vm1_cache_filename)
-            print(f"VM1 OWNED: Address {self.address}")
+            LOG.emit(OWNED, 2, self.address)
             self.invalidate_vm1_cache(self.address)
 
-        print(f"VM2 WRITE: address {self.address} set to MODIFIED")
+        LOG.emit(WRITE, 2, self.address, "MODIFIED")
 
     def invalidate_vm1_cache(self, address):
         is_exists = self.read_from_local_cache(self.vm1_cache_filename)
@@ -93,14 +98,15 @@ class MESICoherence:
                 data = self.lru_cache.cache[self.address][0]
                 self.lru_cache.cache[self.address] = [data, "I"]
                 self.write_to_local_cache(self.vm1_cache_filename)
-                print(f"VM1 INVALIDATE: Address {address}")
+                LOG.emit(INVALIDATE, 2, address, peer=1)
                 return True
             else:
                 return False
 
-    def run_daxwriter(self, message):
+    def run_daxwriter(self, message, version=None):
         """
-        Runs the daxwriter.sh script with the given message.
+        Runs the daxwriter.sh script with the given message. With the version the reader saw,
+        returns False if the shared dict has been rewritten since, so the caller can retry.
         """
         script_path = "./ap_ad.sh"  # Path to the shell script
 
@@ -112,18 +118,20 @@ class MESICoherence:
                 message_str = message  # Use directly if already a string
 
             # Run the shell script with the message as an argument
+            args = [script_path, message_str] if version is None else [script_path, message_str, str(version)]
             result = subprocess.run(
-                [script_path, message_str],
+                args,
                 text=True,  # Capture output as text (not bytes)
                 capture_output=True,  # Capture standard output and error
                 check=True  # Raise an exception for non-zero exit codes
             )
 
-            # Print the script's output
-            print("Script output:")
-            print(result.stdout)
+            LOG.emit(SCRIPT_OUTPUT, 2, script_path, len(result.stdout))
+            return True
 
         except subprocess.CalledProcessError as e:
+            if e.returncode == VERSION_CONFLICT:
+                return False
             # Handle script execution errors
             print("Error occurred while running the script:")
             print(e.stderr)
@@ -131,6 +139,7 @@ class MESICoherence:
             print(f"Error: Script {script_path} not found. Ensure the path is correct.")
         except Exception as e:
             print(f"Unexpected error: {e}")
+        return True  # Other failures are reported above, not retried
 
     def run_daxreader(self, address):
 
@@ -147,8 +156,7 @@ class MESICoherence:
                 text=True,  # Ensure output is a string
                 capture_output=True  # Capture stdout and stderr
             )
-            print("Shell script output:")
-            print(result.stdout)
+            LOG.emit(SCRIPT_OUTPUT, 2, script_path, len(result.stdout))
 
             return result.stdout
 
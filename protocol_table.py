@@ -0,0 +1,280 @@
+import sys
+import time
+from lru_cache import LRUCache
+from event_log import (LOG, DIR_READ_MISS, DIR_READ_OWNER, DIR_READ_SHARED, DIR_WRITE_HIT, DIR_WRITE_MISS,
+                       FETCH, FORWARD, INVALIDATE, READ_HIT, READ_MISS, WRITE, WRITE_HIT, WRITE_MISS)
+
+# Events a line can see: the local VM's accesses, fills after a miss, and requests snooped from peers
+EVENTS = ["read", "write", "fill", "fill_shared", "bus_read", "bus_write", "evict"]
+READ, WRITE_EVENT, FILL, FILL_SHARED, BUS_READ, BUS_WRITE, EVICT = range(len(EVENTS))
+# Directory events: the requester is or is not already among the block's owners
+DIRECTORY_EVENTS = ["read", "read_owner", "write", "write_owner"]
+DIR_READ, DIR_READ_BY_OWNER, DIR_WRITE, DIR_WRITE_BY_OWNER = range(len(DIRECTORY_EVENTS))
+
+# Action bits
+HIT = 1  # Served from the local copy
+MISS = 2  # Needs the line from a peer or the device
+UPGRADE = 4  # Local copy is current, peers must be invalidated
+SUPPLY = 8  # This peer answers the miss cache to cache
+WRITEBACK = 16  # Dirty data goes back to the device
+INVALIDATE_LINE = 32  # This copy is invalidated
+SET_OWNER = 64  # Directory: the requester becomes the only owner
+ADD_OWNER = 128  # Directory: the requester joins the owners
+INVALIDATE_OTHERS = 256  # Directory: every other owner is invalidated
+
+
+# A protocol as data: {(state, event): (next state, actions[, log event])}, compiled at load time into
+# one flat list indexed by state offset + event. Pairs the table leaves out keep their state and do nothing.
+class ProtocolTable:
+    def __init__(self, name, states, transitions, events=EVENTS):
+        self.name = name
+        self.states = states
+        self.invalid = states[0]
+        self.events = events
+        self.offsets = {state: index * len(events) for index, state in enumerate(states)}
+        self.table = [(state, 0, None) for state in states for _ in events]
+        for (state, event), entry in transitions.items():
+            if state not in self.offsets or event not in events:
+                raise ValueError(f"{name}: unknown transition ({state}, {event}).")
+            if entry[0] not in self.offsets:
+                raise ValueError(f"{name}: ({state}, {event}) goes to unknown state {entry[0]}.")
+            self.table[self.offsets[state] + events.index(event)] = (entry[0], entry[1], entry[2] if len(entry) > 2 else None)
+
+    def dispatch(self, state, event):
+        return self.table[self.offsets[state] + event]
+
+
+MESI = ProtocolTable("mesi", ["I", "S", "E", "M"], {
+    ("I", "read"): ("I", MISS),
+    ("S", "read"): ("S", HIT),
+    ("E", "read"): ("E", HIT),
+    ("M", "read"): ("M", HIT),
+    ("I", "fill"): ("E", 0),
+    ("I", "fill_shared"): ("S", 0),
+    ("I", "write"): ("M", MISS),
+    ("S", "write"): ("M", UPGRADE),
+    ("E", "write"): ("M", HIT),
+    ("M", "write"): ("M", HIT),
+    ("E", "bus_read"): ("S", 0),
+    ("M", "bus_read"): ("S", SUPPLY | WRITEBACK),
+    ("S", "bus_write"): ("I", INVALIDATE_LINE),
+    ("E", "bus_write"): ("I", INVALIDATE_LINE),
+    ("M", "bus_write"): ("I", INVALIDATE_LINE),  # A whole-line write supersedes the dirty copy
+    ("M", "evict"): ("I", WRITEBACK),
+})
+
+# MESIF: the most recent sharer holds F and answers read misses instead of the device
+MESIF = ProtocolTable("mesif", ["I", "S", "F", "E", "M"], {
+    ("I", "read"): ("I", MISS),
+    ("S", "read"): ("S", HIT),
+    ("F", "read"): ("F", HIT),
+    ("E", "read"): ("E", HIT),
+    ("M", "read"): ("M", HIT),
+    ("I", "fill"): ("E", 0),
+    ("I", "fill_shared"): ("F", 0),
+    ("I", "write"): ("M", MISS),
+    ("S", "write"): ("M", UPGRADE),
+    ("F", "write"): ("M", UPGRADE),
+    ("E", "write"): ("M", HIT),
+    ("M", "write"): ("M", HIT),
+    ("F", "bus_read"): ("S", SUPPLY),
+    ("E", "bus_read"): ("S", SUPPLY),
+    ("M", "bus_read"): ("S", SUPPLY | WRITEBACK),
+    ("S", "bus_write"): ("I", INVALIDATE_LINE),
+    ("F", "bus_write"): ("I", INVALIDATE_LINE),
+    ("E", "bus_write"): ("I", INVALIDATE_LINE),
+    ("M", "bus_write"): ("I", INVALIDATE_LINE),
+    ("M", "evict"): ("I", WRITEBACK),
+})
+
+# MOESI: a dirty line is shared in O without writing it back; O answers misses and writes back on eviction
+MOESI = ProtocolTable("moesi", ["I", "S", "E", "O", "M"], {
+    ("I", "read"): ("I", MISS),
+    ("S", "read"): ("S", HIT),
+    ("E", "read"): ("E", HIT),
+    ("O", "read"): ("O", HIT),
+    ("M", "read"): ("M", HIT),
+    ("I", "fill"): ("E", 0),
+    ("I", "fill_shared"): ("S", 0),
+    ("I", "write"): ("M", MISS),
+    ("S", "write"): ("M", UPGRADE),
+    ("O", "write"): ("M", UPGRADE),
+    ("E", "write"): ("M", HIT),
+    ("M", "write"): ("M", HIT),
+    ("E", "bus_read"): ("S", SUPPLY),
+    ("O", "bus_read"): ("O", SUPPLY),
+    ("M", "bus_read"): ("O", SUPPLY),
+    ("S", "bus_write"): ("I", INVALIDATE_LINE),
+    ("E", "bus_write"): ("I", INVALIDATE_LINE),
+    ("O", "bus_write"): ("I", INVALIDATE_LINE),
+    ("M", "bus_write"): ("I", INVALIDATE_LINE),
+    ("O", "evict"): ("I", WRITEBACK),
+    ("M", "evict"): ("I", WRITEBACK),
+})
+
+# Shared directory entries: U (uncached), S (shared by the owners), M (modified by its one owner)
+DIRECTORY = ProtocolTable("directory", ["U", "S", "M"], {
+    ("U", "read"): ("S", SET_OWNER, DIR_READ_MISS),
+    ("S", "read"): ("S", ADD_OWNER, DIR_READ_SHARED),
+    ("M", "read"): ("S", ADD_OWNER, DIR_READ_OWNER),
+    ("U", "write"): ("M", INVALIDATE_OTHERS | SET_OWNER, DIR_WRITE_MISS),
+    ("S", "write"): ("M", INVALIDATE_OTHERS | SET_OWNER, DIR_WRITE_MISS),
+    ("M", "write"): ("M", INVALIDATE_OTHERS | SET_OWNER, DIR_WRITE_MISS),
+    ("S", "write_owner"): ("M", INVALIDATE_OTHERS | SET_OWNER, DIR_WRITE_MISS),
+    ("M", "write_owner"): ("M", 0, DIR_WRITE_HIT),
+}, DIRECTORY_EVENTS)
+
+TABLES = {table.name: table for table in [MESI, MESIF, MOESI]}
+
+
+def directory_access(directory, block, vm_id, op):
+    """
+    Apply one VM's read ("R") or write ("W") of a block to a shared Directory through the DIRECTORY table.
+    """
+    state_info = directory.get_state(block)
+    owners = state_info["owners"]
+    if op == "R":
+        event = DIR_READ_BY_OWNER if vm_id in owners else DIR_READ
+    else:
+        event = DIR_WRITE_BY_OWNER if vm_id in owners else DIR_WRITE
+    next_state, actions, log = DIRECTORY.dispatch(state_info["state"], event)
+    if log is not None:
+        LOG.emit(log, vm_id, block, peer=owners[0] if owners else 0)
+    if actions & INVALIDATE_OTHERS:
+        directory.invalidate_others(block, vm_id)
+    if actions & SET_OWNER:
+        directory.set_state(block, next_state, [vm_id])
+    elif actions & ADD_OWNER:
+        directory.set_state(block, next_state, owners + [vm_id])
+
+
+# Coherence engine whose every decision is a table lookup: any ProtocolTable over EVENTS plugs in
+class TableCoherence:
+    def __init__(self, vm_id, bus, cache_size=2, table=MESI):
+        self.vm_id = vm_id
+        self.bus = bus
+        self.protocol = TABLES[table] if isinstance(table, str) else table
+        self.table = self.protocol.table
+        self.offsets = self.protocol.offsets
+        self.invalid = self.protocol.invalid
+        self.lru_cache = LRUCache(cache_size, on_evict=self._evict, line_size=bus.line_size)
+        self.bus.attach(vm_id, self.lru_cache, self.protocol.name)
+
+    def _evict(self, address, line):
+        self.bus.back_invalidate(self.vm_id, address)
+        if self.table[self.offsets[line[1]] + EVICT][1] & WRITEBACK:
+            self.bus.traffic["writebacks"] += 1
+            self.bus.stats.writeback(self.vm_id)
+            self.bus.write_memory(self.vm_id, address, line[0])
+
+    def _fill(self, address, data, state):
+        if address in self.lru_cache.cache:
+            # Line was held invalid, so this is a coherence miss rather than a capacity miss
+            self.lru_cache.total_count += 1
+            self.lru_cache.miss_count += 1
+            self.lru_cache.cache.move_to_end(address)
+            self.lru_cache.cache[address] = [data, state]
+        else:
+            self.lru_cache.access(address, [data, state])
+
+    def read(self, address):
+        address &= self.bus.line_mask
+        line = self.lru_cache.cache.get(address)
+        state = self.invalid if line is None else line[1]
+        next_state, actions, _ = self.table[self.offsets[state] + READ]
+        if actions & HIT:
+            self.lru_cache.access(address)
+            self.bus.stats.hit(self.vm_id, "read", state)
+            LOG.emit(READ_HIT, self.vm_id, address, state)
+            line[1] = next_state
+            return self.bus.line(line[0])
+
+        LOG.emit(READ_MISS, self.vm_id, address)
+        self.bus.stats.miss(self.vm_id, "read", "-" if line is None else state)
+        data = None
+        shared = False
+        for peer_id, cache in self.bus.peers(self.vm_id):
+            peer_line = cache.cache.get(address)
+            if peer_line is None or peer_line[1] == self.invalid:
+                continue
+            shared = True
+            peer_state, peer_actions, _ = self.table[self.offsets[peer_line[1]] + BUS_READ]
+            if peer_actions & WRITEBACK:
+                self.bus.traffic["writebacks"] += 1
+                self.bus.stats.writeback(peer_id)
+                self.bus.write_memory(peer_id, address, peer_line[0])
+            if peer_actions & SUPPLY and data is None:
+                data = peer_line[0]
+                self.bus.traffic["cache_to_cache"] += 1
+                self.bus.stats.transfer(peer_id, self.vm_id, address)
+                LOG.emit(FORWARD, self.vm_id, address, peer=peer_id)
+            peer_line[1] = peer_state
+        if data is None:
+            data = self.bus.read_memory(self.vm_id, address)
+        fill_state = self.table[self.offsets[state] + (FILL_SHARED if shared else FILL)][0]
+        self._fill(address, data, fill_state)
+        LOG.emit(FETCH, self.vm_id, address, fill_state)
+        return self.bus.line(data)
+
+    def write(self, address, data):
+        address &= self.bus.line_mask
+        line = self.lru_cache.cache.get(address)
+        state = self.invalid if line is None else line[1]
+        next_state, actions, _ = self.table[self.offsets[state] + WRITE_EVENT]
+        if actions & HIT:
+            self.lru_cache.access(address)
+            self.bus.stats.hit(self.vm_id, "write", state)
+            LOG.emit(WRITE_HIT, self.vm_id, address, state)
+            self.lru_cache.cache[address] = [data, next_state]
+            return
+
+        if actions & UPGRADE:
+            self.bus.traffic["upgrades"] += 1
+            self.bus.stats.upgrade(self.vm_id, address)
+            self.lru_cache.access(address)
+            self.lru_cache.cache[address] = [data, next_state]
+        else:
+            LOG.emit(WRITE_MISS, self.vm_id, address)
+            self.bus.stats.miss(self.vm_id, "write", "-" if line is None else state)
+            self._fill(address, data, next_state)
+        for peer_id, cache in self.bus.peers(self.vm_id):
+            peer_line = cache.cache.get(address)
+            if peer_line is None:
+                continue
+            peer_state, peer_actions, _ = self.table[self.offsets[peer_line[1]] + BUS_WRITE]
+            if peer_actions & INVALIDATE_LINE:
+                peer_line[1] = peer_state
+                self.bus.back_invalidate(peer_id, address)
+                self.bus.traffic["invalidations"] += 1
+                self.bus.stats.invalidation(self.vm_id, peer_id, address)
+                LOG.emit(INVALIDATE, self.vm_id, address, peer=peer_id)
+        LOG.emit(WRITE, self.vm_id, address, "MODIFIED")
+
+
+# Test Scenarios: each table against the hand-written engine it replaces, on the same trace
+if __name__ == "__main__":
+    from coherence_bus import CoherenceBus
+    from mesif_coh import MESIFCoherence
+    from adaptive_coh import AdaptiveBus, AdaptiveCoherence
+    from workloads import drive, zipfian
+
+    ops = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    pairs = [
+        ("mesi", CoherenceBus, lambda vm_id, bus: MESIFCoherence(vm_id, bus, 64, forwarding=False)),
+        ("mesif", CoherenceBus, lambda vm_id, bus: MESIFCoherence(vm_id, bus, 64)),
+        ("moesi", lambda: AdaptiveBus("invalidate"), lambda vm_id, bus: AdaptiveCoherence(vm_id, bus, 64)),
+    ]
+    for name, bus_class, hand_written in pairs:
+        results = []
+        for engine in [hand_written, lambda vm_id, bus: TableCoherence(vm_id, bus, 64, name)]:
+            bus = bus_class()
+            agents = {vm_id: engine(vm_id, bus) for vm_id in range(1, 5)}
+            start = time.perf_counter()
+            drive(agents, zipfian(ops, seed=42))
+            elapsed = time.perf_counter() - start
+            results.append(({key: bus.traffic[key] for key in CoherenceBus().traffic}, elapsed))
+        (hand_traffic, hand_time), (table_traffic, table_time) = results
+        print(f"{name}: hand-written {ops / hand_time / 1e3:.0f} K ops/s, table {ops / table_time / 1e3:.0f} K ops/s, "
+              f"traffic {'identical' if hand_traffic == table_traffic else 'DIFFERS'}")
+        if hand_traffic != table_traffic:
+            print(f"  hand-written {hand_traffic}\n  table        {table_traffic}")
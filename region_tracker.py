@@ -0,0 +1,128 @@
+import os
+import tempfile
+from collections import OrderedDict
+from dax_parser_new import Directory
+from event_log import LOG, REGION_PROMOTE
+
+REGION_SIZE = 4096  # Bytes covered by one region entry
+
+
+# Coarse-grained region coherence in front of the per-line Directory
+# Region states: P (private to one VM), R (read-only, any number of readers), S (shared, tracked per line)
+class RegionTracker:
+    def __init__(self, region_size=REGION_SIZE):
+        self.region_size = region_size
+        self.regions = {}
+        self.pending = {}  # Lines to seed into the per-line directory after a region is promoted
+        self.stats = OrderedDict([("accesses", 0), ("filtered", 0), ("line_tracked", 0), ("promotions", 0)])
+
+    def region_of(self, block):
+        return int(block, 16) // self.region_size
+
+    def access(self, block, vm_id, op):
+        """
+        Record an access and return True if it has to go through the per-line directory.
+        """
+        self.stats["accesses"] += 1
+        region_id = self.region_of(block)
+        region = self.regions.get(region_id)
+        if region is None:
+            region = self.regions[region_id] = {"state": "P", "owners": [vm_id], "lines": {}}
+        elif region["state"] == "S":
+            self.stats["line_tracked"] += 1
+            return True
+        elif vm_id not in region["owners"] or (op == "W" and region["state"] == "R"):
+            dirty = "M" in region["lines"].values()
+            if op == "R" and not dirty:
+                region["state"] = "R"
+                region["owners"].append(vm_id)
+            else:
+                self._promote(region_id, region)
+                self.stats["line_tracked"] += 1
+                return True
+
+        if op == "W":
+            region["lines"][block] = "M"
+        else:
+            region["lines"].setdefault(block, "S")
+        self.stats["filtered"] += 1
+        return False
+
+    def _promote(self, region_id, region):
+        """
+        The region became actively shared: hand every line it covered to the per-line directory.
+        """
+        for block, state in region["lines"].items():
+            owners = [region["owners"][0]] if state == "M" else list(region["owners"])
+            self.pending[block] = (state, owners)
+        region["state"] = "S"
+        region["lines"] = {}
+        self.stats["promotions"] += 1
+        LOG.emit(REGION_PROMOTE, address=hex(region_id * self.region_size))
+
+    def flush_into(self, directory):
+        for block, (state, owners) in self.pending.items():
+            directory.set_state(block, state, owners)
+        self.pending.clear()
+
+    def display_data(self):
+        for region_id, region in self.regions.items():
+            print(f"{hex(region_id * self.region_size)}: {region['state']} owners {region['owners']}")
+
+
+# Directory that counts the per-line operations the engines issue
+class CountingDirectory(Directory):
+    def __init__(self):
+        super().__init__()
+        self.operations = 0
+
+    def get_state(self, block):
+        self.operations += 1
+        return super().get_state(block)
+
+    def set_state(self, block, state, owners):
+        self.operations += 1
+        super().set_state(block, state, owners)
+
+    def invalidate_others(self, block, requester):
+        self.operations += 1
+        super().invalidate_others(block, requester)
+
+
+# Benchmark: private working sets, a read-only table and one actively shared region
+def run_region_benchmark(regions, vm_count=4, lines_per_region=32, rounds=4):
+    from directory_final_vm2 import DirectoryCoherence
+
+    directory = CountingDirectory()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        vms = [DirectoryCoherence(vm_id, directory, cache_size=lines_per_region,
+                                  cache_filename=os.path.join(cache_dir, f"cache_vm{vm_id}.json"), regions=regions)
+               for vm_id in range(1, vm_count + 1)]
+        table = [hex(0x100000 + line * 64) for line in range(lines_per_region)]
+        hot = [hex(0x200000 + line * 64) for line in range(4)]
+
+        for round_number in range(rounds):
+            for vm in vms:
+                for line in range(lines_per_region):
+                    block = hex(vm.vm_id * 0x10000 + line * 64)
+                    vm.write(block, f"Private{round_number}")
+                    vm.read(block)
+                for block in table:
+                    vm.read(block)
+                for block in hot:
+                    vm.write(block, f"Hot{vm.vm_id}")
+    return directory.operations
+
+
+if __name__ == "__main__":
+    baseline_ops = run_region_benchmark(None)
+    tracker = RegionTracker()
+    region_ops = run_region_benchmark(tracker)
+
+    print("\n--- Region tracking ---")
+    tracker.display_data()
+    for key, value in tracker.stats.items():
+        print(f"{key}: {value}")
+    print(f"Per-line directory operations without regions: {baseline_ops}")
+    print(f"Per-line directory operations with regions: {region_ops}")
+    print(f"Directory operations saved: {baseline_ops - region_ops}")
@@ -0,0 +1,234 @@
+import fcntl
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dax_mapping import DAXMapping, HUGE_PAGE_SIZE
+
+# Entry header: sequence word (odd while a writer is inside), payload length. Native formats, so the word
+# is loaded in one 8-byte access; standard-size ("<") formats read it a byte at a time and can see it torn.
+HEADER = struct.Struct("QI")
+SEQUENCE = struct.Struct("Q")
+LENGTH = struct.Struct("I")
+SLOT_SIZE = 256
+LINE_SIZE = 64
+LOCK_STRIPES = 64
+SPINS_BEFORE_YIELD = 64  # Busy retries before a reader starts yielding its CPU
+DEAD_WRITER_TIMEOUT = 1.0  # Seconds a sequence word may stay at one odd value before its writer is presumed dead
+
+
+def store_sequence(mm, start, value):
+    """
+    Store a sequence word in one 8-byte access. struct.pack_into zero-fills its target before packing,
+    so a writer preempted in between would publish version 0 to every other VM.
+    """
+    memoryview(mm)[start:start + SEQUENCE.size].cast("Q")[0] = value
+
+
+# One versioned entry in the shared region, guarded by a sequence word instead of a lock
+class VersionedEntry:
+    def __init__(self, mapping, offset, size, stats=None, claim_locks=None):
+        if offset % SEQUENCE.size:
+            raise ValueError(f"Entry at {offset:#x} is not aligned to its {SEQUENCE.size} byte sequence word.")
+        self.mapping = mapping
+        self.offset = offset
+        self.size = size
+        self.capacity = size - HEADER.size
+        self.stats = stats if stats is not None else OrderedDict([("reads", 0), ("read_retries", 0),
+                                                                  ("cas_success", 0), ("cas_failures", 0),
+                                                                  ("recoveries", 0)])
+        self.claim_locks = claim_locks if claim_locks is not None else [threading.Lock()]
+
+    def _claim_lock(self):
+        return self.claim_locks[(self.offset // self.size) % len(self.claim_locks)]
+
+    def read(self, dead_writer_timeout=DEAD_WRITER_TIMEOUT):
+        """
+        Return (version, payload). Retries while a writer is inside or if the entry changed under us,
+        yielding after a short spin. A word stuck at one odd value for dead_writer_timeout is recovered.
+        """
+        mm, start = self.mapping.window(self.offset)
+        self.stats["reads"] += 1
+        spins = 0
+        stuck, stuck_since = None, None
+        while True:
+            before, length = HEADER.unpack_from(mm, start)
+            if before & 1 == 0:
+                payload = mm[start + HEADER.size:start + HEADER.size + min(length, self.capacity)]
+                if SEQUENCE.unpack_from(mm, start)[0] == before:
+                    return before, payload
+            elif before != stuck:
+                stuck, stuck_since = before, time.perf_counter()
+            elif time.perf_counter() - stuck_since > dead_writer_timeout:
+                self.recover(stuck)
+            self.stats["read_retries"] += 1
+            spins += 1
+            if spins >= SPINS_BEFORE_YIELD:
+                time.sleep(0)
+
+    def recover(self, stuck):
+        """
+        Close the write of a writer that died inside the entry (word still at `stuck`) by publishing the
+        next even version. The payload is whatever that writer got to; entries that cannot tolerate a
+        partial payload must validate it (e.g. with a checksum).
+        """
+        mm, start = self.mapping.window(self.offset)
+        with self._claim_lock():
+            fcntl.lockf(self.mapping.fd, fcntl.LOCK_EX, SEQUENCE.size, self.offset)
+            try:
+                if SEQUENCE.unpack_from(mm, start)[0] != stuck:
+                    return False  # The writer finished or someone else recovered the entry
+                store_sequence(mm, start, stuck + 1)
+            finally:
+                fcntl.lockf(self.mapping.fd, fcntl.LOCK_UN, SEQUENCE.size, self.offset)
+        self.stats["recoveries"] += 1
+        return True
+
+    def version(self):
+        mm, start = self.mapping.window(self.offset)
+        return SEQUENCE.unpack_from(mm, start)[0]
+
+    def compare_and_swap(self, expected, payload):
+        """
+        Install payload only if the entry is still at version `expected`.
+        Python has no atomic instruction on mapped memory, so the claim of the sequence word
+        (even -> odd) is made atomic with a lock over that word alone; the payload copy and
+        every reader run without it.
+        """
+        if len(payload) > self.capacity:
+            raise ValueError(f"Payload of {len(payload)} bytes does not fit in a {self.capacity} byte entry.")
+        mm, start = self.mapping.window(self.offset)
+        with self._claim_lock():
+            fcntl.lockf(self.mapping.fd, fcntl.LOCK_EX, SEQUENCE.size, self.offset)
+            try:
+                current = SEQUENCE.unpack_from(mm, start)[0]
+                if current != expected or current & 1:
+                    self.stats["cas_failures"] += 1
+                    return False
+                store_sequence(mm, start, expected + 1)
+            finally:
+                fcntl.lockf(self.mapping.fd, fcntl.LOCK_UN, SEQUENCE.size, self.offset)
+        mm[start + HEADER.size:start + HEADER.size + len(payload)] = payload
+        LENGTH.pack_into(mm, start + SEQUENCE.size, len(payload))
+        store_sequence(mm, start, expected + 2)
+        self.stats["cas_success"] += 1
+        return True
+
+    def update(self, function):
+        """
+        Optimistic read-modify-write: apply function to the payload until the CAS lands.
+        """
+        while True:
+            version, payload = self.read()
+            result = function(payload)
+            if self.compare_and_swap(version, result):
+                return version + 2, result
+
+    def store(self, payload):
+        return self.update(lambda _: payload)
+
+
+def slot_offset(line, base=0, slot_size=SLOT_SIZE):
+    return base + line * slot_size
+
+
+def slot_layout(device, slots, base=0, slot_size=SLOT_SIZE):
+    """
+    Return the (device, offset, size) of every entry of a SeqlockTable. Given to the directory engine as its
+    shards, each line's directory entry is read and compare-and-swapped under its own sequence word,
+    and the table reads the same entries.
+    """
+    if HUGE_PAGE_SIZE % slot_size:
+        raise ValueError("Slot size must divide the mapping window so no entry spans two windows.")
+    return [(device, slot_offset(line, base, slot_size), slot_size) for line in range(slots)]
+
+
+# Direct-mapped table of versioned line entries: a line's entry sits at a computed offset
+class SeqlockTable:
+    def __init__(self, mapping, base=0, slot_size=SLOT_SIZE, slots=None):
+        if slot_size <= HEADER.size:
+            raise ValueError(f"Slot size must exceed the {HEADER.size} byte header.")
+        if HUGE_PAGE_SIZE % slot_size:
+            raise ValueError("Slot size must divide the mapping window so no entry spans two windows.")
+        self.mapping = mapping
+        self.base = base
+        self.slot_size = slot_size
+        self.slots = slots if slots is not None else (mapping.region_size - base) // slot_size
+        self.stats = OrderedDict([("reads", 0), ("read_retries", 0), ("cas_success", 0), ("cas_failures", 0),
+                                  ("recoveries", 0)])
+        self.claim_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self.entries = {}
+
+    def entry(self, address):
+        line = int(address, 16) // LINE_SIZE
+        if line >= self.slots:
+            raise ValueError(f"Address {address} is outside the {self.slots} line table.")
+        entry = self.entries.get(line)
+        if entry is None:
+            entry = self.entries[line] = VersionedEntry(self.mapping, slot_offset(line, self.base, self.slot_size),
+                                                        self.slot_size, self.stats, self.claim_locks)
+        return entry
+
+    def read(self, address):
+        return self.entry(address).read()
+
+    def compare_and_swap(self, address, expected, payload):
+        return self.entry(address).compare_and_swap(expected, payload)
+
+    def update(self, address, function):
+        return self.entry(address).update(function)
+
+
+def _increment(payload):
+    return str(int(payload or b"0") + 1).encode("utf-8")
+
+
+def _hammer(device, vm_id, lines, rounds, results):
+    """
+    One emulated VM: concurrent fetch-and-add on shared lines with no sleeps and no global lock.
+    """
+    table = SeqlockTable(DAXMapping(device), slots=lines)
+    for round_number in range(rounds):
+        table.update(hex((round_number % lines) * LINE_SIZE), _increment)
+    results.put((vm_id, dict(table.stats)))
+
+
+# Test Scenarios: several VM processes updating the same lines at full speed
+if __name__ == "__main__":
+    vm_count = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    lines, rounds = 8, 2000
+    with tempfile.TemporaryDirectory() as device_dir:
+        device = os.path.join(device_dir, "dax0.0")
+        with open(device, "wb") as file:
+            file.truncate(HUGE_PAGE_SIZE)
+
+        results = multiprocessing.Queue()
+        start = time.perf_counter()
+        workers = [multiprocessing.Process(target=_hammer, args=(device, vm_id, lines, rounds, results))
+                   for vm_id in range(1, vm_count + 1)]
+        for worker in workers:
+            worker.start()
+        stats = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        table = SeqlockTable(DAXMapping(device), slots=lines)
+        total = sum(int(table.read(hex(line * LINE_SIZE))[1]) for line in range(lines))
+        for vm_id, vm_stats in sorted(stats):
+            print(f"VM{vm_id}: {vm_stats}")
+        print(f"{vm_count * rounds} concurrent increments in {elapsed * 1000:.1f} ms, counted {total}")
+        print("No lost updates" if total == vm_count * rounds else "LOST UPDATES")
+
+        # A writer that dies after claiming the word leaves it odd; readers recover instead of spinning forever
+        entry = table.entry(hex(0))
+        mm, start = entry.mapping.window(entry.offset)
+        SEQUENCE.pack_into(mm, start, entry.version() + 1)
+        start = time.perf_counter()
+        version, payload = entry.read(dead_writer_timeout=0.05)
+        print(f"Dead writer recovered after {(time.perf_counter() - start) * 1000:.0f} ms: version {version}, "
+              f"payload {bytes(payload)}, {dict(table.stats)}")
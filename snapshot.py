@@ -0,0 +1,250 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from collections import Counter, OrderedDict
+from contextlib import redirect_stdout
+from itertools import accumulate
+from coherence_bus import CoherenceBus
+from mesif_coh import MESIFCoherence
+
+MAGIC = b"CXLSNAP4"
+HEADER = struct.Struct("<8sQIIII")  # magic, shared region bytes, caches, directory entries, hierarchies, stats length
+CACHE = struct.Struct("<IIQQI")  # vm_id, capacity, miss_count, total_count, entries
+HIERARCHY = struct.Struct("<II")  # vm_id, levels
+LEVEL = struct.Struct("<QQ")  # miss_count, total_count
+COLUMN = struct.Struct("<IQQ")  # values, text bytes, raw bytes
+TAG_NONE, TAG_STR, TAG_BYTES, TAG_INT = 0, 1, 2, 3
+
+
+def _pack_column(values):
+    """
+    Encode a column of values as tags, lengths (or integers), one UTF-8 text blob and one raw blob.
+    Columns decode with a handful of bulk copies instead of one struct call per field.
+    """
+    tags = bytearray()
+    lengths = array("q")
+    text = []
+    raw = []
+    for value in values:
+        if value is None:
+            tags.append(TAG_NONE)
+            lengths.append(0)
+        elif isinstance(value, int):
+            tags.append(TAG_INT)
+            lengths.append(value)
+        elif isinstance(value, str):
+            tags.append(TAG_STR)
+            lengths.append(len(value))
+            text.append(value)
+        else:
+            tags.append(TAG_BYTES)
+            lengths.append(len(value))
+            raw.append(bytes(value))
+    text = "".join(text).encode("utf-8")
+    raw = b"".join(raw)
+    return b"".join([COLUMN.pack(len(tags), len(text), len(raw)), bytes(tags), lengths.tobytes(), text, raw])
+
+
+def _unpack_column(view, offset):
+    count, text_length, raw_length = COLUMN.unpack_from(view, offset)
+    offset += COLUMN.size
+    tags = bytes(view[offset:offset + count])
+    offset += count
+    lengths = array("q")
+    lengths.frombytes(view[offset:offset + count * lengths.itemsize])
+    offset += count * lengths.itemsize
+    text = str(view[offset:offset + text_length], "utf-8")
+    offset += text_length
+    raw = bytes(view[offset:offset + raw_length])
+    offset += raw_length
+
+    if tags.count(TAG_STR) == count:
+        positions = list(accumulate(lengths, initial=0))
+        return [text[start:end] for start, end in zip(positions, positions[1:])], offset
+    values = []
+    text_position = raw_position = 0
+    for tag, length in zip(tags, lengths):
+        if tag == TAG_STR:
+            values.append(text[text_position:text_position + length])
+            text_position += length
+        elif tag == TAG_BYTES:
+            values.append(raw[raw_position:raw_position + length])
+            raw_position += length
+        elif tag == TAG_INT:
+            values.append(length)
+        else:
+            values.append(None)
+    return values, offset
+
+
+def _bus_stats(bus):
+    """
+    Counters and per-protocol bookkeeping that are not bulk data.
+    """
+    stats = {"traffic": bus.traffic}
+    if hasattr(bus, "pending"):
+        stats["pending"] = sorted([vm_id, address] for vm_id, address in bus.pending)
+    if hasattr(bus, "class_stats"):
+        stats["class_stats"] = bus.class_stats
+        stats["transitions"] = bus.transitions
+    stats["coherence"] = {
+        "protocol": bus.stats.protocol,
+        "vms": [[vm_id, counters] for vm_id, counters in bus.stats.vms.items()],
+        "hot_lines": [[address, count, bus.stats.hot_lines.errors[address]]
+                      for address, count in bus.stats.hot_lines.counts.items()],
+    }
+    stats["hierarchies"] = [[vm_id, hierarchy.stats] for vm_id, hierarchy in sorted(bus.hierarchies.items())]
+    return stats
+
+
+def _install_bus_stats(bus, stats):
+    bus.traffic.update(stats["traffic"])
+    if "pending" in stats:
+        bus.pending = {(vm_id, address) for vm_id, address in stats["pending"]}
+    if "class_stats" in stats:
+        for name, counters in stats["class_stats"].items():
+            bus.class_stats[name].update(counters)
+        bus.transitions.update(stats["transitions"])
+    coherence = stats["coherence"]
+    bus.stats.protocol = coherence["protocol"]
+    bus.stats.vms = OrderedDict((vm_id, Counter(counters)) for vm_id, counters in coherence["vms"])
+    bus.stats.hot_lines.counts = {address: count for address, count, _ in coherence["hot_lines"]}
+    bus.stats.hot_lines.errors = {address: error for address, _, error in coherence["hot_lines"]}
+    for vm_id, hierarchy_stats in stats["hierarchies"]:
+        bus.hierarchies[vm_id].stats.update(hierarchy_stats)
+
+
+def save_snapshot(path, bus, agents, directory=None):
+    """
+    Dump the shared region, every VM cache, the private levels of every attached CacheHierarchy and the
+    statistics to one binary file.
+    """
+    parts = []
+    for agent in agents:
+        cache = agent.lru_cache
+        parts.append(CACHE.pack(agent.vm_id, cache.capacity, cache.miss_count, cache.total_count, len(cache.cache)))
+        parts.append(_pack_column(list(cache.cache)))
+        parts.append(_pack_column([line[0] for line in cache.cache.values()]))
+        parts.append(_pack_column([line[1] for line in cache.cache.values()]))
+    entries = directory.directory if directory is not None else {}
+    parts.append(_pack_column(list(entries)))
+    parts.append(_pack_column([info["state"] for info in entries.values()]))
+    parts.append(_pack_column([len(info["owners"]) for info in entries.values()]))
+    parts.append(_pack_column([owner for info in entries.values() for owner in info["owners"]]))
+    for vm_id, hierarchy in sorted(bus.hierarchies.items()):
+        parts.append(HIERARCHY.pack(vm_id, len(hierarchy.levels)))
+        for level in hierarchy.levels:
+            parts.append(LEVEL.pack(level.miss_count, level.total_count))
+            parts.append(_pack_column(list(level.cache)))
+    stats = json.dumps(_bus_stats(bus)).encode("utf-8")
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, len(bus.memory), len(agents), len(entries), len(bus.hierarchies),
+                               len(stats)))
+        file.write(bus.memory)
+        file.write(b"".join(parts))
+        file.write(stats)
+    return os.path.getsize(path)
+
+
+def load_snapshot(path, bus, agents, directory=None):
+    """
+    Map a snapshot and install it into freshly built bus/agents/directory; nothing is replayed.
+    A VM saved with a CacheHierarchy must have one with the same levels attached before loading.
+    """
+    agents_by_id = {agent.vm_id: agent for agent in agents}
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        try:
+            magic, region_size, cache_count, _, hierarchy_count, stats_length = HEADER.unpack_from(view)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a coherence snapshot.")
+            if region_size > len(bus.memory):
+                raise ValueError(f"Snapshot region of {region_size} bytes does not fit the bus's {len(bus.memory)}.")
+            offset = HEADER.size
+
+            bus.memory[:region_size] = view[offset:offset + region_size]
+            offset += region_size
+
+            for _ in range(cache_count):
+                vm_id, capacity, miss_count, total_count, _ = CACHE.unpack_from(view, offset)
+                offset += CACHE.size
+                addresses, offset = _unpack_column(view, offset)
+                data, offset = _unpack_column(view, offset)
+                states, offset = _unpack_column(view, offset)
+                cache = agents_by_id[vm_id].lru_cache
+                cache.capacity, cache.miss_count, cache.total_count = capacity, miss_count, total_count
+                cache.cache = OrderedDict(zip(addresses, map(list, zip(data, states))))
+
+            blocks, offset = _unpack_column(view, offset)
+            states, offset = _unpack_column(view, offset)
+            owner_counts, offset = _unpack_column(view, offset)
+            owners, offset = _unpack_column(view, offset)
+            if directory is not None:
+                position = 0
+                for block, state, owner_count in zip(blocks, states, owner_counts):
+                    directory.set_state(block, state, owners[position:position + owner_count])
+                    position += owner_count
+
+            for _ in range(hierarchy_count):
+                vm_id, level_count = HIERARCHY.unpack_from(view, offset)
+                offset += HIERARCHY.size
+                hierarchy = bus.hierarchies.get(vm_id)
+                if hierarchy is None or len(hierarchy.levels) != level_count:
+                    raise ValueError(f"Snapshot has {level_count} private cache levels for VM{vm_id}; attach a "
+                                     f"CacheHierarchy with the same levels before loading it.")
+                for level in hierarchy.levels:
+                    level.miss_count, level.total_count = LEVEL.unpack_from(view, offset)
+                    addresses, offset = _unpack_column(view, offset + LEVEL.size)
+                    level.cache = OrderedDict.fromkeys(addresses)
+
+            stats = json.loads(bytes(view[offset:offset + stats_length]).decode("utf-8"))
+        finally:
+            view.release()
+
+    _install_bus_stats(bus, stats)
+
+
+# Test Scenarios: warm up once, then fork experiments from the snapshot
+if __name__ == "__main__":
+    from cache_hierarchy import CacheHierarchy, required_capacity
+
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bus = CoherenceBus()
+    vms = [MESIFCoherence(vm_id, bus, cache_size=max(lines // 2, required_capacity())) for vm_id in range(1, 5)]
+    agents = [CacheHierarchy(vm) for vm in vms[:2]] + vms[2:]  # Private levels in front of two of the VMs
+    for line in range(lines):
+        bus.store(line * 64, f"Data{line}".encode())
+
+    with open(os.devnull, "w") as quiet, redirect_stdout(quiet):
+        start = time.perf_counter()
+        for line in range(lines):
+            agents[line % 4].read(line * 64)
+            agents[(line + 1) % 4].read(line * 64)
+        warmup = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        path = os.path.join(snapshot_dir, "warm.snap")
+        size = save_snapshot(path, bus, vms)
+
+        start = time.perf_counter()
+        forked_bus = CoherenceBus()
+        forked = [MESIFCoherence(vm_id, forked_bus, cache_size=required_capacity() if vm_id <= 2 else 2)
+                  for vm_id in range(1, 5)]
+        for vm in forked[:2]:
+            CacheHierarchy(vm)
+        load_snapshot(path, forked_bus, forked)
+        restore = time.perf_counter() - start
+
+    same = (forked_bus.traffic == bus.traffic and forked_bus.stats.summary() == bus.stats.summary()
+            and all(OrderedDict(a.lru_cache.cache) == OrderedDict(b.lru_cache.cache) for a, b in zip(vms, forked))
+            and all(a.stats == b.stats and [OrderedDict(level.cache) for level in a.levels]
+                    == [OrderedDict(level.cache) for level in b.levels]
+                    for a, b in zip(agents[:2], [forked_bus.hierarchies[1], forked_bus.hierarchies[2]])))
+    print(f"Warm-up replay: {warmup * 1000:.1f} ms")
+    print(f"Snapshot: {size} bytes, restored in {restore * 1000:.1f} ms")
+    print("Restored state matches" if same else "Restored state DIFFERS")
@@ -0,0 +1,190 @@
+import argparse
+import gc
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from itertools import product
+from coh_daemon import PROTOCOLS
+from dax_mapping import DAXMapping
+from dax_shards import create_emulated_devices
+from snapshot import _pack_column, _unpack_column
+from workloads import WORKLOADS, drive
+
+MAGIC = b"CXLSWEEP"
+HEADER = struct.Struct("<8sII")  # magic, columns, rows
+DEVICE_SIZE = 16 * 1024 * 1024  # Emulated device per point, mapped whole as the bus's shared region
+HIT_NS = 2  # A local cache hit never crosses the link
+
+PARAMETERS = ["protocol", "cache_size", "ways", "vm_count", "workload", "link_latency_ns", "ops", "seed"]
+DEFAULTS = OrderedDict([("ways", 0), ("link_latency_ns", 250)])  # Parameters a grid may leave out
+METRICS = ["hits", "misses", "device_reads", "device_writes", "cache_to_cache", "invalidations", "upgrades",
+           "updates", "writebacks", "estimated_ns", "wall_us"]
+
+
+def code_version():
+    """
+    Hash of every module next to this one, so cached points are rerun once the simulator changes.
+    """
+    digest = hashlib.sha1()
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(source_dir)):
+        if name.endswith(".py"):
+            with open(os.path.join(source_dir, name), "rb") as file:
+                digest.update(name.encode("utf-8") + file.read())
+    return digest.hexdigest()[:16]
+
+
+CODE_VERSION = code_version()
+
+
+def point_key(point):
+    return hashlib.sha1(json.dumps([CODE_VERSION, point], sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def grid_points(grid, ops, seed=0):
+    """
+    Expand {parameter: [values]} into one point per combination.
+    """
+    names = [name for name in PARAMETERS if name in grid]
+    for values in product(*(grid[name] for name in names)):
+        point = OrderedDict(zip(names, values))
+        for name, value in DEFAULTS.items():
+            point.setdefault(name, value)
+        point["ops"] = ops
+        point["seed"] = seed
+        yield point
+
+
+def run_point(point):
+    """
+    Run one grid point in a fresh process with its own emulated device and return its metrics.
+    """
+    point = OrderedDict(DEFAULTS, **point)
+    bus_class, agent_class = PROTOCOLS[point["protocol"]]
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as device_dir:
+        device = create_emulated_devices(device_dir, 1, DEVICE_SIZE)[0]
+        mapping = DAXMapping(device, window_size=DEVICE_SIZE)
+        try:
+            bus = bus_class()
+            window, _ = mapping.window(0)
+            bus.memory = memoryview(window)[:len(bus.memory)]
+            agents = {}
+            for vm_id in range(1, point["vm_count"] + 1):
+                agents[vm_id] = agent_class(vm_id, bus, point["cache_size"])
+                agents[vm_id].lru_cache.ways = point["ways"] or None
+            workload = WORKLOADS[point["workload"]](point["ops"], vm_count=point["vm_count"], seed=point["seed"])
+            with open(os.devnull, "w") as quiet, redirect_stdout(quiet):
+                drive(agents, workload)
+            traffic = dict(bus.traffic)
+            counters = [dict(counters) for counters in bus.stats.vms.values()]
+        finally:
+            # Cached lines are views into the mapping; they must be gone before it can be unmapped
+            agents = bus = window = None
+            gc.collect()
+            mapping.close()
+    wall = time.perf_counter() - start
+
+    metrics = OrderedDict()
+    metrics["hits"] = sum(value for vm in counters for name, value in vm.items() if "_hit_" in name)
+    metrics["misses"] = sum(value for vm in counters for name, value in vm.items() if "_miss_" in name)
+    for name in ["device_reads", "device_writes", "cache_to_cache", "invalidations", "upgrades", "updates",
+                 "writebacks"]:
+        metrics[name] = traffic.get(name, 0)
+    # Link latency as a cost model: every message that crosses the link pays one round trip
+    link_messages = sum(metrics[name] for name in ["device_reads", "device_writes", "cache_to_cache",
+                                                   "invalidations", "upgrades", "updates"])
+    metrics["estimated_ns"] = metrics["hits"] * HIT_NS + link_messages * point["link_latency_ns"]
+    metrics["wall_us"] = int(wall * 1e6)
+    return metrics
+
+
+def run_sweep(grid, ops, cache_dir, workers=None, seed=0):
+    """
+    Run every point of the grid not already cached in cache_dir. Returns [(point, metrics)] in grid order.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    points = list(grid_points(grid, ops, seed))
+    results = {}
+    missing = []
+    for point in points:
+        path = os.path.join(cache_dir, f"{point_key(point)}.json")
+        if os.path.exists(path):
+            with open(path) as file:
+                results[point_key(point)] = json.load(file, object_pairs_hook=OrderedDict)
+        else:
+            missing.append(point)
+    print(f"{len(points)} points: {len(points) - len(missing)} cached, {len(missing)} to run")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for point, metrics in zip(missing, pool.map(run_point, missing)):
+            with open(os.path.join(cache_dir, f"{point_key(point)}.json"), "w") as file:
+                json.dump(metrics, file)
+            results[point_key(point)] = metrics
+    return [(point, results[point_key(point)]) for point in points]
+
+
+def save_results(path, results):
+    """
+    Write one column per parameter and metric, in the snapshot column encoding.
+    """
+    names = PARAMETERS + METRICS
+    columns = [[point.get(name, DEFAULTS.get(name)) for point, _ in results] for name in PARAMETERS]
+    columns += [[metrics[name] for _, metrics in results] for name in METRICS]
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, len(names), len(results)))
+        file.write(_pack_column(names))
+        file.write(b"".join(_pack_column(column) for column in columns))
+
+
+def load_results(path):
+    with open(path, "rb") as file:
+        view = memoryview(file.read())
+    magic, column_count, _ = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a sweep results file.")
+    names, offset = _unpack_column(view, HEADER.size)
+    results = OrderedDict()
+    for name in names:
+        results[name], offset = _unpack_column(view, offset)
+    return results
+
+
+def _values(text, cast=int):
+    return [cast(value) for value in text.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel parameter sweep over the coherence engines")
+    parser.add_argument("--protocols", type=lambda text: _values(text, str), default=sorted(PROTOCOLS))
+    parser.add_argument("--cache-sizes", type=_values, default=[16, 64])
+    parser.add_argument("--ways", type=_values, default=[0, 4], help="Lines per set, 0 for fully associative")
+    parser.add_argument("--vms", type=_values, default=[2, 4])
+    parser.add_argument("--workloads", type=lambda text: _values(text, str), default=["zipfian", "migratory"])
+    parser.add_argument("--latencies", type=_values, default=[250], help="Link latency in ns")
+    parser.add_argument("--ops", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache-dir", default=os.path.join(tempfile.gettempdir(), "cxl_sweep_cache"))
+    parser.add_argument("--output", default=os.path.join(tempfile.gettempdir(), "cxl_sweep_results.bin"))
+    args = parser.parse_args()
+
+    grid = {"protocol": args.protocols, "cache_size": args.cache_sizes, "ways": args.ways, "vm_count": args.vms,
+            "workload": args.workloads, "link_latency_ns": args.latencies}
+    start = time.perf_counter()
+    results = run_sweep(grid, args.ops, args.cache_dir, args.workers)
+    save_results(args.output, results)
+    print(f"Sweep finished in {time.perf_counter() - start:.1f} s, results in {args.output}")
+
+    columns = load_results(args.output)
+    print(f"\n{'protocol':<10}{'cache':>6}{'ways':>5}{'vms':>4} {'workload':<12}{'hit rate':>9}{'est. ms':>9}")
+    for row in range(len(columns["protocol"])):
+        accesses = columns["hits"][row] + columns["misses"][row]
+        print(f"{columns['protocol'][row]:<10}{columns['cache_size'][row]:>6}{columns['ways'][row]:>5}"
+              f"{columns['vm_count'][row]:>4} {columns['workload'][row]:<12}"
+              f"{columns['hits'][row] / max(accesses, 1):>9.3f}{columns['estimated_ns'][row] / 1e6:>9.3f}")
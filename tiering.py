@@ -0,0 +1,202 @@
+import sys
+from collections import Counter, OrderedDict
+
+PAGE_SIZE = 4096
+CXL_NS = 250.0  # Load from the CXL region
+DRAM_NS = 90.0  # Load from the VM's local DRAM
+PEER_DRAM_NS = 2 * CXL_NS  # A page another VM promoted is reached through that VM's host
+EPOCH_ACCESSES = 4096  # Memory accesses between migration decisions
+PROMOTE_THRESHOLD = 8  # Decayed accesses that make a page hot
+DEMOTE_THRESHOLD = 2  # A promoted page at or below this is cold
+DRAM_PAGES = 64  # Local DRAM pages per VM
+MIGRATION_BANDWIDTH = 32 * PAGE_SIZE  # Bytes that may be migrated per epoch
+SHARED = 0  # Accessor of a page more than one VM touched this epoch
+
+
+# Two-tier placement of the shared region: CXL far memory, or one VM's local DRAM
+# Pages are tracked from the accesses that reach memory (cache misses and writebacks),
+# counted per epoch with decay, and migrated between epochs within a bandwidth budget.
+# Only a page a single VM touches is promoted; one that becomes shared goes back to CXL.
+class TieredMemory:
+    def __init__(self, dram_pages=DRAM_PAGES, promote_threshold=PROMOTE_THRESHOLD, demote_threshold=DEMOTE_THRESHOLD,
+                 epoch_accesses=EPOCH_ACCESSES, migration_bandwidth=MIGRATION_BANDWIDTH, page_size=PAGE_SIZE,
+                 cxl_ns=CXL_NS, dram_ns=DRAM_NS, peer_dram_ns=PEER_DRAM_NS):
+        if demote_threshold >= promote_threshold:
+            raise ValueError("The demote threshold must be below the promote threshold.")
+        self.dram_pages = dram_pages
+        self.promote_threshold = promote_threshold
+        self.demote_threshold = demote_threshold
+        self.epoch_accesses = epoch_accesses
+        self.migration_pages = migration_bandwidth // page_size
+        self.page_size = page_size
+        self.cxl_ns = cxl_ns
+        self.dram_ns = dram_ns
+        self.peer_dram_ns = peer_dram_ns
+        self.heat = {}  # page -> decayed access count
+        self.accessor = {}  # page -> the one VM that touched it this epoch, or SHARED
+        self.home = {}  # page -> VM whose DRAM holds it; pages not listed live in the CXL region
+        self.resident = Counter()  # vm_id -> pages in its DRAM
+        self.pending = 0
+        self.stats = OrderedDict([("accesses", 0), ("dram", 0), ("peer_dram", 0), ("cxl", 0), ("total_ns", 0.0),
+                                  ("promotions", 0), ("demotions", 0), ("migration_bytes", 0), ("epochs", 0),
+                                  ("throttled", 0)])
+
+    def attach(self, bus):
+        """
+        Wrap the bus's device accesses so every line that reaches memory is placed and charged here.
+        """
+        read_memory, write_memory = bus.read_memory, bus.write_memory
+
+        def tiered_read(vm_id, address):
+            self.access(vm_id, address)
+            return read_memory(vm_id, address)
+
+        def tiered_write(vm_id, address, data):
+            self.access(vm_id, address)
+            return write_memory(vm_id, address, data)
+
+        bus.read_memory, bus.write_memory = tiered_read, tiered_write
+        bus.tiers = self
+        return bus
+
+    def access(self, vm_id, address):
+        page = address // self.page_size
+        self.heat[page] = self.heat.get(page, 0) + 1
+        accessor = self.accessor.get(page)
+        if accessor is None:
+            self.accessor[page] = vm_id
+        elif accessor != vm_id:
+            self.accessor[page] = SHARED
+
+        home = self.home.get(page)
+        if home is None:
+            self.stats["cxl"] += 1
+            self.stats["total_ns"] += self.cxl_ns
+        elif home == vm_id:
+            self.stats["dram"] += 1
+            self.stats["total_ns"] += self.dram_ns
+        else:
+            self.stats["peer_dram"] += 1
+            self.stats["total_ns"] += self.peer_dram_ns
+        self.stats["accesses"] += 1
+        self.pending += 1
+        if self.pending >= self.epoch_accesses:
+            self.migrate()
+
+    def _move(self, page, vm_id):
+        home = self.home.pop(page, None)
+        if home is not None:
+            self.resident[home] -= 1
+            self.stats["demotions"] += 1
+        if vm_id is not None:
+            self.home[page] = vm_id
+            self.resident[vm_id] += 1
+            self.stats["promotions"] += 1
+        self.stats["migration_bytes"] += self.page_size
+
+    def migrate(self):
+        """
+        End the epoch: demote cold and newly shared pages, promote hot private ones, then decay.
+        """
+        budget = self.migration_pages
+        # Demotions first, so promotions can use the room they free
+        demote = sorted((page for page, home in self.home.items()
+                         if self.accessor.get(page, home) != home
+                         or self.heat.get(page, 0) <= self.demote_threshold),
+                        key=lambda page: self.heat.get(page, 0))
+        for page in demote:
+            if budget == 0:
+                self.stats["throttled"] += 1
+                continue
+            self._move(page, None)
+            budget -= 1
+
+        promote = sorted((page for page, heat in self.heat.items() if heat >= self.promote_threshold
+                          and page not in self.home and self.accessor.get(page, SHARED) != SHARED),
+                         key=lambda page: self.heat[page], reverse=True)
+        for page in promote:
+            vm_id = self.accessor[page]
+            if self.resident[vm_id] >= self.dram_pages:
+                # DRAM full: swap with the VM's coldest page, if the candidate is clearly hotter
+                residents = [resident for resident, home in self.home.items() if home == vm_id]
+                if not residents:
+                    continue
+                coldest = min(residents, key=lambda resident: self.heat.get(resident, 0))
+                if self.heat.get(coldest, 0) * 2 > self.heat[page]:
+                    continue
+                if budget < 2:
+                    self.stats["throttled"] += 1
+                    continue
+                self._move(coldest, None)
+                budget -= 1
+            elif budget == 0:
+                self.stats["throttled"] += 1
+                continue
+            self._move(page, vm_id)
+            budget -= 1
+
+        for page in list(self.heat):
+            heat = self.heat[page] // 2
+            if heat or page in self.home:
+                self.heat[page] = heat
+            else:
+                del self.heat[page]
+        self.accessor.clear()
+        self.pending = 0
+        self.stats["epochs"] += 1
+
+    def report(self):
+        """
+        Average memory access latency against every access going to CXL, plus migration traffic.
+        """
+        accesses = self.stats["accesses"]
+        average = self.stats["total_ns"] / accesses if accesses else 0.0
+        report = OrderedDict()
+        report["accesses"] = accesses
+        report["dram_fraction"] = self.stats["dram"] / accesses if accesses else 0.0
+        report["avg_ns"] = average
+        report["baseline_ns"] = self.cxl_ns
+        report["speedup"] = self.cxl_ns / average if average else 1.0
+        report["promotions"] = self.stats["promotions"]
+        report["demotions"] = self.stats["demotions"]
+        report["migration_bytes"] = self.stats["migration_bytes"]
+        report["migration_bytes_per_access"] = self.stats["migration_bytes"] / accesses if accesses else 0.0
+        report["throttled"] = self.stats["throttled"]
+        return report
+
+
+def run_tiered(workload, tiers=None, vm_count=4, cache_size=64):
+    from coherence_bus import CoherenceBus
+    from mesif_coh import MESIFCoherence
+    from workloads import drive
+
+    bus = CoherenceBus()
+    tiers = tiers or TieredMemory()
+    tiers.attach(bus)
+    agents = {vm_id: MESIFCoherence(vm_id, bus, cache_size=cache_size) for vm_id in range(1, vm_count + 1)}
+    drive(agents, workload)
+    return tiers
+
+
+# Benchmark: latency and migration traffic by DRAM size and bandwidth budget, against all-CXL
+if __name__ == "__main__":
+    from workloads import partitioned
+
+    ops = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    configurations = [
+        ("all-CXL", dict(dram_pages=0)),
+        ("16 pages/VM", dict(dram_pages=16)),
+        ("64 pages/VM", dict(dram_pages=64)),
+        ("64 pages/VM, 4 page/epoch", dict(dram_pages=64, migration_bandwidth=4 * PAGE_SIZE)),
+        ("256 pages/VM", dict(dram_pages=256)),
+    ]
+    # Every workload needs private hot pages: a page more than one VM touches is never promoted,
+    # so a fully shared workload (zipfian over one region) only ever measures all-CXL
+    for shared_fraction in [0.1, 0.5]:
+        print(f"\n--- partitioned, {shared_fraction:.0%} of accesses shared ---")
+        for label, options in configurations:
+            workload = partitioned(ops, shared_fraction=shared_fraction, seed=42)
+            report = run_tiered(workload, TieredMemory(**options)).report()
+            print(f"{label:<26} avg={report['avg_ns']:6.1f} ns speedup={report['speedup']:.2f}x "
+                  f"DRAM={report['dram_fraction']:.2f} promotions={report['promotions']:<5} "
+                  f"demotions={report['demotions']:<5} migrated={report['migration_bytes'] // 1024} KB")
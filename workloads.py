@@ -0,0 +1,233 @@
+import os
+import random
+import sys
+import time
+from contextlib import redirect_stdout
+from bisect import bisect
+from itertools import accumulate, chain, islice
+
+LINE_SIZE = 64
+BASE_ADDRESS = 0x100000
+BATCH = 65536  # Ops drawn per batch; all per-op work below runs inside C iterators
+TABLE_SIZE = 1 << 16  # Distributions are quantised into this many slots and drawn with 16-bit random indices
+
+
+def _addresses(lines, base=BASE_ADDRESS):
+    return [base + line * LINE_SIZE for line in range(lines)]
+
+
+def _table(population, weights=None):
+    """
+    Quantise a distribution over population into TABLE_SIZE slots, so a draw is one lookup.
+    """
+    if len(population) > TABLE_SIZE:
+        raise ValueError(f"At most {TABLE_SIZE} outcomes can be drawn from a table, got {len(population)}.")
+    if weights is None:
+        return [population[index * len(population) // TABLE_SIZE] for index in range(TABLE_SIZE)]
+    cum_weights = list(accumulate(weights))
+    total = cum_weights[-1]
+    return [population[min(bisect(cum_weights, (index + 0.5) * total / TABLE_SIZE), len(population) - 1)]
+            for index in range(TABLE_SIZE)]
+
+
+def _draw(rng, table, count):
+    return map(table.__getitem__, memoryview(rng.randbytes(2 * count)).cast("H"))
+
+
+def _stream(ops, batch):
+    """
+    Chain per-batch iterators: Python runs once per batch, never once per op.
+    """
+    return islice(chain.from_iterable(batch(min(BATCH, ops - done)) for done in range(0, ops, BATCH)), ops)
+
+
+def _accesses(vm_count, lines, write_fraction, line_weights=None, address_of=None):
+    """
+    Every (vm_id, op, address) combination with its probability; the tuples themselves are what gets yielded.
+    """
+    combos = []
+    weights = []
+    for vm_id in range(1, vm_count + 1):
+        for op, op_weight in (("R", 1.0 - write_fraction), ("W", write_fraction)):
+            for line in range(lines):
+                combos.append((vm_id, op, address_of(vm_id, line)))
+                weights.append(op_weight * (1.0 if line_weights is None else line_weights[line]))
+    return combos, weights
+
+
+def uniform(ops, vm_count=4, lines=1024, write_fraction=0.3, seed=0):
+    """
+    Every VM touches every line with equal probability.
+    """
+    rng = random.Random(seed)
+    addresses = _addresses(lines)
+    if vm_count * 2 * lines <= TABLE_SIZE:
+        table = _table(*_accesses(vm_count, lines, write_fraction, address_of=lambda vm_id, line: addresses[line]))
+        return _stream(ops, lambda count: _draw(rng, table, count))
+    vms = _table(range(1, vm_count + 1))
+    op_table = _table(("R", "W"), (1.0 - write_fraction, write_fraction))
+    return _stream(ops, lambda count: zip(_draw(rng, vms, count), _draw(rng, op_table, count),
+                                          rng.choices(addresses, k=count)))
+
+
+def zipfian(ops, vm_count=4, lines=1024, write_fraction=0.3, theta=0.99, seed=0):
+    """
+    Hot-set access: line rank r is drawn with probability proportional to 1 / r**theta.
+    """
+    rng = random.Random(seed)
+    addresses = _addresses(lines)
+    rng.shuffle(addresses)  # Hot lines are spread over the region, not packed at the start
+    weights = [1.0 / (rank ** theta) for rank in range(1, lines + 1)]
+    vms = _table(range(1, vm_count + 1))
+    op_table = _table(("R", "W"), (1.0 - write_fraction, write_fraction))
+    if lines <= TABLE_SIZE // 16:
+        # Small hot sets fit the quantised table with room to spare even for the coldest ranks
+        line_table = _table(addresses, weights)
+        return _stream(ops, lambda count: zip(_draw(rng, vms, count), _draw(rng, op_table, count),
+                                              _draw(rng, line_table, count)))
+    cum_weights = list(accumulate(weights))
+    return _stream(ops, lambda count: zip(_draw(rng, vms, count), _draw(rng, op_table, count),
+                                          rng.choices(addresses, cum_weights=cum_weights, k=count)))
+
+
+def producer_consumer(ops, vm_count=4, lines=64, write_fraction=None, seed=0):
+    """
+    VM1 writes a line, then every other VM reads it. write_fraction is fixed by the pattern.
+    """
+    rng = random.Random(seed)
+    rounds = [((1, "W", address),) + tuple((vm_id, "R", address) for vm_id in range(2, vm_count + 1))
+              for address in _addresses(lines)]
+    table = _table(rounds)
+    return _stream(ops, lambda count: chain.from_iterable(_draw(rng, table, count // vm_count + 1)))
+
+
+def migratory(ops, vm_count=4, lines=64, write_fraction=None, seed=0):
+    """
+    Each line moves VM to VM: the holder reads it, updates it and the next VM takes over.
+    """
+    rng = random.Random(seed)
+    addresses = _addresses(lines)
+    holders = [0] * lines
+    while ops > 0:
+        for line in rng.choices(range(lines), k=BATCH):
+            vm_id = holders[line] % vm_count + 1
+            holders[line] += 1
+            yield vm_id, "R", addresses[line]
+            if ops == 1:
+                return
+            yield vm_id, "W", addresses[line]
+            ops -= 2
+            if ops <= 0:
+                return
+
+
+def broadcast(ops, vm_count=4, lines=256, write_fraction=0.01, seed=0):
+    """
+    Read-mostly shared data: every VM reads, VM1 occasionally rewrites a line.
+    """
+    rng = random.Random(seed)
+    addresses = _addresses(lines)
+    combos, weights = _accesses(vm_count, lines, write_fraction, address_of=lambda vm_id, line: addresses[line])
+    weights = [0.0 if op == "W" and vm_id != 1 else weight * (vm_count if op == "W" else 1)
+               for (vm_id, op, _), weight in zip(combos, weights)]
+    table = _table(combos, weights)
+    return _stream(ops, lambda count: _draw(rng, table, count))
+
+
+def false_sharing(ops, vm_count=4, lines=16, write_fraction=0.5, seed=0, field_size=8):
+    """
+    Each VM owns its own field_size bytes, but the fields of all VMs sit in the same lines.
+    """
+    rng = random.Random(seed)
+    if vm_count * field_size > LINE_SIZE:
+        raise ValueError(f"{vm_count} fields of {field_size} bytes do not fit in a {LINE_SIZE} byte line.")
+    table = _table(*_accesses(vm_count, lines, write_fraction, address_of=lambda vm_id, line:
+                                  BASE_ADDRESS + line * LINE_SIZE + (vm_id - 1) * field_size))
+    return _stream(ops, lambda count: _draw(rng, table, count))
+
+
+def lock_contention(ops, vm_count=4, lines=4, write_fraction=None, seed=0, spins=3):
+    """
+    VMs spin on a few lock lines (reads), then acquire (write), touch the data line and release (write).
+    """
+    rng = random.Random(seed)
+    locks = _addresses(lines)
+    data = _addresses(lines, BASE_ADDRESS + lines * LINE_SIZE)
+    sections = [((vm_id, "R", locks[lock]),) * spins
+                + ((vm_id, "W", locks[lock]), (vm_id, "W", data[lock]), (vm_id, "W", locks[lock]))
+                for vm_id in range(1, vm_count + 1) for lock in range(lines)]
+    table = _table(sections)
+    return _stream(ops, lambda count: chain.from_iterable(_draw(rng, table, count // (spins + 3) + 1)))
+
+
+def partitioned(ops, vm_count=4, lines=32768, write_fraction=0.3, shared_fraction=0.1, theta=0.99, seed=0,
+                page_lines=64):
+    """
+    Each VM works in its own slice of the region, plus one slice every VM shares (shared_fraction of
+    accesses). Within a slice, pages of page_lines lines are drawn zipfian, so every slice has hot pages.
+    """
+    rng = random.Random(seed)
+    slice_lines = lines // (vm_count + 1)
+    pages = slice_lines // page_lines
+    if pages == 0:
+        raise ValueError(f"{lines} lines leave no {page_lines} line page per slice for {vm_count} VMs.")
+    order = list(range(pages))
+    rng.shuffle(order)  # Hot pages are spread over each slice, not packed at its start
+    offsets = [order[page] * page_lines * LINE_SIZE + line * LINE_SIZE
+               for page in range(pages) for line in range(page_lines)]
+    cum_weights = list(accumulate(1.0 / ((rank // page_lines + 1) ** theta) for rank in range(len(offsets))))
+    slices = [(vm_id, op, BASE_ADDRESS + (vm_id if private else 0) * slice_lines * LINE_SIZE)
+              for vm_id in range(1, vm_count + 1) for op in ("R", "W") for private in (True, False)]
+    table = _table(slices, [(write_fraction if op == "W" else 1.0 - write_fraction)
+                            * (1.0 - shared_fraction if base != BASE_ADDRESS else shared_fraction)
+                            for vm_id, op, base in slices])
+    return _stream(ops, lambda count: ((vm_id, op, base + offset) for (vm_id, op, base), offset in
+                                       zip(_draw(rng, table, count),
+                                           rng.choices(offsets, cum_weights=cum_weights, k=count))))
+
+
+WORKLOADS = {
+    "uniform": uniform,
+    "zipfian": zipfian,
+    "producer_consumer": producer_consumer,
+    "migratory": migratory,
+    "broadcast": broadcast,
+    "false_sharing": false_sharing,
+    "lock_contention": lock_contention,
+    "partitioned": partitioned,
+}
+
+
+def drive(agents, workload):
+    """
+    Feed a workload stream into agents keyed by vm_id. Returns the number of ops issued.
+    """
+    payloads = {vm_id: f"VM{vm_id}".encode() for vm_id in agents}
+    count = 0
+    for vm_id, op, address in workload:
+        if op == "R":
+            agents[vm_id].read(address)
+        else:
+            agents[vm_id].write(address, payloads[vm_id])
+        count += 1
+    return count
+
+
+# Benchmark: generation rate per pattern, then a short run through MESIF
+if __name__ == "__main__":
+    from coherence_bus import CoherenceBus
+    from mesif_coh import MESIFCoherence
+
+    ops = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    for name, workload in WORKLOADS.items():
+        start = time.perf_counter()
+        count = sum(1 for _ in workload(ops, seed=42))
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {count / elapsed / 1e6:.2f} M ops/s")
+
+    bus = CoherenceBus()
+    agents = {vm_id: MESIFCoherence(vm_id, bus, cache_size=64) for vm_id in range(1, 5)}
+    with open(os.devnull, "w") as quiet, redirect_stdout(quiet):
+        drive(agents, zipfian(20000, seed=42))
+    print("\n--- MESIF on zipfian ---")
+    bus.display_traffic()